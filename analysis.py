@@ -0,0 +1,150 @@
+import argparse
+import json
+import math
+import numpy as np
+from prettytable import PrettyTable
+from model import NetworkModel, compile_model, load
+
+
+def erlang_c(servers: int, offered_load: float) -> float:
+    """
+    Probability that an arrival has to wait in an M/M/c queue with offered
+    load a = lambda / mu, computed from the stable Erlang B recursion
+    """
+    if offered_load <= 0:
+        return 0.0
+    if offered_load >= servers:
+        return 1.0
+    b = 1.0
+    for k in range(1, servers + 1):
+        b = offered_load * b / (k + offered_load * b)
+    return servers * b / (servers - offered_load * (1 - b))
+
+
+def mmc_metrics(arrival_rate: float, service_rate: float, servers: int) -> dict:
+    """
+    Exact steady-state M/M/c metrics, times in the unit of 1 / rate.
+    Unstable queues (rho >= 1) get infinite L, Lq, W and Wq.
+    """
+    offered_load = arrival_rate / service_rate
+    rho = offered_load / servers
+    if rho >= 1:
+        return {"rho": rho, "p_wait": 1.0, "L": math.inf, "Lq": math.inf,
+                "W": math.inf, "Wq": math.inf}
+    p_wait = erlang_c(servers, offered_load)
+    lq = p_wait * rho / (1 - rho)
+    wq = lq / arrival_rate if arrival_rate > 0 else 0.0
+    return {
+        "rho": rho,
+        "p_wait": p_wait,
+        "L": lq + offered_load,
+        "Lq": lq,
+        "W": wq + 1 / service_rate,
+        "Wq": wq,
+    }
+
+
+def solve_traffic(dat: dict, workload: dict) -> tuple[list[str], np.ndarray]:
+    """
+    Per-node arrival rates (per second) from the traffic equations
+    lambda = gamma + lambda P, external arrivals entering at the dispatcher
+    """
+    model = compile_model(dat, workload, require_stable=False)
+    return list(model.names), model.arrival_rates
+
+
+def analyze(model: NetworkModel) -> dict:
+    """
+    Jackson-network prediction per node and for the whole factory, rates
+    per hour and times in hours like the simulation reports
+    """
+    nodes = {}
+    for i, name in enumerate(model.names):
+        # plain floats, so the result stays JSON serializable
+        arrival_rate = float(model.arrival_rates[i])
+        # the rate with the minimum service clamp, as the stability check takes it
+        service_rate = float(model.effective_service_rates[i])
+        servers = int(model.servers[i])
+        metrics = mmc_metrics(arrival_rate, service_rate, servers)
+        nodes[name] = {
+            "arrival_rate": arrival_rate * 3600,
+            "service_rate": service_rate * 3600,
+            "servers": servers,
+            "utilization": metrics["rho"],
+            "p_wait": metrics["p_wait"],
+            "avg_products_in_node": metrics["L"],
+            "avg_products_in_queue": metrics["Lq"],
+            "avg_response_time": metrics["W"] / 3600,
+            "avg_wait_time": metrics["Wq"] / 3600,
+            "stable": metrics["rho"] < 1,
+        }
+
+    external_rate = model.external_rate * 3600
+    avg_products_in_sys = sum(n["avg_products_in_node"] for n in nodes.values())
+    bottlenecks = sorted(nodes, key=lambda name: nodes[name]["utilization"],
+                         reverse=True)
+    return {
+        "nodes": nodes,
+        "system": {
+            "avg_products_in_sys": avg_products_in_sys,
+            "avg_sys_response_time": avg_products_in_sys / external_rate,
+            "stable": all(n["stable"] for n in nodes.values()),
+        },
+        "unstable": [name for name in bottlenecks if not nodes[name]["stable"]],
+        "bottlenecks": bottlenecks,
+    }
+
+
+def json_ready(value):
+    """
+    value with infinite and nan floats as None, the L and W of unstable
+    nodes are not numbers JSON can hold
+    """
+    if isinstance(value, dict):
+        return {k: json_ready(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [json_ready(v) for v in value]
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+
+def print_analysis(result: dict):
+    print(
+        f"------------------------\nJackson network analysis (M/M/c)\n------------------------")
+    columns = ["arrival_rate", "service_rate", "servers", "utilization", "p_wait",
+               "avg_products_in_node", "avg_products_in_queue",
+               "avg_response_time", "avg_wait_time"]
+    tb = PrettyTable(["rank", "node_name"] + columns + ["status"])
+    for rank, name in enumerate(result["bottlenecks"], start=1):
+        node = result["nodes"][name]
+        tb.add_row([rank, name] + [round(node[c], 4) for c in columns]
+                   + ["ok" if node["stable"] else "UNSTABLE"])
+    print(tb)
+    for name, value in result["system"].items():
+        if name != "stable":
+            print(f"{name} = {round(value, 4)}")
+    if len(result["unstable"]) > 0:
+        print(f"UNSTABLE nodes (utilization >= 1): {', '.join(result['unstable'])}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Predict the factory's steady state from the traffic equations and Erlang C")
+    parser.add_argument("workload", help="path to the workload file")
+    parser.add_argument("--config", default="./config.json",
+                        help="path to the network config file")
+    parser.add_argument("--json", action="store_true",
+                        help="print the result as JSON instead of a table")
+    args = parser.parse_args()
+
+    try:
+        model = load(config_path=args.config, workload_path=args.workload,
+                     require_stable=False)
+    except ValueError as e:
+        parser.exit(2, f"error: {e}\n")
+    result = analyze(model)
+    if args.json:
+        print(json.dumps(json_ready(result), indent=2, allow_nan=False))
+    else:
+        print_analysis(result)
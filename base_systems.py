@@ -1,17 +1,20 @@
 import simpy as sp
-from params import ServerParams, SystemParams, SIM_DURATION
-from product import Product, ProductStatistics
+from params import ServerParams, SystemParams, RoutingParams, MIN_SERVICE_TIME
+from product import Product
 from servers import  ProductServer
 from qs import Queue
-from system_stats import SystemStatistics
-from simpy.resources.resource import Request
+from system_stats import SystemStatistics, SojournStatistics
+from streams import RandomStreams
+from routing import Router, AliasTable, LoadIndex, build_router
 from typing import Tuple
+from instrument import NodeCounters, timed
 
 
 class SystemScheduleResult:
     FOUND_PRODUCT = 1,
     NO_PRODUCT = 2,
     NO_SERVER = 3,
+    FOUND_BATCH = 4,
 
 
 class System:
@@ -20,60 +23,167 @@ class System:
         env: sp.Environment,
         params: SystemParams,
         server_params: ServerParams,
+        streams: RandomStreams,
     ) -> None:
         self.env = env
         self.params = params
         self.server_params = server_params
-        self.queue = Queue()
-        self.available_servers = sp.Resource(
-            self.env, capacity=params.max_servers)
+        if server_params.service is None:
+            self.service_stream = streams.exponential(
+                node=params.name,
+                purpose="service",
+                mean=server_params.mean_service_time,
+                minimum=MIN_SERVICE_TIME,
+            )
+        else:
+            self.service_stream = streams.service(node=params.name, params=server_params.service)
+        self.routing_stream = streams.uniform(
+            node=params.name,
+            purpose="routing",
+        )
+        self.queue = Queue(params=params.queue)
+        self.space_event: sp.Event = None
+        self.busy_servers = 0
         self.stats = SystemStatistics(system_name=self.params.name)
-        self.active_proc = None
-        self.idle_proc = None
-        self.is_idle = True
+        # schedule() waits on this event when there is nothing to start
+        self.wakeup: sp.Event = None
+        self.idle_since: float = 0.0
         self.prev_arrival = 0.0
-
-        # MMN0208: server utilization
-        self.servers_usage = []
-        self.queue_length = []
-        self.current_in_sys = []
+        # shared by every system of the factory, fed when a product exits
+        self.sojourn: SojournStatistics = None
+        # event counters and phase timers, None unless the run is instrumented
+        self.counters: NodeCounters = None
+        self.destinations: list = []
+        self.router: Router = None
+        # products per node for load-aware routing, None when every node routes by probability
+        self.load_index: LoadIndex = None
+        # batch service: a batch opens with its first product and is due when
+        # full or when its timeout fires, batch_seq tells stale timers apart
+        self.batch = params.batch
+        self.batch_open = False
+        self.batch_due = False
+        self.batch_seq = 0
 
     def get_stats(self) -> SystemStatistics:
         return self.stats
 
     # MMN0208: server utilization
-    def _monitor(self):
-        while True:
-            self.servers_usage.append(self.available_servers.count)
-            self.queue_length.append(self.queue.__len__())
-            yield self.env.timeout(0.25)
+    def monitor(self, resolution: float, duration: float):
+        """
+        Keep servers usage and queue length sampled every resolution seconds,
+        in stats.busy_servers.series and stats.queue_length.series
+        """
+        self.stats.sample(resolution=resolution, duration=duration)
 
     def get_name(self) -> str:
         return self.params.name
 
-    def add_product(self, product: Product):
+    def set_sojourn_statistics(self, sojourn: SojournStatistics):
+        self.sojourn = sojourn
+
+    def set_destinations(self, destinations: list, table: AliasTable = None,
+                         nodes: list[int] = None, policy: RoutingParams = None):
+        """
+        Route finished products among destinations, with the model's alias
+        table of their probabilities when given. A load-aware policy reads
+        the load index of the destination nodes.
+        """
+        self.destinations = destinations
+        self.router = build_router(destinations=destinations, stream=self.routing_stream,
+                                   nodes=nodes, params=policy, index=self.load_index,
+                                   table=table)
+
+    def track_load(self, index: LoadIndex):
+        self.load_index = index
+
+    def instrument(self, counters: NodeCounters):
+        self.counters = counters
+
+    def _start(self, generator, phase: str) -> sp.Process:
+        # start a process, timing it as schedule or serve when instrumented
+        if self.counters is not None:
+            generator = timed(generator, self.counters, phase)
+        return self.env.process(generator)
+
+    def _exit(self, product: Product):
+        # the product leaves the factory after its service here
+        if self.sojourn is not None:
+            self.sojourn.record_exit(product=product, now=self.env.now)
+        if self.counters is not None:
+            self.counters.exits += 1
+
+    def add_product(self, product: Product) -> bool:
+        """
+        Admit a product, returns False when the queue is full and blocks
+        """
+        if self.queue.is_full():
+            if self.queue.params.on_full == "block":
+                if self.counters is not None:
+                    self.counters.blocked += 1
+                return False
+            # balk: the product leaves the factory
+            self.stats.update_balked()
+            if self.counters is not None:
+                self.counters.balked += 1
+            return True
+
+        if self.counters is not None:
+            self.counters.arrivals += 1
         self.queue.enqueue(product=product)
+        self.stats.record_arrival(now=self.env.now)
+        if self.load_index is not None:
+            self.load_index.add(self.params.node_id, 1)
         
         self.stats.update_total_interarrival_time(
             interarrival_time=self.env.now - self.prev_arrival)
         self.prev_arrival = self.env.now
 
-        stats = ProductStatistics()
-        stats.start_wait_time = self.env.now
+        product.visited(node=self.params.node_id, now=self.env.now)
+        if self.batch is not None and not self.batch_open:
+            self._open_batch()
 
-        product.queues_visited[self.get_name()] = stats
+        self._stop_idle()
+
+        if self.is_available() and (self.batch is None or self.batch_due
+                                    or len(self.queue) >= self.batch.size):
+            self._wake()
+        return True
+
+    def _open_batch(self):
+        self.batch_seq += 1
+        self.batch_open = True
+        self.batch_due = False
+        if self.batch.timeout is not None:
+            seq = self.batch_seq
+            timer = self.env.timeout(self.batch.timeout)
+            timer.callbacks.append(lambda _: self._fill_timeout(seq))
+
+    def _fill_timeout(self, seq: int):
+        # serve the batch part full, unless it was taken meanwhile
+        if seq == self.batch_seq and self.batch_open:
+            self.batch_due = True
+            if self.is_available():
+                self._wake()
 
-        if self.is_idle:
-            self._stop_idle()
+    def wait_for_space(self) -> sp.Event:
+        if self.space_event is None:
+            self.space_event = self.env.event()
+        return self.space_event
 
-        if self.is_available():
-            self._stop_active()
+    def send_to(self, system: "System", product: Product):
+        # hold on to the caller until the next system admits the product
+        while not system.add_product(product=product):
+            yield system.wait_for_space()
 
     def _get_product(self) -> Product:
         try:
-            return self.queue.dequeue()
+            product = self.queue.dequeue()
         except Exception:
             return None
+        if self.space_event is not None:
+            self.space_event.succeed()
+            self.space_event = None
+        return product
 
     def is_empty(self) -> bool:
         return self.queue.is_empty()
@@ -82,12 +192,10 @@ class System:
         return self.queue.is_full()
 
     def is_available(self) -> bool:
-        cap = self.available_servers.capacity
-        in_use = self.available_servers.count
-        return in_use < cap
+        return self.busy_servers < self.params.max_servers
 
     def is_active(self) -> bool:
-        return self.available_servers.count > 0
+        return self.busy_servers > 0
 
     def __len__(self) -> int:
         return len(self.queue)
@@ -95,114 +203,144 @@ class System:
     
     def availability(self, args = None) -> Tuple[float, float]:
         server_ratio = 0.0
-        if self.available_servers.capacity == 0:
+        if self.params.max_servers == 0:
             server_ratio = 0.0
         else:
-            server_ratio = self.available_servers.count / self.available_servers.capacity
+            server_ratio = self.busy_servers / self.params.max_servers
         queue_ratio = 0.0
-        if self.queue.capacity == 0:
+        if not self.queue.capacity:
             queue_ratio = 0.0
         else:
-            queue_ratio = len(self.queue) / self.queue.capacity()
+            queue_ratio = len(self.queue) / self.queue.capacity
         return (server_ratio, queue_ratio)
 
     def _stop_idle(self):
-        self.is_idle = False
-        if self.idle_proc is not None and not self.idle_proc.triggered:
-            self.idle_proc.interrupt()
+        if self.idle_since is not None:
+            self.stats.update_idle_time(idle_time=self.env.now - self.idle_since)
+            self.idle_since = None
 
-    def _stop_active(self):
-        if self.active_proc is not None and not self.active_proc.triggered:
-            self.active_proc.interrupt()
-
-    def _active(self):
-        try:
-            active_start = self.env.now
-            # print(
-            #     f"At time t = {active_start}, {self.get_name()} ACTIVE starts")
-
-            yield self.env.timeout(SIM_DURATION)
-        except sp.Interrupt:
-            active_end = self.env.now
-            # print(
-            #     f"At time t = {active_end}, {self.get_name()} ACTIVE ends")
-
-    def _idle(self):
-        try:
-            idle_start = self.env.now
-            # print(f"At time t = {idle_start}, {self.get_name()} IDLE starts")
-            yield self.env.timeout(SIM_DURATION)
-        except sp.Interrupt:
-            idle_end = self.env.now
-            # print(f"At time t = {idle_end}, {self.get_name()} IDLE ends")
-            self.stats.update_idle_time(idle_time=idle_end - idle_start)
+    def _wake(self):
+        if self.wakeup is not None and not self.wakeup.triggered:
+            self.wakeup.succeed()
+            if self.counters is not None:
+                self.counters.wakeups += 1
 
     def _calculate_in_queue_wait_time(self):
-        remaining_products = self.queue.products
+        remaining_products = self.queue
         self.stats.in_queue_at_end = len(remaining_products)
         for v in remaining_products:
-            v.update_wait_time(id=self.get_name(), end=self.env.now)
-            self.stats.update_wait_time(
-                wait_time=v.get_wait_time(id=self.get_name()))
-
-    def go_active(self) -> sp.Process:
-        active_state = self._active()
-        self.active_proc = self.env.process(active_state)
-        yield self.active_proc
-
-    def go_idle(self) -> sp.Process:
-        self.is_idle = True
-        idle_timeout = self._idle()
-        self.idle_proc = self.env.process(idle_timeout)
-        yield self.idle_proc
-
-    def request_server(self) -> (SystemScheduleResult, Product, Request):
+            self.stats.update_wait_time(wait_time=v.end_wait(now=self.env.now))
+
+    def wait_for_work(self) -> sp.Event:
+        """
+        Wait until a product arrives or a server is released
+        """
+        if not self.is_active() and self.is_empty():
+            self.idle_since = self.env.now
+        if self.counters is not None:
+            self.counters.waits += 1
+        self.wakeup = self.env.event()
+        yield self.wakeup
+
+    def request_server(self) -> (SystemScheduleResult, Product):
         if not self.is_empty():
+            if self.batch is not None:
+                return self._request_batch()
             if self.is_available():
-                req = self.available_servers.request()
+                self.busy_servers += 1
                 # print(
-                #     f"{self.get_name()} servers count = {self.available_servers.count}/{self.available_servers.capacity}")
+                #     f"{self.get_name()} servers count = {self.busy_servers}/{self.params.max_servers}")
                 product = self._get_product()
                 self._schedule_update_stats(product=product)
-                return SystemScheduleResult.FOUND_PRODUCT, product, req
+                if self.counters is not None:
+                    self.counters.service_starts += 1
+                return SystemScheduleResult.FOUND_PRODUCT, product
             else:
-                return SystemScheduleResult.NO_PRODUCT, None, None
+                return SystemScheduleResult.NO_PRODUCT, None
         else:
             # print(
             #     f"At time t = {self.env.now}, {self.get_name()} NO_SERVER idle start")
-            return SystemScheduleResult.NO_SERVER, None, None
-
-    def serve(self, product: Product, req: sp.Resource, server: ProductServer) -> sp.Event:
+            return SystemScheduleResult.NO_SERVER, None
+
+    def _request_batch(self) -> (SystemScheduleResult, list[Product]):
+        if not self.is_available() or (len(self.queue) < self.batch.size and not self.batch_due):
+            return SystemScheduleResult.NO_PRODUCT, None
+        self.busy_servers += 1
+        products = [self._get_product() for _ in range(min(self.batch.size, len(self.queue)))]
+        self.batch_open = False
+        self.batch_due = False
+        if not self.is_empty():
+            # the products left behind start the next batch
+            self._open_batch()
+        now = self.env.now
+        self.stats.record_service_start(now=now, products=len(products))
+        for product in products:
+            self.stats.update_service_requests()
+            self.stats.update_product_count()
+            self.stats.record_wait(wait_time=product.end_wait(now=now))
+        if self.counters is not None:
+            self.counters.service_starts += len(products)
+        return SystemScheduleResult.FOUND_BATCH, products
+
+    def serve(self, product: Product, server: ProductServer) -> sp.Event:
         service_start = self.env.now
         yield from server.process(product=product)
         service_end = self.env.now
         self.stats.update_service_time(service_end - service_start)
 
-        self.available_servers.release(request=req)
-        if self.is_available():
-            self._stop_active()
+        # the server stays held while the next system blocks
+        yield from self._move_to_next_production_line(product=product)
+
+        self.stats.record_departure(now=self.env.now)
+        self.busy_servers -= 1
+        if self.load_index is not None:
+            self.load_index.add(self.params.node_id, -1)
+        if self.counters is not None:
+            self.counters.departures += 1
+        self._wake()
+
+    def serve_batch(self, products: list[Product], server: ProductServer) -> sp.Event:
+        """
+        One service time for the whole batch, then every product is routed
+        on its own while the batch holds the server
+        """
+        service_start = self.env.now
+        yield from server.process(product=products[0])
+        service_time = self.env.now - service_start
+
+        for product in products:
+            # the server's time per product, so service rates stay per product
+            self.stats.update_service_time(service_time / len(products))
+            yield from self._move_to_next_production_line(product=product)
+
+        self.stats.record_departure(now=self.env.now, products=len(products))
+        self.busy_servers -= 1
+        if self.load_index is not None:
+            self.load_index.add(self.params.node_id, -len(products))
+        if self.counters is not None:
+            self.counters.departures += len(products)
+        self._wake()
 
     def _schedule_update_stats(self, product: Product):
+        self.stats.record_service_start(now=self.env.now)
         self.stats.update_service_requests()
         self.stats.update_product_count()
 
-        product.update_wait_time(
-            id=self.get_name(),
-            end=self.env.now)
-
-        self.stats.update_wait_time(
-            wait_time=product.get_wait_time(id=self.get_name()))
+        self.stats.record_wait(
+            wait_time=product.end_wait(now=self.env.now))
 
     def schedule(self):
         pass
 
+    def _move_to_next_production_line(self, product: Product):
+        return
+        yield
+
     def run(self):
-        # MMN0208: server utilization
-        self.env.process(self._monitor())
         pass
 
     def stop(self):
         self._stop_idle()
-        self._stop_active()
         self._calculate_in_queue_wait_time()
+        self.stats.close(now=self.env.now)
         self.stats.update_utilization(self.params.max_servers)
\ No newline at end of file
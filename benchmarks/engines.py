@@ -0,0 +1,101 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+from main import ENGINES
+from params import load_nodes
+
+
+def count_simpy_steps(factory) -> list:
+    # wrap env.step on the instance, Environment.run looks it up there
+    counter = [0]
+    step = factory.env.step
+
+    def counting_step():
+        counter[0] += 1
+        step()
+
+    factory.env.step = counting_step
+    return counter
+
+
+def feed_forward(config_path: str, directory: str) -> str:
+    """
+    Copy of the config with every route back to the same or an earlier node
+    sent to the exit instead, so the lindley engine can solve it
+    """
+    with open(config_path) as f:
+        dat = json.load(f)
+    cfgs = load_nodes(dat)
+    order = {cfg["name"]: i for i, cfg in enumerate(cfgs)}
+    for i, cfg in enumerate(cfgs):
+        for dest in cfg["go_to"]:
+            if order.get(dest["name"], len(cfgs)) <= i:
+                dest["name"] = "exit"
+    path = os.path.join(directory, "feed_forward.config.json")
+    with open(path, "w") as f:
+        json.dump(dat, f)
+    return path
+
+
+def run(engine: str, workload_path: str, config_path: str, seed: int,
+        replications: int = None) -> dict:
+    kwargs = {} if replications is None else {"replications": replications}
+    try:
+        factory = ENGINES[engine](workload_path=workload_path,
+                                  config_path=config_path, seed=seed, **kwargs)
+    except ValueError:
+        # the engine cannot model this config
+        return None
+    counter = count_simpy_steps(factory) if engine == "simpy" else None
+
+    start = time.perf_counter()
+    factory.open(verbose=False)
+    wall_time = time.perf_counter() - start
+
+    events = counter[0] if counter is not None else factory.events
+    # products of every replication computed in this run
+    products = factory.summary()["generator"]["total_generated"] * (replications or 1)
+    label = engine if replications is None else f"{engine} x{replications}"
+    if len(getattr(factory, "reasons", [])) > 0:
+        label += " (native fallback)"
+    return {
+        "engine": label,
+        "wall_time_s": wall_time,
+        # engine specific, SimPy steps or calendar events
+        "engine_events": events,
+        "engine_events_per_s": events / wall_time,
+        "products_per_s": products / wall_time,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare products per second of the simulation engines")
+    parser.add_argument("workload", help="path to the workload file")
+    parser.add_argument("--config", default="./config.json")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--feed-forward", action="store_true",
+                        help="send routes back to earlier nodes to the exit, so lindley runs without falling back")
+    parser.add_argument("--replications", type=int, default=10,
+                        help="also run lindley with this many replications at once")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        config_path = args.config
+        if args.feed_forward:
+            config_path = feed_forward(args.config, directory)
+        results = [run(engine, args.workload, config_path, args.seed)
+                   for engine in ENGINES if engine != "lindley"]
+        # with max_servers > 1 lindley loops over products in Python and is
+        # vectorized across replications only, a single replication shows it
+        results += [run("lindley", args.workload, config_path, args.seed, replications=r)
+                    for r in (1, args.replications)]
+    results = [res for res in results if res is not None]
+    baseline = results[0]["wall_time_s"]
+    for res in results:
+        print(f"{res['engine']:>12}: {res['wall_time_s']:.3f} s, "
+              f"{res['products_per_s']:.0f} products/s, "
+              f"{res['engine_events']} engine events, "
+              f"x{baseline / res['wall_time_s']:.1f} vs simpy")
@@ -0,0 +1,86 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from params import POLICIES
+from replicate import replicate
+
+COLUMNS = ("no_exited", "sojourn_mean", "sojourn_p95", "sojourn_wait_mean")
+
+
+def policy_config(config_path: str, policy: str, nodes: list[str], d: int,
+                  directory: str) -> str:
+    """
+    Copy of the config with policy set on nodes, every node when nodes is empty
+    """
+    with open(config_path) as f:
+        dat = json.load(f)
+    for cfg in [dat["dispatcher"]] + dat["productionlines"] + dat["qa_check"]:
+        if len(nodes) == 0 or cfg["name"] in nodes:
+            cfg["routing"] = {"policy": policy, "d": d}
+    path = os.path.join(directory, f"{policy}.config.json")
+    with open(path, "w") as f:
+        json.dump(dat, f)
+    return path
+
+
+def run(config_path: str, workload_path: str, policies: list[str], nodes: list[str],
+        d: int, replications: int, seed: int, engine: str, workers: int = None) -> list[dict]:
+    """
+    Throughput and end-to-end times of each policy, replications share
+    their seeds across policies so the differences are not arrival noise
+    """
+    with open(workload_path) as f:
+        hours = json.load(f)["simulation_time"] / 3600
+    results = []
+    with tempfile.TemporaryDirectory() as directory, \
+            ProcessPoolExecutor(max_workers=workers) as pool:
+        for policy in policies:
+            path = policy_config(config_path, policy, nodes, d, directory)
+            start = time.perf_counter()
+            result = replicate(path, workload_path, replications, seed=seed,
+                               engine=engine, pool=pool)
+            res = {"policy": policy, "wall_time_s": time.perf_counter() - start}
+            for column in COLUMNS:
+                res[column] = result["system"][column]["mean"]
+                res[f"{column}_half_width"] = (result["system"][column]["ci_high"]
+                                               - result["system"][column]["mean"])
+            res["throughput"] = res["no_exited"] / hours
+            results.append(res)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare load-aware routing policies against probabilistic routing")
+    parser.add_argument("workload", help="path to the workload file")
+    parser.add_argument("--config", default="./config.json")
+    parser.add_argument("--policies", nargs="+", choices=POLICIES, default=list(POLICIES))
+    parser.add_argument("--nodes", nargs="*", default=["dispatcher"],
+                        help="nodes routing by the policy, every node when empty")
+    parser.add_argument("--d", type=int, default=2, help="choices of power_of_d")
+    parser.add_argument("--replications", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--engine", choices=["simpy", "native"], default="native")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--json", action="store_true",
+                        help="print the results as JSON instead of lines")
+    args = parser.parse_args()
+
+    policies = ["probabilistic"] + [p for p in args.policies if p != "probabilistic"]
+    results = run(args.config, args.workload, policies, args.nodes, args.d,
+                  args.replications, args.seed, args.engine, workers=args.workers)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        baseline = results[0]
+        for res in results:
+            print(f"{res['policy']:>13}: throughput {res['throughput']:.3f}/h "
+                  f"({res['throughput'] / baseline['throughput'] - 1:+.1%}), "
+                  f"sojourn mean {res['sojourn_mean']:.3f} h +- {res['sojourn_mean_half_width']:.3f} "
+                  f"({res['sojourn_mean'] / baseline['sojourn_mean'] - 1:+.1%}), "
+                  f"p95 {res['sojourn_p95']:.3f} h "
+                  f"({res['sojourn_p95'] / baseline['sojourn_p95'] - 1:+.1%}), "
+                  f"{res['wall_time_s']:.1f} s")
@@ -0,0 +1,66 @@
+import argparse
+import tracemalloc
+from product import Product
+
+
+class LegacyProductStatistics:
+    def __init__(self) -> None:
+        self.wait_time: float = 0.0
+        self.service_time: float = 0.0
+
+
+class LegacyProduct:
+    """
+    The dict-backed product as it was before slots: a queues_visited dict of
+    per-node statistics objects keyed by node name
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.queues_visited: dict[str, LegacyProductStatistics] = {}
+
+
+NODE_NAMES = ["dispatcher", "production_line_a", "qa_check_a"]
+
+
+def make_legacy(i: int) -> LegacyProduct:
+    product = LegacyProduct(name=i)
+    for t, node in enumerate(NODE_NAMES):
+        stats = LegacyProductStatistics()
+        stats.start_wait_time = float(t)
+        stats.end_wait_time = float(t) + 0.5
+        product.queues_visited[node] = stats
+    return product
+
+
+def make_slotted(i: int) -> Product:
+    product = Product(name=i, arrival_time=float(i))
+    for t in range(len(NODE_NAMES)):
+        product.visited(node=t, now=float(t))
+        product.end_wait(now=float(t) + 0.5)
+    return product
+
+
+def bytes_per_product(make, n: int) -> float:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    products = [make(i) for i in range(n)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del products
+    # leave out the list slot holding each product
+    return (after - before) / n - 8
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Bytes per in-flight product, dict-backed vs slotted")
+    parser.add_argument("--products", type=int, default=100000)
+    args = parser.parse_args()
+
+    legacy = bytes_per_product(make_legacy, args.products)
+    slotted = bytes_per_product(make_slotted, args.products)
+    print(f"{len(NODE_NAMES)} nodes visited per product")
+    print(f"  before (dict + per-node objects): {legacy:.0f} bytes/product")
+    print(f"  after (__slots__, integer node ids): {slotted:.0f} bytes/product")
+    print(f"  x{legacy / slotted:.1f} smaller")
@@ -0,0 +1,46 @@
+import argparse
+import timeit
+import numpy as np
+from streams import RandomStreams
+from routing import Router
+
+
+class _Destination:
+    def __init__(self, name: str, probability: float) -> None:
+        self.name = name
+        self.probability = probability
+
+
+def run(n_draws: int, probabilities: list[float]) -> dict:
+    destinations = [_Destination(name=f"line_{i}", probability=p)
+                    for i, p in enumerate(probabilities)]
+
+    def choice():
+        return np.random.choice(destinations, 1, p=probabilities)[0]
+
+    router = Router(
+        destinations=destinations,
+        stream=RandomStreams(seed=0).uniform(node="bench", purpose="routing"))
+
+    choice_time = min(timeit.repeat(choice, number=n_draws, repeat=3))
+    alias_time = min(timeit.repeat(router.choose, number=n_draws, repeat=3))
+    return {
+        "destinations": len(destinations),
+        "np_random_choice_ns": choice_time / n_draws * 1e9,
+        "alias_table_ns": alias_time / n_draws * 1e9,
+        "speedup": choice_time / alias_time,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Time one routing decision: np.random.choice vs alias table")
+    parser.add_argument("--draws", type=int, default=100000)
+    args = parser.parse_args()
+
+    for probabilities in ([0.5, 0.4, 0.1], [0.25, 0.75], [0.05, 0.05, 0.9]):
+        res = run(n_draws=args.draws, probabilities=probabilities)
+        print(f"{res['destinations']} destinations: "
+              f"np.random.choice {res['np_random_choice_ns']:.0f} ns, "
+              f"alias table {res['alias_table_ns']:.0f} ns, "
+              f"speedup x{res['speedup']:.1f}")
@@ -0,0 +1,299 @@
+import argparse
+import copy
+import cProfile
+import json
+import multiprocessing
+import os
+import platform
+import pstats
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from benchmarks.engines import count_simpy_steps
+from main import ENGINES
+import netgen
+
+WORKLOADS = [f"./workload/workload{i}.json" for i in range(4)]
+
+# subsystem of a profiled function, by file and then by function name
+SUBSYSTEM_FILES = {
+    "main.py": "generator",
+    "streams.py": "generator",
+    "routing.py": "routing",
+    "qs.py": "queue",
+    "system_stats.py": "stats",
+    "sketches.py": "stats",
+    "snapshots.py": "monitor",
+    "base_systems.py": "systems",
+    "systems.py": "systems",
+    "servers.py": "systems",
+    "product.py": "systems",
+    "native_engine.py": "systems",
+    "ctmc_engine.py": "systems",
+    "lindley_engine.py": "systems",
+}
+MONITOR_FUNCTIONS = {("system_stats.py", "record"), ("system_stats.py", "flush"),
+                     ("system_stats.py", "sample"), ("base_systems.py", "monitor")}
+
+
+def subsystem(filename: str, function: str) -> str:
+    base = os.path.basename(filename)
+    if (base, function) in MONITOR_FUNCTIONS:
+        return "monitor"
+    if base in SUBSYSTEM_FILES:
+        return SUBSYSTEM_FILES[base]
+    if f"{os.sep}simpy{os.sep}" in filename:
+        return "simpy"
+    if filename == "~":
+        # C functions and builtin methods, called from every subsystem
+        return "builtins"
+    return "other"
+
+
+class Case:
+    def __init__(self, name: str, config_path: str, workload_path: str, meta: dict = None) -> None:
+        self.name = name
+        self.config_path = config_path
+        self.workload_path = workload_path
+        # copied into the result, e.g. node count and arrival rate for scaling plots
+        self.meta = meta or {}
+
+
+def scaled_case(name: str, config_path: str, workload_path: str, factor: int,
+                directory: str) -> Case:
+    """
+    The same network with factor times the arrival rate and servers, so
+    utilizations stay put while the event count grows factor times
+    """
+    with open(config_path) as f:
+        dat = json.load(f)
+    with open(workload_path) as f:
+        workload = json.load(f)
+    dat = copy.deepcopy(dat)
+    for cfg in [dat["dispatcher"]] + dat["productionlines"] + dat["qa_check"]:
+        cfg["max_servers"] *= factor
+    workload["generator"]["mean_interarrival_time"] /= factor
+    scaled_config = os.path.join(directory, f"{name}.config.json")
+    scaled_workload = os.path.join(directory, f"{name}.workload.json")
+    with open(scaled_config, "w") as f:
+        json.dump(dat, f)
+    with open(scaled_workload, "w") as f:
+        json.dump(workload, f)
+    return Case(name=name, config_path=scaled_config, workload_path=scaled_workload,
+                meta={"scale": factor})
+
+
+def network_case(nodes: int, mean_interarrival_time: float, simulation_time: float,
+                 seed: int, directory: str) -> Case:
+    """
+    A random stable network from netgen, utilizations set for this arrival rate
+    """
+    dat, workload = netgen.generate(nodes=nodes,
+                                    mean_interarrival_time=mean_interarrival_time,
+                                    simulation_time=simulation_time, seed=seed)
+    name = f"net{nodes}_ia{mean_interarrival_time:g}"
+    config_path, workload_path = netgen.write(directory, name, dat, workload)
+    return Case(name=name, config_path=config_path, workload_path=workload_path,
+                meta={"nodes": nodes, "arrival_rate": 3600 / mean_interarrival_time})
+
+
+def _open(engine: str, case: Case, seed: int, monitor_resolution: float = None):
+    kwargs = {}
+    if monitor_resolution is not None and engine == "simpy":
+        kwargs["monitor_resolution"] = monitor_resolution
+    factory = ENGINES[engine](workload_path=case.workload_path,
+                              config_path=case.config_path, seed=seed, **kwargs)
+    counter = count_simpy_steps(factory) if engine == "simpy" else None
+    return factory, counter
+
+
+def _timed(engine: str, case: Case, seed: int, monitor_resolution: float = None) -> dict:
+    factory, counter = _open(engine, case, seed, monitor_resolution)
+    start = time.perf_counter()
+    factory.open(verbose=False)
+    wall_time = time.perf_counter() - start
+    # SimPy steps or the engine's own calendar events, which differ in what
+    # one event covers: compare engines by products_per_s only
+    events = counter[0] if counter is not None else factory.events
+    products = factory.summary()["generator"]["total_generated"]
+    # ru_maxrss is in KiB on Linux, in bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != "darwin":
+        peak_rss *= 1024
+    return {
+        "wall_time_s": wall_time,
+        "engine_events": events,
+        "engine_events_per_s": events / wall_time,
+        "products": products,
+        "products_per_s": products / wall_time,
+        "peak_rss_bytes": peak_rss,
+    }
+
+
+def _memory(engine: str, case: Case, seed: int, monitor_resolution: float = None) -> dict:
+    factory, _ = _open(engine, case, seed, monitor_resolution)
+    blocks = sys.getallocatedblocks()
+    tracemalloc.start()
+    factory.open(verbose=False)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # blocks still allocated after the run, CPython keeps no count of the
+    # allocations made during it
+    retained = sys.getallocatedblocks() - blocks
+    products = max(factory.summary()["generator"]["total_generated"], 1)
+    return {
+        "tracemalloc_peak_bytes": peak,
+        "peak_bytes_per_product": peak / products,
+        "retained_blocks_per_product": retained / products,
+    }
+
+
+def _profile(engine: str, case: Case, seed: int, monitor_resolution: float = None) -> dict:
+    factory, _ = _open(engine, case, seed, monitor_resolution)
+    profiler = cProfile.Profile()
+    profiler.runcall(factory.open, verbose=False)
+    totals: dict[str, float] = {}
+    for (filename, _, function), row in pstats.Stats(profiler).stats.items():
+        # row is (primitive calls, calls, own time, cumulative time, callers)
+        name = subsystem(filename, function)
+        totals[name] = totals.get(name, 0.0) + row[2]
+    overall = sum(totals.values())
+    return {name: {"seconds": seconds, "share": seconds / overall}
+            for name, seconds in sorted(totals.items(), key=lambda kv: -kv[1])}
+
+
+def _isolated(phase, *args):
+    # a fresh interpreter per phase keeps peak RSS and tracemalloc per run
+    with ProcessPoolExecutor(
+            max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return pool.submit(phase, *args).result()
+
+
+def measure(engine: str, case: Case, seed: int, profile: bool = True,
+            monitor_resolution: float = None) -> dict:
+    args = (engine, case, seed, monitor_resolution)
+    try:
+        res = {"case": case.name, "engine": engine,
+               "config": case.config_path, "workload": case.workload_path}
+        res.update(case.meta)
+        res.update(_isolated(_timed, *args))
+    except ValueError:
+        # the engine cannot model this config
+        return None
+    res.update(_isolated(_memory, *args))
+    if profile:
+        res["subsystems"] = _isolated(_profile, *args)
+    return res
+
+
+def version() -> str:
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"],
+                              capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run_suite(cases: list[Case], engines: list[str], seed: int = 0,
+              profile: bool = True, monitor_resolution: float = None) -> dict:
+    results = []
+    for case in cases:
+        for engine in engines:
+            res = measure(engine, case, seed, profile=profile,
+                          monitor_resolution=monitor_resolution)
+            if res is not None:
+                results.append(res)
+    return {
+        "version": version(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": seed,
+        "monitor_resolution": monitor_resolution,
+        "results": results,
+    }
+
+
+def compare(old: dict, new: dict, tolerance: float) -> list[str]:
+    """
+    Regressions of new against old: products per second down, or peak
+    memory up, by more than tolerance on any (case, engine)
+    """
+    previous = {(r["case"], r["engine"]): r for r in old["results"]}
+    regressions = []
+    for r in new["results"]:
+        before = previous.get((r["case"], r["engine"]))
+        if before is None:
+            continue
+        if r["products_per_s"] < before["products_per_s"] * (1 - tolerance):
+            regressions.append(
+                f"{r['case']} {r['engine']}: products/s {before['products_per_s']:.0f} -> {r['products_per_s']:.0f}")
+        if r["tracemalloc_peak_bytes"] > before["tracemalloc_peak_bytes"] * (1 + tolerance):
+            regressions.append(
+                f"{r['case']} {r['engine']}: tracemalloc peak {before['tracemalloc_peak_bytes']} -> {r['tracemalloc_peak_bytes']}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure simulator throughput and memory, write the results as JSON")
+    parser.add_argument("--config", default="./config.json")
+    parser.add_argument("--workloads", nargs="*", default=WORKLOADS,
+                        help="workload files run on --config")
+    parser.add_argument("--engines", nargs="+", choices=list(ENGINES),
+                        default=["simpy"], help="engines to measure")
+    parser.add_argument("--scales", nargs="*", type=int, default=[4],
+                        help="also run workload1 on --config with this many times the arrival rate and servers")
+    parser.add_argument("--networks", nargs="*", type=int, default=[],
+                        help="also run random netgen networks of these node counts")
+    parser.add_argument("--interarrival-times", nargs="+", type=float, default=[60],
+                        help="mean interarrival times of the netgen networks, in seconds")
+    parser.add_argument("--network-time", type=float, default=86400,
+                        help="simulation time of the netgen networks, in seconds")
+    parser.add_argument("--case", nargs=3, action="append", default=[],
+                        metavar=("NAME", "CONFIG", "WORKLOAD"),
+                        help="an extra config and workload to measure")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--monitor-resolution", type=float, default=None,
+                        help="also sample queue lengths and busy servers (simpy engine)")
+    parser.add_argument("--no-profile", action="store_true",
+                        help="skip the cProfile run behind the subsystem breakdown")
+    parser.add_argument("--output", default=None,
+                        help="write the JSON here instead of stdout")
+    parser.add_argument("--compare", default=None,
+                        help="earlier JSON output, exit with 1 on a regression against it")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="relative change counted as a regression")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        cases = [Case(name=os.path.splitext(os.path.basename(w))[0],
+                      config_path=args.config, workload_path=w) for w in args.workloads]
+        cases += [scaled_case(f"workload1_x{factor}", args.config, WORKLOADS[1],
+                              factor, directory) for factor in args.scales]
+        cases += [network_case(nodes, interarrival, args.network_time, args.seed, directory)
+                  for nodes in args.networks for interarrival in args.interarrival_times]
+        cases += [Case(name=name, config_path=config, workload_path=workload)
+                  for name, config, workload in args.case]
+        report = run_suite(cases, args.engines, seed=args.seed,
+                           profile=not args.no_profile,
+                           monitor_resolution=args.monitor_resolution)
+
+    text = json.dumps(report, indent=2)
+    if args.output is None:
+        print(text)
+    else:
+        with open(args.output, "w") as f:
+            f.write(text)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), report, args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if len(regressions) > 0:
+            sys.exit(1)
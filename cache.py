@@ -0,0 +1,213 @@
+import argparse
+import hashlib
+import json
+import os
+import tempfile
+import time
+import numpy as np
+from model import load
+
+# stored with every entry, bumped when the entry layout changes
+FORMAT = 1
+# temporary files older than this were left by a writer that died mid-write
+STALE_TMP = 3600
+
+_VERSION: str = None
+# sha256 of trace files by identity, a trace is read once per process
+_DIGESTS: dict[tuple, str] = {}
+
+
+def code_version() -> str:
+    """
+    Digest of the simulator modules, entries written by other code never match
+    """
+    global _VERSION
+    if _VERSION is None:
+        directory = os.path.dirname(os.path.abspath(__file__))
+        digest = hashlib.sha256()
+        for name in sorted(os.listdir(directory)):
+            if name.endswith(".py"):
+                digest.update(name.encode())
+                with open(os.path.join(directory, name), "rb") as f:
+                    digest.update(f.read())
+        _VERSION = digest.hexdigest()
+    return _VERSION
+
+
+def _seed(seed):
+    if isinstance(seed, np.random.SeedSequence):
+        # the root seed and the replication index
+        return {"entropy": seed.entropy, "spawn_key": list(seed.spawn_key)}
+    return seed
+
+
+def _digest(path: str) -> str:
+    stat = os.stat(path)
+    identity = (os.path.realpath(path), stat.st_mtime_ns, stat.st_size)
+    if identity not in _DIGESTS:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        _DIGESTS[identity] = digest.hexdigest()
+    return _DIGESTS[identity]
+
+
+def _content(value):
+    # copy of a config or workload with every trace path replaced by the
+    # digest of the file, so the key follows what the trace holds
+    if isinstance(value, dict):
+        res = {k: _content(v) for k, v in value.items()}
+        trace = value.get("trace")
+        if isinstance(trace, dict) and "path" in trace:
+            res["trace"] = dict(res["trace"], path=None, sha256=_digest(trace["path"]))
+        return res
+    if isinstance(value, list):
+        return [_content(v) for v in value]
+    return value
+
+
+class ResultCache:
+    """
+    Summaries of finished runs on disk, one JSON file per run named by the
+    hash of everything the run depends on: the compiled config and
+    workload, the content of the trace files they read, seed, engine and
+    code version. Files with the same content at other paths, traces
+    included, hit the same entries.
+
+    Entries are written to a temporary file and renamed into place, so
+    worker processes sharing a directory never read half an entry. Every
+    hit refreshes the entry's time, evict drops entries unused for
+    max_age seconds and then the least recently used ones above max_bytes.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = None, max_age: float = None) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, config_path: str, workload_path: str, seed, engine: str) -> str:
+        model = load(config_path, workload_path, require_stable=False)
+        content = {
+            "format": FORMAT,
+            "version": code_version(),
+            "engine": engine,
+            "seed": _seed(seed),
+            "config": _content(model.dat),
+            "workload": _content(model.workload),
+        }
+        text = json.dumps(content, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        # one level of subdirectories keeps directory listings short
+        return os.path.join(self.directory, key[:2], f"{key[2:]}.json")
+
+    def get(self, key: str) -> dict:
+        """
+        Summary stored under key, None on a miss
+        """
+        path = self._path(key)
+        try:
+            if self.max_age is not None and time.time() - os.stat(path).st_mtime > self.max_age:
+                return None
+            with open(path) as f:
+                entry = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            # missing, evicted meanwhile or not an entry
+            return None
+        if entry.get("format") != FORMAT or entry.get("key") != key:
+            return None
+        return entry["summary"]
+
+    def put(self, key: str, summary: dict):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump({"format": FORMAT, "key": key, "summary": summary}, f)
+            os.replace(tmp, path)
+        except BaseException:
+            _remove(tmp)
+            raise
+
+    def _entries(self) -> list[tuple[float, int, str]]:
+        # (last use, size, path) of every entry, oldest first
+        entries = []
+        now = time.time()
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if name.endswith(".tmp"):
+                    if now - stat.st_mtime > STALE_TMP:
+                        _remove(path)
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+        return entries
+
+    def evict(self) -> int:
+        """
+        Remove entries past max_age, then the oldest until the rest fit in
+        max_bytes, returns the number removed
+        """
+        if self.max_age is None and self.max_bytes is None:
+            return 0
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        now = time.time()
+        removed = 0
+        for last_use, size, path in entries:
+            expired = self.max_age is not None and now - last_use > self.max_age
+            over = self.max_bytes is not None and total > self.max_bytes
+            if not expired and not over:
+                break
+            _remove(path)
+            total -= size
+            removed += 1
+        return removed
+
+    def clear(self) -> int:
+        entries = self._entries()
+        for _, _, path in entries:
+            _remove(path)
+        return len(entries)
+
+    def usage(self) -> tuple[int, int]:
+        """
+        Number of entries and their total size in bytes
+        """
+        entries = self._entries()
+        return len(entries), sum(size for _, size, _ in entries)
+
+
+def _remove(path: str):
+    # another process may have removed it first
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Show, evict or clear a directory of cached run summaries")
+    parser.add_argument("directory", help="cache directory")
+    parser.add_argument("--max-bytes", type=int, default=None,
+                        help="evict the least recently used entries above this size")
+    parser.add_argument("--max-age", type=float, default=None,
+                        help="evict entries unused for this many seconds")
+    parser.add_argument("--clear", action="store_true", help="remove every entry")
+    args = parser.parse_args()
+
+    cache = ResultCache(args.directory, max_bytes=args.max_bytes, max_age=args.max_age)
+    removed = cache.clear() if args.clear else cache.evict()
+    entries, size = cache.usage()
+    print(f"{args.directory}: {entries} entries, {size} bytes, {removed} removed")
@@ -0,0 +1,184 @@
+import numpy as np
+from prettytable import PrettyTable
+from params import load_nodes
+from streams import RandomStreams
+from model import load, EXIT
+
+# config keys the CTMC can model, anything else makes the network non-Markovian
+NODE_KEYS = {"name", "mean_service_time", "max_servers", "go_to", "queue"}
+QUEUE_KEYS = {"discipline", "priority_key"}
+GENERATOR_KEYS = {"mean_interarrival_time"}
+
+
+def check_markovian(dat: dict, workload: dict) -> list[str]:
+    """
+    Reasons the network cannot be simulated as a CTMC over occupancy counts,
+    empty when it can
+    """
+    reasons = []
+    for cfg in load_nodes(dat):
+        for key in sorted(set(cfg) - NODE_KEYS):
+            reasons.append(f"{cfg['name']}: \"{key}\" is not supported")
+        for key in sorted(set(cfg.get("queue", {})) - QUEUE_KEYS):
+            # disciplines only reorder products, capacities change the chain
+            reasons.append(f"{cfg['name']}: queue \"{key}\" is not supported")
+    for key in sorted(set(workload["generator"]) - GENERATOR_KEYS):
+        reasons.append(f"generator: \"{key}\" is not supported")
+    return reasons
+
+
+class CTMCFactory:
+    """
+    Simulate an all-exponential network as a continuous-time Markov chain
+    over per-node occupancy counts (Gillespie's direct method).
+
+    Every transition costs one exponential draw for the holding time and one
+    categorical draw over arrival and (node, destination) departure rates.
+    No product objects exist, so memory does not grow with the number of
+    products in the system. The max(1, ...) service clamp is ignored.
+    """
+
+    def __init__(self, workload_path: str, config_path: str, seed=None,
+                 require_stable: bool = True) -> None:
+        self.model = load(config_path=config_path, workload_path=workload_path,
+                          require_stable=require_stable)
+        self.workload = self.model.workload
+        self.dat = self.model.dat
+
+        reasons = check_markovian(self.dat, self.workload)
+        if len(reasons) > 0:
+            raise ValueError(
+                "the CTMC engine only models exponential interarrival and service "
+                "times with unbounded queues and probabilistic routing, use another "
+                "engine for this config:\n  "
+                + "\n  ".join(reasons))
+
+        self.verbose = True
+        self.sim_time = self.model.simulation_time
+        self.now = 0.0
+        self.events = 0
+
+        model = self.model
+        self.names = list(model.names)
+        n_nodes = len(model)
+        self.exit = n_nodes
+        self.servers = model.servers
+        self.arrival_rate = model.external_rate
+
+        # transition 0 is an external arrival at the dispatcher, the others
+        # move one product from src to dst (exit is index n_nodes)
+        src = [0]
+        dst = [0]
+        rate = [0.0]
+        for i in range(n_nodes):
+            for j, p in zip(model.destinations[i], model.probabilities[i]):
+                src.append(i)
+                dst.append(self.exit if j == EXIT else j)
+                rate.append(model.service_rates[i] * p)
+        self.src = np.array(src)
+        self.dst = np.array(dst)
+        self.rate = np.array(rate)
+
+        self.occupancy = np.zeros(n_nodes, dtype=np.int64)
+        self.area_in_node = np.zeros(n_nodes)
+        self.area_in_queue = np.zeros(n_nodes)
+        self.area_busy = np.zeros(n_nodes)
+        self.arrivals = np.zeros(n_nodes, dtype=np.int64)
+        self.completions = np.zeros(n_nodes, dtype=np.int64)
+        self.exits = 0
+        self.generated = 0
+
+        streams = RandomStreams(seed=seed)
+        self.holding_stream = streams.exponential(
+            node="ctmc", purpose="holding", mean=1.0)
+        self.transition_stream = streams.uniform(
+            node="ctmc", purpose="transition")
+
+    def run(self):
+        occupancy = self.occupancy
+        servers = self.servers
+        src = self.src[1:]
+        dst = self.dst
+        rates = self.rate.copy()
+        rates[0] = self.arrival_rate
+        base = self.rate[1:]
+        until = self.sim_time
+        exit_index = self.exit
+
+        while True:
+            busy = np.minimum(occupancy, servers)
+            rates[1:] = base * busy[src]
+            cumulative = np.cumsum(rates)
+            total = cumulative[-1]
+            dt = self.holding_stream.next() / total
+            if self.now + dt > until:
+                dt = until - self.now
+
+            self.area_in_node += occupancy * dt
+            self.area_busy += busy * dt
+            self.area_in_queue += (occupancy - busy) * dt
+            self.now += dt
+            if self.now >= until:
+                break
+
+            self.events += 1
+            k = int(np.searchsorted(
+                cumulative, self.transition_stream.next() * total, side="right"))
+            if k == 0:
+                occupancy[0] += 1
+                self.arrivals[0] += 1
+                self.generated += 1
+                continue
+            source = src[k - 1]
+            occupancy[source] -= 1
+            self.completions[source] += 1
+            target = dst[k]
+            if target == exit_index:
+                self.exits += 1
+            else:
+                occupancy[target] += 1
+                self.arrivals[target] += 1
+
+    def summary(self) -> dict:
+        hours = self.sim_time / 3600
+        nodes = {}
+        for i, name in enumerate(self.names):
+            nodes[name] = {
+                "arrival_rate": self.arrivals[i] / hours,
+                "throughput": self.completions[i] / hours,
+                "utilization": self.area_busy[i] / self.sim_time / self.servers[i],
+                "avg_products_in_node": self.area_in_node[i] / self.sim_time,
+                "avg_products_in_queue": self.area_in_queue[i] / self.sim_time,
+            }
+        avg_products_in_sys = float(self.area_in_node.sum() / self.sim_time)
+        arrival_rate = self.generated / hours
+        return {
+            "nodes": nodes,
+            "system": {
+                "avg_products_in_sys": avg_products_in_sys,
+                "throughput": self.exits / hours,
+                "avg_sys_response_time": avg_products_in_sys / arrival_rate,
+            },
+            "generator": {
+                "total_generated": self.generated,
+                "arrival_rate": arrival_rate,
+            },
+        }
+
+    def stats(self):
+        summary = self.summary()
+        print(
+            f"------------------------\nSimulation duration = {self.sim_time} (CTMC)\n------------------------")
+        columns = list(next(iter(summary["nodes"].values())))
+        tb = PrettyTable(["node_name"] + columns)
+        for name, values in summary["nodes"].items():
+            tb.add_row([name] + [round(float(values[c]), 4) for c in columns])
+        print(tb)
+        for name, value in summary["system"].items():
+            print(f"{name} = {round(value, 4)}")
+
+    def open(self, verbose: bool = True):
+        self.verbose = verbose
+        self.run()
+        if self.verbose:
+            self.stats()
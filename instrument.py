@@ -0,0 +1,168 @@
+import cProfile
+import io
+import pstats
+import signal
+import time
+from collections import Counter
+from prettytable import PrettyTable
+
+# per node event counters, in report order
+COUNTERS = ["arrivals", "balked", "blocked", "service_starts", "departures",
+            "exits", "waits", "wakeups", "service_draws", "routing_draws"]
+
+PROFILERS = ("cprofile", "sampling")
+
+
+class NodeCounters:
+    """
+    Events of one node and the time spent in its schedule and serve code.
+    In the native engine schedule time is the generator's arrival handling
+    at the dispatcher and serve time is each node's departure handling.
+    """
+
+    __slots__ = COUNTERS + ["schedule_time", "serve_time"]
+
+    def __init__(self) -> None:
+        for name in self.__slots__:
+            setattr(self, name, 0)
+
+
+def timed(generator, counters: NodeCounters, phase: str):
+    """
+    Drive a process generator, adding the time spent inside it between
+    yields to counters.<phase>_time
+    """
+    attribute = f"{phase}_time"
+    value, error = None, None
+    while True:
+        start = time.perf_counter()
+        try:
+            if error is None:
+                event = generator.send(value)
+            else:
+                event = generator.throw(error)
+        except StopIteration as stop:
+            return stop.value
+        finally:
+            elapsed = time.perf_counter() - start
+            setattr(counters, attribute, getattr(counters, attribute) + elapsed)
+        value, error = None, None
+        try:
+            value = yield event
+        except BaseException as e:
+            # failed events are thrown into the process, pass them on
+            error = e
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler: every interval seconds of CPU time SIGPROF
+    records the executing function and every function on its stack.
+    Unix only, and the run must happen on the main thread.
+    """
+
+    def __init__(self, interval: float = 0.001) -> None:
+        self.interval = interval
+        self.samples = 0
+        self.own: Counter = Counter()
+        self.total: Counter = Counter()
+
+    def _sample(self, signum, frame):
+        self.samples += 1
+        self.own[self._key(frame)] += 1
+        seen = set()
+        while frame is not None:
+            key = self._key(frame)
+            if key not in seen:
+                seen.add(key)
+                self.total[key] += 1
+            frame = frame.f_back
+
+    @staticmethod
+    def _key(frame) -> str:
+        code = frame.f_code
+        return f"{code.co_filename}:{code.co_firstlineno}({code.co_name})"
+
+    def runcall(self, function, *args, **kwargs):
+        previous = signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            signal.setitimer(signal.ITIMER_PROF, 0, 0)
+            signal.signal(signal.SIGPROF, previous)
+
+    def report(self, top: int = 20) -> str:
+        tb = PrettyTable(["function", "own_samples", "own_share", "total_share"])
+        for key, count in self.own.most_common(top):
+            tb.add_row([key, count, round(count / self.samples, 4),
+                        round(self.total[key] / self.samples, 4)])
+        tb.align["function"] = "l"
+        return f"{self.samples} samples every {self.interval} s\n{tb}"
+
+
+class Instrumentation:
+    """
+    Per node counters, phase wall times and an optional profiler around
+    the run. Engines only touch it behind an "is not None" check, so runs
+    without it pay one attribute test per event.
+    """
+
+    def __init__(self, profiler: str = None, interval: float = 0.001) -> None:
+        if profiler is not None and profiler not in PROFILERS:
+            raise ValueError(f"unknown profiler {profiler}, expected one of {PROFILERS}")
+        self.nodes: dict[str, NodeCounters] = {}
+        self.phases: dict[str, float] = {}
+        self.profiler = None
+        if profiler == "cprofile":
+            self.profiler = cProfile.Profile()
+        elif profiler == "sampling":
+            self.profiler = SamplingProfiler(interval=interval)
+
+    def node(self, name: str) -> NodeCounters:
+        if name not in self.nodes:
+            self.nodes[name] = NodeCounters()
+        return self.nodes[name]
+
+    def add_phase(self, name: str, seconds: float):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def run(self, function, *args, **kwargs):
+        """
+        Call function under the profiler, timed as the "run" phase
+        """
+        start = time.perf_counter()
+        try:
+            if self.profiler is None:
+                return function(*args, **kwargs)
+            return self.profiler.runcall(function, *args, **kwargs)
+        finally:
+            self.add_phase("run", time.perf_counter() - start)
+
+    def collect(self, systems: list):
+        """
+        Read the draw counts off the random streams of systems
+        """
+        for system in systems:
+            counters = self.node(system.get_name())
+            counters.service_draws = system.service_stream.drawn()
+            counters.routing_draws = system.routing_stream.drawn()
+
+    def report(self, top: int = 20):
+        print(
+            f"------------------------\nInstrumentation (times in seconds)\n------------------------")
+        tb = PrettyTable(["node_name"] + COUNTERS + ["schedule_s", "serve_s"])
+        for name, counters in self.nodes.items():
+            tb.add_row([name] + [getattr(counters, c) for c in COUNTERS]
+                       + [round(counters.schedule_time, 4), round(counters.serve_time, 4)])
+        tb.align["node_name"] = "l"
+        print(tb)
+        for name, seconds in self.phases.items():
+            print(f"{name} = {round(seconds, 4)}")
+
+        if isinstance(self.profiler, cProfile.Profile):
+            out = io.StringIO()
+            pstats.Stats(self.profiler, stream=out).sort_stats("tottime").print_stats(top)
+            print(out.getvalue())
+        elif isinstance(self.profiler, SamplingProfiler):
+            print(self.profiler.report(top))
@@ -0,0 +1,355 @@
+import numpy as np
+import params as pr
+from native_engine import NativeFactory
+from params import load_nodes
+from model import NetworkModel, load, EXIT
+from streams import RandomStreams
+from system_stats import SystemStatistics, GeneratorStatistics, SojournStatistics, BatchMeans, FactoryReport, aggregate, print_result
+from sketches import SampleQuantiles
+
+# config keys the vectorized recursion can model
+NODE_KEYS = {"name", "mean_service_time", "max_servers", "go_to", "queue"}
+QUEUE_KEYS = {"discipline"}
+GENERATOR_KEYS = {"mean_interarrival_time"}
+
+
+def feedback_nodes(model: NetworkModel) -> list[str]:
+    """
+    Nodes on or downstream of a feedback loop, empty for a feed-forward network
+    """
+    indegree = [0] * len(model)
+    for destinations in model.destinations:
+        for j in destinations:
+            if j != EXIT:
+                indegree[j] += 1
+    ready = [i for i in range(len(model)) if indegree[i] == 0]
+    done = set()
+    while ready:
+        i = ready.pop()
+        done.add(i)
+        for j in model.destinations[i]:
+            if j != EXIT:
+                indegree[j] -= 1
+                if indegree[j] == 0:
+                    ready.append(j)
+    return [name for i, name in enumerate(model.names) if i not in done]
+
+
+def topological_order(model: NetworkModel) -> list[int]:
+    order = []
+    seen = set()
+
+    def visit(i: int):
+        if i == EXIT or i in seen:
+            return
+        seen.add(i)
+        for j in model.destinations[i]:
+            visit(j)
+        order.append(i)
+
+    for i in range(len(model)):
+        visit(i)
+    return order[::-1]
+
+
+def check_feed_forward(model: NetworkModel) -> list[str]:
+    """
+    Reasons the network cannot run on the Lindley engine, empty when it can
+    """
+    reasons = []
+    loop = feedback_nodes(model)
+    if len(loop) > 0:
+        reasons.append(f"feedback loop, nodes on or after it: {', '.join(loop)}")
+    for cfg in load_nodes(model.dat):
+        for key in sorted(set(cfg) - NODE_KEYS):
+            reasons.append(f"{cfg['name']}: \"{key}\" is not supported")
+        queue_cfg = cfg.get("queue", {})
+        for key in sorted(set(queue_cfg) - QUEUE_KEYS):
+            reasons.append(f"{cfg['name']}: queue \"{key}\" is not supported")
+        if queue_cfg.get("discipline", "fifo") != "fifo":
+            reasons.append(f"{cfg['name']}: only FIFO queues are supported")
+    for key in sorted(set(model.workload["generator"]) - GENERATOR_KEYS):
+        reasons.append(f"generator: \"{key}\" is not supported")
+    return reasons
+
+
+def fcfs(arrivals: np.ndarray, service: np.ndarray, servers: int) -> np.ndarray:
+    """
+    Service start times at a FCFS station for arrivals sorted along axis 1,
+    one row per replication. Padding arrivals of +inf start at +inf.
+
+    One server uses the closed form of the Lindley recursion,
+    D_n = C_n + max_{k<=n}(A_k - C_{k-1}) with C the cumulative service.
+    More servers use the Kiefer-Wolfowitz recursion over the servers' free
+    times, looping over products but vectorized across replications.
+    """
+    if servers == 1:
+        cumulative = np.cumsum(service, axis=1)
+        departures = cumulative + np.maximum.accumulate(
+            arrivals - (cumulative - service), axis=1)
+        return departures - service
+
+    replications, products = arrivals.shape
+    free = np.zeros((replications, servers))
+    starts = np.empty_like(arrivals)
+    rows = np.arange(replications)
+    for i in range(products):
+        server = free.argmin(axis=1)
+        start = np.maximum(arrivals[:, i], free[rows, server])
+        starts[:, i] = start
+        free[rows, server] = start + service[:, i]
+    return starts
+
+
+class NodeResult:
+    def __init__(self, name: str, stats: SystemStatistics) -> None:
+        self.name = name
+        self.stats = stats
+
+    def get_name(self) -> str:
+        return self.name
+
+    def get_stats(self) -> SystemStatistics:
+        return self.stats
+
+
+class LindleyFactory(FactoryReport):
+    """
+    Compute per-product waits of a feed-forward network in closed form over
+    whole arrays of arrival and service times, for R replications at once
+    along the first array axis.
+
+    Stations are solved in topological order, each one's departures becoming
+    the arrivals of the next. Networks with feedback loops, or features the
+    recursion cannot express, fall back to the native event engine.
+
+    Only single-server stations are vectorized along products. Stations with
+    max_servers > 1 run the Kiefer-Wolfowitz recursion as a Python loop over
+    products, vectorized across replications only, so a single replication
+    runs at a few times the native engine's speed rather than numpy speed.
+    python -m benchmarks.engines --feed-forward shows both cases.
+    """
+
+    def __init__(self, workload_path: str, config_path: str, seed=None, replications: int = 1,
+                 require_stable: bool = True) -> None:
+        self.workload_path = workload_path
+        self.config_path = config_path
+        self.model = load(config_path=config_path, workload_path=workload_path,
+                          require_stable=require_stable)
+        self.workload = self.model.workload
+        self.dat = self.model.dat
+
+        self.verbose = True
+        self.seed = seed
+        self.replications = replications
+        self.sim_time = self.model.simulation_time
+        self.events = 0
+        # per replication: node results and generator statistics
+        self.results: list[list[NodeResult]] = []
+        self.generators: list[GeneratorStatistics] = []
+        self.sojourns: list[SojournStatistics] = []
+        # replication reported by systems(), generator_stats() and sojourn_stats()
+        self.replication = 0
+        self.fallback_summaries: list[dict] = None
+        self.reasons = check_feed_forward(self.model)
+
+    def systems(self) -> list[NodeResult]:
+        return self.results[self.replication]
+
+    def generator_stats(self) -> GeneratorStatistics:
+        return self.generators[self.replication]
+
+    def sojourn_stats(self) -> SojournStatistics:
+        return self.sojourns[self.replication]
+
+    def _arrivals(self, streams: RandomStreams) -> np.ndarray:
+        mean = self.model.mean_interarrival_time
+        rng = streams.generator(node="generator", purpose="interarrival")
+        expected = self.sim_time / mean
+        width = int(expected + 6 * np.sqrt(expected) + 10)
+        interarrivals = rng.exponential(mean, size=(self.replications, width))
+        # extend until every replication generates past the horizon
+        while interarrivals.sum(axis=1).min() <= self.sim_time:
+            interarrivals = np.hstack(
+                [interarrivals, rng.exponential(mean, size=(self.replications, width))])
+        arrivals = np.cumsum(interarrivals, axis=1)
+        arrivals[arrivals > self.sim_time] = np.inf
+        return arrivals
+
+    def _station(self, node: int, arrivals: np.ndarray, streams: RandomStreams):
+        """
+        Solve one station, return departure times and waits indexed like
+        arrivals (+inf for products not done or not started within the
+        horizon) and its statistics
+        """
+        until = self.sim_time
+        order = np.argsort(arrivals, axis=1, kind="stable")
+        width = int(np.isfinite(arrivals).sum(axis=1).max())
+        order = order[:, :width]
+        arrivals_sorted = np.take_along_axis(arrivals, order, axis=1)
+
+        # service draws follow start order, which is arrival order under FCFS
+        name = self.model.names[node]
+        servers = int(self.model.servers[node])
+        rng = streams.generator(node=name, purpose="service")
+        service = np.maximum(
+            rng.exponential(self.model.mean_service_times[node], size=arrivals_sorted.shape),
+            pr.MIN_SERVICE_TIME)
+        starts_sorted = fcfs(arrivals_sorted, service, servers)
+        starts_sorted[starts_sorted > until] = np.inf
+        departures_sorted = starts_sorted + service
+
+        stats = [SystemStatistics(system_name=name)
+                 for _ in range(self.replications)]
+        # padding entries are inf - inf, masked out by the where below
+        with np.errstate(invalid="ignore"):
+            arrived = np.isfinite(arrivals_sorted)
+            started = np.isfinite(starts_sorted)
+            done = departures_sorted <= until
+            in_queue = arrived & ~started
+            last_arrival = np.where(arrived, arrivals_sorted, 0.0).max(axis=1, initial=0.0)
+            wait = np.where(started, starts_sorted - arrivals_sorted, 0.0).sum(axis=1) \
+                + np.where(in_queue, until - arrivals_sorted, 0.0).sum(axis=1)
+            service_time = np.where(done, service, 0.0).sum(axis=1)
+            leave = np.minimum(departures_sorted, until)
+            start_or_end = np.minimum(starts_sorted, until)
+            area_in_node = np.where(arrived, leave - arrivals_sorted, 0.0).sum(axis=1)
+            area_in_queue = np.where(arrived, start_or_end - arrivals_sorted, 0.0).sum(axis=1)
+            area_busy = np.where(started, leave - starts_sorted, 0.0).sum(axis=1)
+            waits_sorted = np.where(started, starts_sorted - arrivals_sorted, np.inf)
+        for r, s in enumerate(stats):
+            s.total_interarrival_time = float(last_arrival[r])
+            s.total_service_requests = int(started[r].sum())
+            s.total_product_count = s.total_service_requests
+            s.in_queue_at_end = int(in_queue[r].sum())
+            s.total_wait_time = float(wait[r])
+            s.total_service_time = float(service_time[r])
+            for stat, area in ((s.in_system, area_in_node[r]),
+                               (s.queue_length, area_in_queue[r]),
+                               (s.busy_servers, area_busy[r])):
+                stat.area = float(area)
+                stat.last_time = until
+            s.close(now=until)
+            s.update_utilization(servers)
+            s.wait_quantiles = SampleQuantiles(waits_sorted[r][started[r]])
+            s.wait_batches = BatchMeans.from_values(waits_sorted[r][started[r]])
+        self.events += int(arrived.sum())
+
+        departures = np.full(arrivals.shape, np.inf)
+        np.put_along_axis(departures, order,
+                          np.where(done, departures_sorted, np.inf), axis=1)
+        waits = np.full(arrivals.shape, np.inf)
+        np.put_along_axis(waits, order, waits_sorted, axis=1)
+        return departures, waits, stats
+
+    def _route(self, node: int, departures: np.ndarray, streams: RandomStreams) -> np.ndarray:
+        """
+        Destination index into the node's go_to of every departing product,
+        drawing routing uniforms in departure order
+        """
+        order = np.argsort(departures, axis=1, kind="stable")
+        width = int(np.isfinite(departures).sum(axis=1).max())
+        rng = streams.generator(node=self.model.names[node], purpose="routing")
+        uniforms = np.full(departures.shape, 0.0)
+        np.put_along_axis(uniforms, order[:, :width],
+                          rng.random(size=(self.replications, width)), axis=1)
+        return self.model.alias_tables[node].sample_array(uniforms)
+
+    def run(self):
+        streams = RandomStreams(seed=self.seed)
+        arrivals = self._arrivals(streams)
+
+        generators = []
+        for r in range(self.replications):
+            g = GeneratorStatistics(env=None)
+            g.get_theoretical(
+                mean_interarrival_time=self.model.mean_interarrival_time)
+            generated = np.isfinite(arrivals[r])
+            g.total_generated = int(generated.sum())
+            g.total_interarrival_time = float(arrivals[r][generated].max(initial=0.0))
+            generators.append(g)
+        self.generators = generators
+
+        node_arrivals = [np.full(arrivals.shape, np.inf) for _ in range(len(self.model))]
+        node_arrivals[0] = arrivals
+        node_stats = [None] * len(self.model)
+        # products keep their column from node to node, so these follow them
+        hops = np.zeros(arrivals.shape, dtype=np.int64)
+        total_wait = np.zeros(arrivals.shape)
+        exit_time = np.full(arrivals.shape, np.inf)
+        for node in topological_order(self.model):
+            departures, waits, node_stats[node] = self._station(
+                node, node_arrivals[node], streams)
+            hops += np.isfinite(node_arrivals[node])
+            total_wait += np.where(np.isfinite(waits), waits, 0.0)
+            done = np.isfinite(departures)
+            if len(self.model.destinations[node]) == 0:
+                exit_time[done] = departures[done]
+                continue
+            destination = self._route(node, departures, streams)
+            for i, j in enumerate(self.model.destinations[node]):
+                chosen = (destination == i) & done
+                if j != EXIT:
+                    target = node_arrivals[j]
+                    target[chosen] = departures[chosen]
+                else:
+                    exit_time[chosen] = departures[chosen]
+
+        self.sojourns = []
+        for r in range(self.replications):
+            exited = np.flatnonzero(np.isfinite(exit_time[r]))
+            exited = exited[np.argsort(exit_time[r][exited], kind="stable")]
+            self.sojourns.append(SojournStatistics.from_samples(
+                sojourn=exit_time[r][exited] - arrivals[r][exited],
+                wait=total_wait[r][exited],
+                hops=hops[r][exited]))
+
+        self.results = [[NodeResult(name, node_stats[i][r])
+                         for i, name in enumerate(self.model.names)]
+                        for r in range(self.replications)]
+
+    def _run_fallback(self):
+        seeds = [self.seed]
+        if self.replications > 1:
+            seeds = np.random.SeedSequence(self.seed).spawn(self.replications)
+        self.fallback_summaries = []
+        for seed in seeds:
+            factory = NativeFactory(workload_path=self.workload_path,
+                                    config_path=self.config_path, seed=seed,
+                                    require_stable=self.model.require_stable)
+            factory.open(verbose=False)
+            self.events += factory.events
+            self.fallback_summaries.append(factory.summary())
+            if len(self.results) == 0:
+                self.results = [factory.systems()]
+                self.generators = [factory.generator_stats()]
+                self.sojourns = [factory.sojourn_stats()]
+
+    def summaries(self) -> list[dict]:
+        """
+        One summary per replication
+        """
+        if self.fallback_summaries is not None:
+            return self.fallback_summaries
+        summaries = []
+        for r in range(self.replications):
+            self.replication = r
+            summaries.append(self.summary())
+        self.replication = 0
+        return summaries
+
+    def open(self, verbose: bool = True):
+        self.verbose = verbose
+        if len(self.reasons) > 0:
+            if self.verbose:
+                print("Lindley engine falls back to the native event engine:\n  "
+                      + "\n  ".join(self.reasons))
+            self._run_fallback()
+        else:
+            self.run()
+        if not self.verbose:
+            return
+        if self.replications == 1:
+            self.stats()
+        else:
+            print_result(aggregate(self.summaries()))
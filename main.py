@@ -1,47 +1,18 @@
 import simpy as sp
-import numpy as np
 import params as pr
-import sys
+import argparse
+import time
 from product import Product
 from systems import ProductionLine, QACheck, Dispatcher, Destination
-from typing import List
-from prettytable import PrettyTable
-import json
-
-
-class GeneratorStatistics:
-    def __init__(self, env: sp.Environment) -> None:
-        self.env = env
-
-        self.total_generated: int = 0
-        self.total_interarrival_time: float = 0.0
-        self.theoretical_arrival_rate: float = 0.0
-
-    def add_total_generated(self):
-        self.total_generated += 1
-
-    def avg_interarrival_time(self) -> float:
-        if self.total_generated == 0:
-            return 0.0
-        return self.total_interarrival_time / self.total_generated
-    
-    def arrival_rate(self) -> float:
-        return 3600 / self.avg_interarrival_time()
-
-    def update_interarrival_time(self, last_time: float):
-        self.total_interarrival_time += last_time
-        
-    def get_theoretical(self, mean_interarrival_time: float) -> float:
-        self.theoretical_arrival_rate = 3600 / mean_interarrival_time
-        return
-
-    def list_stats(self) -> List:
-        return [self.total_generated, round(self.avg_interarrival_time(), 4)]
-
-    def __str__(self) -> str:
-        return f"""total_generated: {self.total_generated}
-arrival_rate (actual / theory / diff): {str(round(self.arrival_rate(), 4)) + " / " + str(round(self.theoretical_arrival_rate, 4)) + " / " + str(abs(round(self.arrival_rate() - self.theoretical_arrival_rate, 4)))}
-"""
+from streams import RandomStreams
+from system_stats import GeneratorStatistics, SojournStatistics, FactoryReport, precision_reached
+from instrument import Instrumentation, PROFILERS
+from model import load, EXIT
+from routing import LoadIndex
+from snapshots import SnapshotWriter, WindowStatistics
+from native_engine import NativeFactory
+from ctmc_engine import CTMCFactory
+from lindley_engine import LindleyFactory
 
 
 class Generator:
@@ -50,25 +21,30 @@ class Generator:
         env: sp.Environment,
         params: pr.GeneratorParams,
         dispatcher: Dispatcher,
+        streams: RandomStreams,
     ) -> None:
         self.env = env
         self.params = params
         self.dispatcher = dispatcher
+        self.interarrival_stream = streams.interarrival(params=self.params)
         self.current_id = 0
         self.stats = GeneratorStatistics(env=self.env)
-        self.stats.get_theoretical(mean_interarrival_time=self.params.mean_interarrival_time)
+        self.stats.get_theoretical(
+            mean_interarrival_time=self.params.mean_interarrival_time / self.params.batch_size)
 
     def generate(self):
         while True:
-            interarrival = np.random.exponential(
-                self.params.mean_interarrival_time)
+            interarrival = self.interarrival_stream.next()
             yield self.env.timeout(interarrival)
             # print(f"At time t = {self.env.now}, Generate NEW_PRODUCT")
             self.stats.update_interarrival_time(last_time=interarrival)
-            self.stats.add_total_generated()
+            # one timeout for the whole batch, the products still arrive one by one
+            for _ in range(self.params.batch_size):
+                self.stats.add_total_generated()
 
-            self.dispatcher.add_product(
-                product=Product(name=self._random_name()))
+                product = Product(name=self._random_name(), arrival_time=self.env.now)
+                while not self.dispatcher.add_product(product=product):
+                    yield self.dispatcher.wait_for_space()
 
     def _random_name(self) -> str:
         curr_id = self.current_id
@@ -82,61 +58,120 @@ class Generator:
         self.env.process(self.generate())
 
 
-class Factory:
-    def __init__(self, workload_path: str, config_path: str) -> None:
+class Factory(FactoryReport):
+    def __init__(self, workload_path: str, config_path: str, seed=None, monitor_resolution: float = None,
+                 instrumentation: Instrumentation = None, snapshots: pr.SnapshotParams = None,
+                 require_stable: bool = True) -> None:
+        build_start = time.perf_counter()
         self.env = sp.Environment()
-        self.workload = None
-        self.get_workload(config_path=workload_path)
-        self.dat = None
-        self.configure(config_path=config_path)
-
-        self.products = self._generate_systems()
-
-        # self.products += self._generate_systems_check()
-        dispatcher_cfg = self.dat["dispatcher"]
-
-        # Initialize dispatcher
-        dispatcher_go_to = dispatcher_cfg["go_to"]
-        product_lines: list[Destination] = []
-        for place in dispatcher_go_to:
-            name = place["name"]
-            probability = place["probability"]
-            system = self.products[name]
-            product_lines.append(Destination(
-                name=name,
-                probability=probability,
-                system=system
-            ))
-
-        self.dispatcher = Dispatcher(
-            env=self.env,
-            params=pr.SystemParams(
-                name=dispatcher_cfg["name"],
-                max_servers=dispatcher_cfg["max_servers"],
-            ),
-            server_params=pr.ServerParams(
-                mean_service_time=dispatcher_cfg["mean_service_time"],
-            ),
-            production_lines=product_lines
-        )
+        self.verbose = True
+        self.streams = RandomStreams(seed=seed)
+        # require_stable False simulates overloaded networks, whose queues grow
+        self.model = load(config_path=config_path, workload_path=workload_path,
+                          require_stable=require_stable)
+        self.workload = self.model.workload
+        self.dat = self.model.dat
+        # integer node ids, in the same order as NativeFactory's node indices
+        self.node_ids = self.model.index
+
+        self.products, self.qa_check, self.dispatcher = self._generate_systems()
 
-        generator_cfg = self.workload["generator"]
         self.generator = Generator(
             env=self.env,
-            params=pr.GeneratorParams(
-                mean_interarrival_time=generator_cfg["mean_interarrival_time"]
-            ),
+            params=self.model.generator,
             dispatcher=self.dispatcher,
+            streams=self.streams,
         )
 
         sim_time = self.workload["simulation_time"]
         pr.SIM_DURATION = sim_time
+        self.sim_time = sim_time
+        self.precision = pr.PrecisionParams.from_config(workload=self.workload)
+
+        self.sojourn = SojournStatistics()
+        for system in self.systems():
+            system.set_sojourn_statistics(sojourn=self.sojourn)
+
+        if monitor_resolution is not None:
+            for system in self.systems():
+                system.monitor(resolution=monitor_resolution, duration=sim_time)
+
+        self.snapshots: SnapshotWriter = None
+        if snapshots is not None:
+            self.snapshots = SnapshotWriter(path=snapshots.path, interval=snapshots.interval)
+
+        self.windows: WindowStatistics = None
+        if self.model.windows is not None:
+            self.windows = WindowStatistics(params=self.model.windows)
+
+        self.instrumentation = instrumentation
+        if instrumentation is not None:
+            for system in self.systems():
+                system.instrument(instrumentation.node(system.get_name()))
+            instrumentation.add_phase("build", time.perf_counter() - build_start)
+
+    def systems(self) -> list:
+        return [self.dispatcher] + list(self.products.values()) + list(self.qa_check.values())
+
+    def generator_stats(self) -> GeneratorStatistics:
+        return self.generator.get_stats()
+
+    def sojourn_stats(self) -> SojournStatistics:
+        return self.sojourn
+
+    def watch_precision(self):
+        """
+        Return once every node's steady-state mean wait is precise enough
+        """
+        while True:
+            yield self.env.timeout(self.precision.check_interval)
+            if precision_reached([s.get_stats() for s in self.systems()],
+                                 relative_half_width=self.precision.relative_half_width,
+                                 confidence=self.precision.confidence):
+                return
+
+    def _snapshot(self):
+        self.snapshots.write(self.env.now, [(s.get_name(), s.get_stats(), s.params.max_servers)
+                                            for s in self.systems()])
+
+    def watch_snapshots(self):
+        """
+        Write a snapshot every interval, reading statistics only
+        """
+        while True:
+            yield self.env.timeout(self.snapshots.interval)
+            self._snapshot()
+
+    def _record_window(self):
+        self.windows.record(self.env.now, [(s.get_name(), s.get_stats(), s.params.max_servers)
+                                           for s in self.systems()])
+
+    def watch_windows(self):
+        """
+        Close a shift window at every shift change
+        """
+        while True:
+            yield self.env.timeout(self.windows.next_boundary(self.env.now) - self.env.now)
+            self._record_window()
 
     # MMN0208: Add close function
     def close(self):
-        yield self.env.timeout(pr.SIM_DURATION)
-        print(
-            f"------------------------\nAt time t =  {self.env.now}, Factory CLOSES\n------------------------")
+        if self.precision is None:
+            yield self.env.timeout(pr.SIM_DURATION)
+        else:
+            yield self.env.timeout(pr.SIM_DURATION) | self.env.process(self.watch_precision())
+            if self.env.now < pr.SIM_DURATION and self.verbose:
+                print(f"Precision target reached at t = {self.env.now}, stopping early")
+        self.sim_time = self.env.now
+        if self.snapshots is not None:
+            if self.snapshots.last_time != self.env.now:
+                self._snapshot()
+            self.snapshots.close()
+        if self.windows is not None:
+            self._record_window()
+        if self.verbose:
+            print(
+                f"------------------------\nAt time t =  {self.env.now}, Factory CLOSES\n------------------------")
         self.dispatcher.stop()
         for line in self.products:
             self.products[line].stop()
@@ -145,126 +180,76 @@ class Factory:
             self.qa_check[qa].stop()
         return
 
-    def configure(self, config_path: str):
-        f = open(config_path)
-        self.dat = json.load(f)
-        f.close()
-        return
-    
-    def get_workload(self, config_path: str):
-        f = open(config_path)
-        self.workload = json.load(f)
-        f.close()
-        return
-
-    def open(self):
-        print(
-            f"------------------------\nAt time t =  {self.env.now}, Factory OPENS\n------------------------")
+    def open(self, verbose: bool = True):
+        self.verbose = verbose
+        if self.verbose:
+            print(
+                f"------------------------\nAt time t =  {self.env.now}, Factory OPENS\n------------------------")
         self._start_products()
         self.dispatcher.run()
         self.generator.run()
+        if self.snapshots is not None:
+            self.env.process(self.watch_snapshots())
+        if self.windows is not None:
+            self.env.process(self.watch_windows())
         proc = self.env.process(self.close())
-        self.env.run(until=proc)
-        self.stats()
-
-    def _generate_systems(self) -> dict[str, ProductionLine]:
-        productionline: dict[str, ProductionLine] = {}
-        qa_check: dict[str, QACheck] = {}
-
-        qa_cfgs = self.dat["qa_check"]
-
-        # Initialize all QA check lines
-        for cfg in qa_cfgs:
-            name = cfg["name"]
-
-            qa_check[name] = QACheck(
-                env=self.env,
-                params=pr.SystemParams(
-                    name=name,
-                    max_servers=cfg["max_servers"]
-                ),
-                server_params=pr.ServerParams(
-                    mean_service_time=cfg["mean_service_time"]
-                ),
-                go_to=[]
-            )
+        if self.instrumentation is None:
+            self.env.run(until=proc)
+        else:
+            self.instrumentation.run(self.env.run, until=proc)
+            self.instrumentation.collect(self.systems())
+        if self.verbose:
+            self.stats()
+            if self.instrumentation is not None:
+                self.instrumentation.report()
+
+    def _system(self, cls, cfg: dict, **destinations):
+        i = self.model.index[cfg["name"]]
+        return cls(
+            env=self.env,
+            params=pr.SystemParams(
+                name=cfg["name"],
+                max_servers=int(self.model.servers[i]),
+                queue=self.model.queues[i],
+                node_id=i,
+                batch=self.model.batches[i],
+            ),
+            server_params=pr.ServerParams(
+                mean_service_time=cfg["mean_service_time"],
+                service=self.model.services[i],
+            ),
+            streams=self.streams,
+            **destinations,
+        )
 
-        self.qa_check = qa_check
-
-        cfgs = self.dat["productionlines"]
-
-        # Initialize all production lines
-        for productionline_cfg in cfgs:
-            name = productionline_cfg["name"]
-            go_to = productionline_cfg["go_to"]
-
-            # collect all destination QA check lines for a production line
-            destination_qa_check = []
-            if len(go_to) > 0:
-                for where in go_to:
-                    dest_name = where["name"]
-
-                    if dest_name == "exit":
-                        destination = Destination(
-                            name=dest_name,
-                            probability=where["probability"],
-                            system=None
-                        )
-                        destination_qa_check.append(destination)
-                        continue
-
-                    destination = Destination(
-                        name=dest_name,
-                        probability=where["probability"],
-                        system=qa_check[dest_name]
-                    )
-                    destination_qa_check.append(destination)
-
-            productionline[name] = ProductionLine(
-                env=self.env,
-                params=pr.SystemParams(
-                    name=productionline_cfg["name"],
-                    max_servers=productionline_cfg["max_servers"],
-                ),
-                server_params=pr.ServerParams(
-                    mean_service_time=productionline_cfg["mean_service_time"],
-                ),
-                qa_check=destination_qa_check,
+    def _generate_systems(self) -> tuple[dict[str, ProductionLine], dict[str, QACheck], Dispatcher]:
+        dispatcher = self._system(Dispatcher, self.dat["dispatcher"], production_lines=[])
+        productionline = {cfg["name"]: self._system(ProductionLine, cfg, qa_check=[])
+                          for cfg in self.dat["productionlines"]}
+        qa_check = {cfg["name"]: self._system(QACheck, cfg, go_to=[])
+                    for cfg in self.dat["qa_check"]}
+
+        # every system exists now, in model index order, so routes can point anywhere
+        by_index = [dispatcher] + list(productionline.values()) + list(qa_check.values())
+        model = self.model
+        self.load_index: LoadIndex = None
+        if any(policy.policy != "probabilistic" for policy in model.policies):
+            self.load_index = LoadIndex(servers=model.servers,
+                                        mean_service_times=model.mean_service_times)
+            for system in by_index:
+                system.track_load(self.load_index)
+        for i, system in enumerate(by_index):
+            system.set_destinations(
+                destinations=[Destination(
+                    name="exit" if j == EXIT else model.names[j],
+                    probability=p,
+                    system=None if j == EXIT else by_index[j],
+                ) for j, p in zip(model.destinations[i], model.probabilities[i])],
+                table=model.alias_tables[i],
+                nodes=model.destinations[i],
+                policy=model.policies[i],
             )
-
-        for cfg in qa_cfgs:
-            name = cfg["name"]
-
-            qa_check_line = qa_check[name]
-            destinations: list[ProductionLine] = []
-
-            go_to_list = cfg["go_to"]
-
-            for dest in go_to_list:
-                name = dest["name"]
-                probability = dest["probability"]
-
-                if name == "exit":
-                    destinations.append(Destination(
-                        name=name,
-                        probability=probability,
-                        system=None,
-                    ))
-                    continue
-
-                system = productionline[name]
-
-                destinations.append(Destination(
-                    name=name,
-                    probability=probability,
-                    system=system
-                ))
-
-            # set product line destinations for QA check lines
-            qa_check_line.set_product_lines_destinations(
-                destinations=destinations)
-
-        return productionline
+        return productionline, qa_check, dispatcher
 
     def _start_products(self):
         for line in self.products:
@@ -273,37 +258,104 @@ class Factory:
         for qa in self.qa_check:
             self.qa_check[qa].run()
 
-    def stats(self):
-        avg_products_in_sys = 0.0
-        print(
-            f"------------------------\nSimulation duration = {pr.SIM_DURATION}\n------------------------")
-        tb = PrettyTable(["node_name", "arrival_rate",
-                         "service_rate", "utilization", "avg_products_in_node", "avg_products_in_queue", "no_processed", "no_remaining"])
-        
-        avg_products_in_sys += self.dispatcher.get_stats().get_avg_in_sys()
-        tb.add_row(self.dispatcher.get_stats().list_stats())
-        for line in self.products:
-            r = self.products[line]
-            avg_products_in_sys += r.get_stats().get_avg_in_sys()
-            tb.add_row(r.get_stats().list_stats())
-
-        for qa in self.qa_check:
-            r = self.qa_check[qa]
-            avg_products_in_sys += r.get_stats().get_avg_in_sys()
-            tb.add_row(r.get_stats().list_stats())
-        tb.align["system_name"] = "l"
-
-        print(tb)
-        
-        print(f"avg_products_in_sys = {round(avg_products_in_sys, 4)}")
-        print(f"avg_sys_response_time = {round(avg_products_in_sys / self.generator.get_stats().arrival_rate(), 4)}")
-        
-        print(
-            f"------------------------\nGenerator statistics\n------------------------")
-        print(self.generator.get_stats())
+ENGINES = {
+    "simpy": Factory,
+    "native": NativeFactory,
+    "ctmc": CTMCFactory,
+    "lindley": LindleyFactory,
+}
 
 
 if __name__ == "__main__":
-    workload_path = str(sys.argv[1])
-    ms = Factory(workload_path=workload_path,config_path="./config.json")
+    parser = argparse.ArgumentParser(description="Simulate the factory network")
+    parser.add_argument("workload", nargs="?", default=None,
+                        help="path to the workload file, not needed with --resume")
+    parser.add_argument("--config", default="./config.json",
+                        help="path to the network config file")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="seed for the random streams")
+    parser.add_argument("--monitor-resolution", type=float, default=None,
+                        help="also sample queue length and busy servers every this many seconds")
+    parser.add_argument("--engine", choices=list(ENGINES), default="simpy",
+                        help="simulation engine")
+    parser.add_argument("--allow-unstable", action="store_true",
+                        help="simulate a network with a node at utilization >= 1 instead of refusing it")
+    parser.add_argument("--replications", type=int, default=None,
+                        help="replications computed at once by the lindley engine, its stations "
+                             "with more than one server are vectorized across replications only")
+    parser.add_argument("--instrument", action="store_true",
+                        help="count events per node and time the build, run, schedule and serve phases")
+    parser.add_argument("--profile", choices=PROFILERS, default=None,
+                        help="also profile the run, implies --instrument")
+    parser.add_argument("--checkpoint", default=None,
+                        help="keep the latest simulation state in this file (native engine), "
+                             "with --resume a new file for the branch")
+    parser.add_argument("--checkpoint-interval", type=float, default=86400,
+                        help="simulated seconds between two checkpoints")
+    parser.add_argument("--resume", default=None,
+                        help="continue from this checkpoint, --seed branches it onto new random streams")
+    parser.add_argument("--until", type=float, default=None,
+                        help="with --resume, simulate up to this time instead of the checkpointed horizon")
+    parser.add_argument("--servers", nargs="+", default=[], metavar="NODE=N",
+                        help="with --resume, change max_servers of these nodes")
+    parser.add_argument("--snapshots", default=None,
+                        help="write per node statistics snapshots to this NDJSON file during the run")
+    parser.add_argument("--snapshot-interval", type=float, default=3600,
+                        help="simulated seconds between two snapshots")
+    args = parser.parse_args()
+
+    snapshots = None
+    if args.snapshots is not None:
+        snapshots = pr.SnapshotParams(path=args.snapshots, interval=args.snapshot_interval)
+
+    if args.resume is not None:
+        if args.instrument or args.profile is not None:
+            parser.error("--instrument and --profile cannot be combined with --resume")
+        try:
+            servers = {name: int(n) for name, n in
+                       (item.split("=", 1) for item in args.servers)}
+        except ValueError:
+            parser.error("--servers takes NODE=N pairs")
+        checkpoint = None
+        if args.checkpoint is not None:
+            checkpoint = pr.CheckpointParams(path=args.checkpoint, interval=args.checkpoint_interval)
+        try:
+            ms = NativeFactory.resume(args.resume, seed=args.seed, simulation_time=args.until,
+                                      servers=servers, snapshots=snapshots,
+                                      checkpoint=checkpoint)
+        except (OSError, ValueError) as e:
+            parser.exit(2, f"error: {e}\n")
+        ms.open()
+        parser.exit(0)
+    if args.workload is None:
+        parser.error("give a workload file or --resume")
+    if args.until is not None or len(args.servers) > 0:
+        parser.error("--until and --servers need --resume")
+
+    kwargs = {}
+    if args.allow_unstable:
+        kwargs["require_stable"] = False
+    if args.monitor_resolution is not None:
+        kwargs["monitor_resolution"] = args.monitor_resolution
+    if args.replications is not None:
+        kwargs["replications"] = args.replications
+    if args.instrument or args.profile is not None:
+        if args.engine not in ("simpy", "native"):
+            parser.error("--instrument and --profile need the simpy or native engine")
+        kwargs["instrumentation"] = Instrumentation(profiler=args.profile)
+    if args.checkpoint is not None:
+        if args.engine != "native":
+            parser.error("--checkpoint needs the native engine, SimPy processes cannot be saved")
+        kwargs["checkpoint"] = pr.CheckpointParams(
+            path=args.checkpoint, interval=args.checkpoint_interval)
+    if snapshots is not None:
+        if args.engine not in ("simpy", "native"):
+            parser.error("--snapshots needs the simpy or native engine")
+        kwargs["snapshots"] = snapshots
+    try:
+        ms = ENGINES[args.engine](workload_path=args.workload,
+                                  config_path=args.config, seed=args.seed,
+                                  **kwargs)
+    except ValueError as e:
+        parser.exit(2, f"error: {e}\n")
     ms.open()
\ No newline at end of file
@@ -0,0 +1,255 @@
+import copy
+import json
+import math
+import os
+import numpy as np
+from types import MappingProxyType
+from params import (load_nodes, QueueParams, ServiceParams, RoutingParams, BatchParams,
+                    GeneratorParams, WindowParams)
+from routing import AliasTable
+
+# destination index of products leaving the factory
+EXIT = -1
+# a node's routing probabilities must sum to one within this
+PROBABILITY_TOLERANCE = 1e-6
+SECTIONS = ("dispatcher", "productionlines", "qa_check")
+
+
+def _frozen(values, dtype) -> np.ndarray:
+    array = np.array(values, dtype=dtype)
+    array.flags.writeable = False
+    return array
+
+
+class NetworkModel:
+    """
+    Validated, immutable form of a config and workload: nodes addressed by
+    their index in load_nodes order, a dense routing matrix, per node rate
+    arrays, alias tables and the traffic-equation arrival rates.
+
+    Engines and the analytic solver read the network from here instead of
+    walking the JSON, so every mistake in the files is reported before a run
+    starts. Use compile_model on dicts, or load to share one model between
+    runs of the same files.
+    """
+
+    def __init__(self, dat: dict, workload: dict, require_stable: bool = True) -> None:
+        problems = check_files(dat, workload)
+        if len(problems) > 0:
+            raise ValueError("invalid network:\n  " + "\n  ".join(problems))
+
+        # private copies, so later edits of the caller's dicts cannot leak in
+        self.require_stable = require_stable
+        self.dat = copy.deepcopy(dat)
+        self.workload = copy.deepcopy(workload)
+        cfgs = load_nodes(self.dat)
+        n = len(cfgs)
+
+        self.names = tuple(cfg["name"] for cfg in cfgs)
+        self.index = MappingProxyType({name: i for i, name in enumerate(self.names)})
+        self.servers = _frozen([cfg["max_servers"] for cfg in cfgs], np.int64)
+        self.mean_service_times = _frozen([cfg["mean_service_time"] for cfg in cfgs], float)
+        self.queues = tuple(QueueParams.from_config(cfg=cfg) for cfg in cfgs)
+        self.batches = tuple(BatchParams.from_config(cfg=cfg) for cfg in cfgs)
+        self.batch_sizes = _frozen([1 if b is None else b.size for b in self.batches], np.int64)
+        # products per second of one server, with full batches at batch nodes
+        self.service_rates = _frozen(self.batch_sizes / self.mean_service_times, float)
+        self.services = tuple(ServiceParams.from_config(cfg=cfg) for cfg in cfgs)
+        # service_rates with an exponential mean raised by its minimum clamp,
+        # the rates the stability check and capacity planning go by
+        self.effective_service_rates = _frozen(
+            [size / _clamped_mean(mean, service) for size, mean, service in
+             zip(self.batch_sizes, self.mean_service_times, self.services)], float)
+        # load-aware policies pick among node destinations, the traffic
+        # equations below still describe the probabilistic routing
+        self.policies = tuple(RoutingParams.from_config(cfg=cfg) for cfg in cfgs)
+
+        # go_to order is kept, it is the order routing draws are mapped in
+        self.destinations = tuple(
+            tuple(self.index.get(dest["name"], EXIT) for dest in cfg["go_to"])
+            for cfg in cfgs)
+        self.probabilities = tuple(
+            tuple(float(dest["probability"]) for dest in cfg["go_to"]) for cfg in cfgs)
+        self.alias_tables = tuple(
+            AliasTable(probabilities) if len(probabilities) > 0 else None
+            for probabilities in self.probabilities)
+        routing = np.zeros((n, n))
+        for i, (destinations, probabilities) in enumerate(
+                zip(self.destinations, self.probabilities)):
+            for j, p in zip(destinations, probabilities):
+                if j != EXIT:
+                    routing[i, j] += p
+        routing.flags.writeable = False
+        # P[i, j] of moving from node i to node j, rows sum to one minus the exit probability
+        self.routing = routing
+        self.exit_probabilities = _frozen(1.0 - routing.sum(axis=1), float)
+
+        self.generator = GeneratorParams.from_config(workload=self.workload)
+        # shifts and days of the per window statistics, None without them
+        self.windows = WindowParams.from_config(workload=self.workload, generator=self.generator)
+        # a trace replays its own gaps and a rate profile keeps this mean,
+        # it still drives the analytic model
+        self.mean_interarrival_time = self.generator.mean_interarrival_time
+        # products per second, batch arrivals bring batch_size at once
+        self.external_rate = self.generator.batch_size / self.mean_interarrival_time
+        self.simulation_time = self.workload["simulation_time"]
+        external = np.zeros(n)
+        external[0] = self.external_rate
+        self.external_rates = _frozen(external, float)
+
+        # traffic equations lambda = gamma + lambda P
+        try:
+            arrival_rates = np.linalg.solve(np.eye(n) - routing.T, external)
+        except np.linalg.LinAlgError:
+            arrival_rates = np.full(n, np.nan)
+        if not np.all(np.isfinite(arrival_rates)) or np.any(arrival_rates < -1e-12):
+            raise ValueError("invalid network: products can never reach the exit, "
+                             "the traffic equations have no solution")
+        self.arrival_rates = _frozen(np.maximum(arrival_rates, 0.0), float)
+        self.utilizations = _frozen(
+            self.arrival_rates / (self.servers * self.service_rates), float)
+
+        if require_stable:
+            problems = self.unstable()
+            if len(problems) > 0:
+                raise ValueError("unstable network, queues grow without bound "
+                                 "(simulate it anyway with --allow-unstable):\n  "
+                                 + "\n  ".join(problems))
+        self._frozen = True
+
+    def __setattr__(self, name, value):
+        if getattr(self, "_frozen", False):
+            raise AttributeError(f"NetworkModel is immutable, cannot set {name}")
+        super().__setattr__(name, value)
+
+    def __reduce__(self):
+        # MappingProxyType does not pickle, compile the model again instead
+        return NetworkModel, (self.dat, self.workload, self.require_stable)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def unstable(self) -> list[str]:
+        """
+        Nodes with an unbounded queue whose utilization is not below one,
+        at the effective service rates, batches taken as full
+        """
+        problems = []
+        for i, name in enumerate(self.names):
+            if self.queues[i].capacity is not None:
+                # a bounded queue balks or blocks instead of growing
+                continue
+            rho = self.arrival_rates[i] / (self.servers[i] * self.effective_service_rates[i])
+            if not 0 <= rho < 1:
+                problems.append(f"{name}: utilization {rho:.4f}")
+        return problems
+
+
+def check_files(dat: dict, workload: dict) -> list[str]:
+    """
+    Mistakes in a config and workload, empty when they describe a network
+    """
+    problems = []
+    for section in SECTIONS:
+        if section not in dat:
+            problems.append(f"config: missing \"{section}\"")
+    generator_cfg = workload.get("generator", {})
+    if not _positive(generator_cfg.get("mean_interarrival_time")):
+        problems.append("workload: generator mean_interarrival_time must be a positive number")
+    if not _positive(workload.get("simulation_time")):
+        problems.append("workload: simulation_time must be a positive number")
+    elif "generator" in workload:
+        try:
+            generator = GeneratorParams.from_config(workload=workload)
+            WindowParams.from_config(workload=workload, generator=generator)
+        except ValueError as e:
+            problems.append(str(e))
+        except (KeyError, TypeError) as e:
+            problems.append(f"workload: malformed generator or windows settings: {e}")
+    if len(problems) > 0:
+        return problems
+
+    cfgs = load_nodes(dat)
+    names = [cfg.get("name") for cfg in cfgs]
+    for name in set(names):
+        if names.count(name) > 1:
+            problems.append(f"{name}: node name used {names.count(name)} times")
+    if "exit" in names:
+        problems.append("exit: reserved for products leaving the factory, not a node name")
+
+    for cfg in cfgs:
+        name = cfg.get("name", "<unnamed>")
+        if not _positive(cfg.get("mean_service_time")):
+            problems.append(f"{name}: mean_service_time must be a positive number")
+        servers = cfg.get("max_servers")
+        if not isinstance(servers, int) or isinstance(servers, bool) or servers < 1:
+            problems.append(f"{name}: max_servers must be a positive integer")
+        for params in (QueueParams, ServiceParams, RoutingParams, BatchParams):
+            try:
+                params.from_config(cfg=cfg)
+            except ValueError as e:
+                problems.append(str(e))
+            except (KeyError, TypeError) as e:
+                problems.append(f"{name}: malformed {params.__name__} settings: {e}")
+
+        go_to = cfg.get("go_to")
+        if not isinstance(go_to, list):
+            problems.append(f"{name}: go_to must be a list of destinations")
+            continue
+        total = 0.0
+        for dest in go_to:
+            if dest.get("name") not in names and dest.get("name") != "exit":
+                problems.append(f"{name}: routes to unknown node {dest.get('name')}")
+            p = dest.get("probability")
+            if not _number(p) or not 0 <= p <= 1:
+                problems.append(f"{name}: probability of {dest.get('name')} must be in [0, 1]")
+            else:
+                total += p
+        if len(go_to) > 0 and abs(total - 1) > PROBABILITY_TOLERANCE:
+            problems.append(f"{name}: routing probabilities sum to {total:g}, not 1")
+    if len(dat["dispatcher"].get("go_to", [])) == 0:
+        problems.append(f"{dat['dispatcher'].get('name')}: the dispatcher routes nowhere")
+    return problems
+
+
+def _clamped_mean(mean: float, service: ServiceParams) -> float:
+    if service.distribution == "exponential" and service.minimum is not None:
+        # E[max(X, m)] of an exponential X
+        return service.minimum + mean * math.exp(-service.minimum / mean)
+    return mean
+
+
+def _number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+def _positive(value) -> bool:
+    return _number(value) and value > 0
+
+
+def compile_model(dat: dict, workload: dict, require_stable: bool = True) -> NetworkModel:
+    return NetworkModel(dat, workload, require_stable=require_stable)
+
+
+# compiled models by file identity, so runs of the same files in one
+# process (replications, sweeps) parse and validate them once
+_CACHE: dict[tuple, NetworkModel] = {}
+
+
+def _identity(path: str) -> tuple:
+    stat = os.stat(path)
+    return os.path.realpath(path), stat.st_mtime_ns, stat.st_size
+
+
+def load(config_path: str, workload_path: str, require_stable: bool = True) -> NetworkModel:
+    """
+    Compiled model of a config and workload file, cached until either changes
+    """
+    key = (_identity(config_path), _identity(workload_path), require_stable)
+    if key not in _CACHE:
+        with open(config_path) as f:
+            dat = json.load(f)
+        with open(workload_path) as f:
+            workload = json.load(f)
+        _CACHE[key] = compile_model(dat, workload, require_stable=require_stable)
+    return _CACHE[key]
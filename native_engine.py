@@ -0,0 +1,531 @@
+import heapq
+import os
+import pickle
+import params as pr
+from collections import deque
+from time import perf_counter
+from instrument import Instrumentation, NodeCounters
+from snapshots import SnapshotWriter, WindowStatistics
+from product import Product
+from qs import Queue
+from routing import Router, LoadIndex, build_router
+from model import NetworkModel, load, EXIT
+from streams import RandomStreams
+from system_stats import SystemStatistics, GeneratorStatistics, SojournStatistics, FactoryReport, precision_reached
+
+# event kinds on the calendar
+ARRIVAL = 0
+DEPARTURE = 1
+PRECISION = 2
+CHECKPOINT = 3
+SNAPSHOT = 4
+WINDOW = 5
+# the fill timeout of a node's batch
+FILL = 6
+
+# upstream index of products held back by a blocking dispatcher
+GENERATOR = -1
+
+
+class NodeDestination:
+    def __init__(self, name: str, probability: float, index: int) -> None:
+        self.name = name
+        self.probability = probability
+        self.index = index
+
+
+class Node:
+    """
+    State of one station of the network, addressed by its integer index
+    """
+
+    def __init__(self, index: int, model: NetworkModel, streams: RandomStreams) -> None:
+        self.index = index
+        self.name = model.names[index]
+        self.max_servers = int(model.servers[index])
+        self.queue = Queue(params=model.queues[index])
+        self.busy = 0
+        self.prev_arrival = 0.0
+        # (upstream index, product, rest) held by servers waiting for queue space,
+        # rest is where the upstream batch or arrival batch carries on
+        self.blocked: deque = deque()
+        # batch service state, as in System
+        self.batch = model.batches[index]
+        self.batch_open = False
+        self.batch_due = False
+        self.batch_seq = 0
+        self.stats = SystemStatistics(system_name=self.name)
+        self.service_stream = streams.service(node=self.name, params=model.services[index])
+        self.routing_stream = streams.uniform(node=self.name, purpose="routing")
+        self.router: Router = None
+        self.counters: NodeCounters = None
+
+    def get_name(self) -> str:
+        return self.name
+
+    def get_stats(self) -> SystemStatistics:
+        return self.stats
+
+    def __getstate__(self) -> dict:
+        # counters belong to the instrumentation of the run, not to its state
+        state = dict(self.__dict__)
+        state["counters"] = None
+        return state
+
+
+class NativeFactory(FactoryReport):
+    """
+    Simulate the dispatcher -> production line -> QA network with a heapq
+    event calendar instead of SimPy processes.
+
+    The model matches Factory: same config and workload files, same random
+    streams, routing on service completion and the same SystemStatistics.
+
+    Unlike SimPy's generators, the whole state here is plain data, so a run
+    can be checkpointed to a pickle and resumed or branched from it.
+    """
+
+    def __init__(self, workload_path: str, config_path: str, seed=None,
+                 instrumentation: Instrumentation = None,
+                 checkpoint: pr.CheckpointParams = None,
+                 snapshots: pr.SnapshotParams = None,
+                 require_stable: bool = True) -> None:
+        build_start = perf_counter()
+        self.model = load(config_path=config_path, workload_path=workload_path,
+                          require_stable=require_stable)
+        self.workload = self.model.workload
+        self.dat = self.model.dat
+
+        self.verbose = True
+        self.streams = RandomStreams(seed=seed)
+        self.now = 0.0
+        self.events = 0
+        self.calendar: list = []
+        self.seq = 0
+
+        model = self.model
+        self.nodes = [Node(index=i, model=model, streams=self.streams)
+                      for i in range(len(model))]
+        # products per node for load-aware routing, None when every node routes by probability
+        self.load_index: LoadIndex = None
+        if any(policy.policy != "probabilistic" for policy in model.policies):
+            self.load_index = LoadIndex(servers=model.servers,
+                                        mean_service_times=model.mean_service_times)
+        for node in self.nodes:
+            node.router = build_router(
+                destinations=[NodeDestination(name="exit" if j == EXIT else model.names[j],
+                                              probability=p, index=j)
+                              for j, p in zip(model.destinations[node.index],
+                                              model.probabilities[node.index])],
+                stream=node.routing_stream,
+                nodes=model.destinations[node.index],
+                params=model.policies[node.index],
+                index=self.load_index,
+                table=model.alias_tables[node.index],
+            )
+        self.dispatcher = self.nodes[0]
+
+        self.interarrival_stream = self.streams.interarrival(params=model.generator)
+        self.generator = GeneratorStatistics(env=None)
+        self.generator.get_theoretical(mean_interarrival_time=1 / model.external_rate)
+        self.batch_size = model.generator.batch_size
+        self.current_id = 0
+        self.sojourn = SojournStatistics()
+        self.sim_time = model.simulation_time
+        self.precision = pr.PrecisionParams.from_config(workload=self.workload)
+
+        self.checkpoint_params = checkpoint
+        self.snapshots: SnapshotWriter = None
+        if snapshots is not None:
+            self.snapshots = SnapshotWriter(path=snapshots.path, interval=snapshots.interval)
+        self.windows: WindowStatistics = None
+        if model.windows is not None:
+            self.windows = WindowStatistics(params=model.windows)
+        # False until the first events are on the calendar, a resumed run is started
+        self.started = False
+
+        self.instrumentation = instrumentation
+        if instrumentation is not None:
+            for node in self.nodes:
+                node.counters = instrumentation.node(node.name)
+            instrumentation.add_phase("build", perf_counter() - build_start)
+
+    def systems(self) -> list[Node]:
+        return self.nodes
+
+    def generator_stats(self) -> GeneratorStatistics:
+        return self.generator
+
+    def sojourn_stats(self) -> SojournStatistics:
+        return self.sojourn
+
+    def _schedule(self, delay: float, kind: int, node: int, payload):
+        self.seq += 1
+        heapq.heappush(self.calendar,
+                       (self.now + delay, self.seq, kind, node, payload))
+
+    def _schedule_arrival(self):
+        interarrival = self.interarrival_stream.next()
+        self._schedule(interarrival, ARRIVAL, GENERATOR, interarrival)
+
+    def _admit(self, node: Node, product: Product, start: bool = True) -> bool:
+        # mirrors System.add_product, start False leaves starting service to
+        # the caller, as SimPy runs the woken node only once a batch loop yields
+        counters = node.counters
+        if node.queue.is_full():
+            if node.queue.params.on_full == "block":
+                if counters is not None:
+                    counters.blocked += 1
+                return False
+            node.stats.update_balked()
+            if counters is not None:
+                counters.balked += 1
+            return True
+
+        if counters is not None:
+            counters.arrivals += 1
+        now = self.now
+        node.queue.enqueue(product=product)
+        node.stats.record_arrival(now=now)
+        if self.load_index is not None:
+            self.load_index.add(node.index, 1)
+        node.stats.update_total_interarrival_time(
+            interarrival_time=now - node.prev_arrival)
+        node.prev_arrival = now
+        product.visited(node=node.index, now=now)
+        if node.batch is not None and not node.batch_open:
+            self._open_batch(node)
+        if start:
+            self._start_service(node)
+        return True
+
+    def _open_batch(self, node: Node):
+        # mirrors System._open_batch
+        node.batch_seq += 1
+        node.batch_open = True
+        node.batch_due = False
+        if node.batch.timeout is not None:
+            self._schedule(node.batch.timeout, FILL, node.index, node.batch_seq)
+
+    def _fill_timeout(self, node: Node, seq: int):
+        if seq == node.batch_seq and node.batch_open:
+            node.batch_due = True
+            self._start_service(node)
+
+    def _start_batch(self, node: Node):
+        # mirrors System._request_batch
+        now = self.now
+        stats = node.stats
+        products = [node.queue.dequeue() for _ in range(min(node.batch.size, len(node.queue)))]
+        node.busy += 1
+        node.batch_open = False
+        node.batch_due = False
+        if not node.queue.is_empty():
+            self._open_batch(node)
+        stats.record_service_start(now=now, products=len(products))
+        for product in products:
+            stats.update_service_requests()
+            stats.update_product_count()
+            stats.record_wait(wait_time=product.end_wait(now=now))
+        service_time = node.service_stream.next()
+        self._schedule(service_time, DEPARTURE, node.index, (products, service_time))
+        if node.counters is not None:
+            node.counters.service_starts += len(products)
+
+    def _start_service(self, node: Node):
+        # mirrors System.request_server and System._schedule_update_stats
+        now = self.now
+        stats = node.stats
+        while node.busy < node.max_servers and not node.queue.is_empty():
+            if node.batch is not None:
+                if len(node.queue) < node.batch.size and not node.batch_due:
+                    break
+                self._start_batch(node)
+                continue
+            product = node.queue.dequeue()
+            node.busy += 1
+            stats.record_service_start(now=now)
+            stats.update_service_requests()
+            stats.update_product_count()
+            stats.record_wait(wait_time=product.end_wait(now=now))
+            service_time = node.service_stream.next()
+            self._schedule(service_time, DEPARTURE, node.index,
+                           (product, service_time))
+            if node.counters is not None:
+                node.counters.service_starts += 1
+        self._unblock(node)
+
+    def _unblock(self, node: Node):
+        # every blocked server retries once in turn, as the waiters of one
+        # space event in SimPy, those without room queue up again behind
+        # the ones that blocked anew meanwhile
+        if not node.blocked or node.queue.is_full():
+            return
+        waiting, node.blocked = node.blocked, deque()
+        deferred = node.batch is not None
+        for upstream, product, rest in waiting:
+            # a batch node starts once the blocked products are in, SimPy
+            # wakes its server after the unblocked processes yield
+            if not self._admit(node, product, start=not deferred):
+                node.blocked.append((upstream, product, rest))
+            elif upstream == GENERATOR:
+                self._arrive(rest)
+            elif rest is None:
+                self._release(self.nodes[upstream])
+            else:
+                self._route_batch(self.nodes[upstream], *rest)
+        if deferred:
+            self._start_service(node)
+
+    def _release(self, node: Node, products: int = 1, touched: list[Node] = ()):
+        node.stats.record_departure(now=self.now, products=products)
+        node.busy -= 1
+        if self.load_index is not None:
+            self.load_index.add(node.index, -products)
+        if node.counters is not None:
+            node.counters.departures += products
+        for target in touched:
+            self._start_service(target)
+        self._start_service(node)
+
+    def _arrival(self, interarrival: float):
+        self.generator.update_interarrival_time(last_time=interarrival)
+        self._arrive(0)
+
+    def _arrive(self, position: int):
+        # products position onwards of an arrival batch, as Generator.generate
+        for i in range(position, self.batch_size):
+            self.generator.add_total_generated()
+            product = Product(name=self.current_id, arrival_time=self.now)
+            self.current_id += 1
+            if not self._admit(self.dispatcher, product, start=False):
+                self.dispatcher.blocked.append((GENERATOR, product, i + 1))
+                self._start_service(self.dispatcher)
+                return
+        self._schedule_arrival()
+        self._start_service(self.dispatcher)
+
+    def _departure(self, node: Node, product: Product, service_time: float):
+        node.stats.update_service_time(service_time)
+        index = node.router.choose().index if len(node.router) > 0 else EXIT
+        if index == EXIT:
+            self.sojourn.record_exit(product=product, now=self.now)
+            if node.counters is not None:
+                node.counters.exits += 1
+        else:
+            target = self.nodes[index]
+            if not self._admit(target, product):
+                # the server stays held until the target has room
+                target.blocked.append((node.index, product, None))
+                return
+        self._release(node)
+
+    def _route_batch(self, node: Node, products: list[Product], position: int,
+                     service_time: float):
+        # mirrors System.serve_batch from products[position] on
+        touched = []
+        for i in range(position, len(products)):
+            product = products[i]
+            node.stats.update_service_time(service_time / len(products))
+            index = node.router.choose().index if len(node.router) > 0 else EXIT
+            if index == EXIT:
+                self.sojourn.record_exit(product=product, now=self.now)
+                if node.counters is not None:
+                    node.counters.exits += 1
+                continue
+            target = self.nodes[index]
+            if not self._admit(target, product, start=False):
+                # the whole batch keeps the server until the target has room
+                target.blocked.append((node.index, product, (products, i + 1, service_time)))
+                for woken in touched:
+                    self._start_service(woken)
+                return
+            if target not in touched:
+                touched.append(target)
+        self._release(node, products=len(products), touched=touched)
+
+    def _close(self):
+        for node in self.nodes:
+            node.stats.in_queue_at_end = len(node.queue)
+            for product in node.queue:
+                node.stats.update_wait_time(
+                    wait_time=product.end_wait(now=self.now))
+            node.stats.close(now=self.now)
+            node.stats.update_utilization(node.max_servers)
+
+    def _precision_reached(self) -> bool:
+        # mirrors Factory.watch_precision
+        return precision_reached([node.stats for node in self.nodes],
+                                 relative_half_width=self.precision.relative_half_width,
+                                 confidence=self.precision.confidence)
+
+    def __getstate__(self) -> dict:
+        # instrumentation and snapshot files belong to the run, not to its state
+        state = dict(self.__dict__)
+        state["instrumentation"] = None
+        state["snapshots"] = None
+        state["calendar"] = [event for event in self.calendar if event[2] != SNAPSHOT]
+        heapq.heapify(state["calendar"])
+        return state
+
+    def checkpoint(self, path: str):
+        """
+        Write the whole simulation state to path: clock, calendar, queues
+        with their products, random streams and statistics accumulators.
+        The file is replaced atomically, a crash mid-write keeps the old one.
+        """
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+
+    @classmethod
+    def resume(cls, path: str, seed=None, simulation_time: float = None,
+               servers: dict[str, int] = None,
+               snapshots: pr.SnapshotParams = None,
+               checkpoint: pr.CheckpointParams = None) -> "NativeFactory":
+        """
+        Factory continuing from a checkpoint. Branches of one warmed-up state
+        differ by seed (new random streams from here on), by simulation_time
+        (a later horizon) or by servers (new max_servers per node name).
+        The checkpoint at path is left as it is, a branch only writes its own
+        checkpoints to a new checkpoint path.
+        """
+        if checkpoint is not None and os.path.realpath(checkpoint.path) == os.path.realpath(path):
+            raise ValueError(f"a branch cannot write its checkpoints over {path}, it started from it")
+        with open(path, "rb") as f:
+            factory = pickle.load(f)
+        if not isinstance(factory, cls):
+            raise ValueError(f"{path} is not a checkpoint of the native engine")
+        factory.calendar = [event for event in factory.calendar if event[2] != CHECKPOINT]
+        heapq.heapify(factory.calendar)
+        factory.checkpoint_params = checkpoint
+        if checkpoint is not None:
+            factory._schedule(checkpoint.interval, CHECKPOINT, GENERATOR, None)
+        if seed is not None:
+            factory.reseed(seed)
+        if simulation_time is not None:
+            if simulation_time < factory.now:
+                raise ValueError(
+                    f"simulation_time {simulation_time} is before the checkpoint at t = {factory.now}")
+            factory.sim_time = simulation_time
+        for name, count in (servers or {}).items():
+            if name not in factory.model.index:
+                raise ValueError(f"unknown node {name}")
+            if count < 1:
+                raise ValueError(f"{name}: max_servers must be a positive integer")
+            node = factory.nodes[factory.model.index[name]]
+            node.max_servers = count
+            if factory.load_index is not None:
+                factory.load_index.set_servers(node.index, count)
+            factory._start_service(node)
+        if snapshots is not None:
+            factory.snapshots = SnapshotWriter(path=snapshots.path, interval=snapshots.interval)
+            factory._schedule(snapshots.interval, SNAPSHOT, GENERATOR, None)
+        return factory
+
+    def reseed(self, seed):
+        """
+        Draw every variate from here on from the streams of seed
+        """
+        streams = RandomStreams(seed=seed)
+        self.interarrival_stream.reseed(streams.generator(node="generator", purpose="interarrival"))
+        for node in self.nodes:
+            node.service_stream.reseed(streams.generator(node=node.name, purpose="service"))
+            node.routing_stream.reseed(streams.generator(node=node.name, purpose="routing"))
+        self.streams = streams
+
+    def _begin(self):
+        self._schedule_arrival()
+        if self.precision is not None:
+            self._schedule(self.precision.check_interval, PRECISION, GENERATOR, None)
+        if self.checkpoint_params is not None:
+            self._schedule(self.checkpoint_params.interval, CHECKPOINT, GENERATOR, None)
+        if self.snapshots is not None:
+            self._schedule(self.snapshots.interval, SNAPSHOT, GENERATOR, None)
+        if self.windows is not None:
+            self._schedule(self.windows.next_boundary(self.now) - self.now, WINDOW, GENERATOR, None)
+        self.started = True
+
+    def _snapshot(self):
+        self.snapshots.write(self.now, [(node.name, node.stats, node.max_servers)
+                                        for node in self.nodes])
+
+    def _record_window(self):
+        self.windows.record(self.now, [(node.name, node.stats, node.max_servers)
+                                       for node in self.nodes])
+
+    def run(self):
+        if not self.started:
+            self._begin()
+        calendar = self.calendar
+        nodes = self.nodes
+        until = self.sim_time
+        pop = heapq.heappop
+        # serve time is a node's departure handling, schedule time the
+        # dispatcher's arrival handling, as SimPy's process phases
+        timing = self.instrumentation is not None
+        while calendar and calendar[0][0] <= until:
+            time, _, kind, node, payload = pop(calendar)
+            self.now = time
+            self.events += 1
+            if timing and kind <= DEPARTURE:
+                start = perf_counter()
+            if kind == DEPARTURE:
+                if nodes[node].batch is None:
+                    self._departure(nodes[node], payload[0], payload[1])
+                else:
+                    self._route_batch(nodes[node], payload[0], 0, payload[1])
+                if timing:
+                    nodes[node].counters.serve_time += perf_counter() - start
+            elif kind == ARRIVAL:
+                self._arrival(payload)
+                if timing:
+                    self.dispatcher.counters.schedule_time += perf_counter() - start
+            elif kind == SNAPSHOT:
+                self._schedule(self.snapshots.interval, SNAPSHOT, GENERATOR, None)
+                self._snapshot()
+            elif kind == WINDOW:
+                self._schedule(self.windows.next_boundary(time) - time, WINDOW, GENERATOR, None)
+                self._record_window()
+            elif kind == FILL:
+                self._fill_timeout(nodes[node], payload)
+            elif kind == CHECKPOINT:
+                self._schedule(self.checkpoint_params.interval, CHECKPOINT, GENERATOR, None)
+                self.checkpoint(self.checkpoint_params.path)
+            elif self._precision_reached():
+                if self.verbose:
+                    print(f"Precision target reached at t = {time}, stopping early")
+                until = time
+                break
+            else:
+                self._schedule(self.precision.check_interval, PRECISION, GENERATOR, None)
+        self.now = until
+        self.sim_time = until
+        if self.checkpoint_params is not None:
+            # the state at the horizon, before closing, can be extended or branched
+            self.checkpoint(self.checkpoint_params.path)
+        if self.snapshots is not None:
+            if self.snapshots.last_time != until:
+                self._snapshot()
+            self.snapshots.close()
+        if self.windows is not None:
+            self._record_window()
+        self._close()
+
+    def open(self, verbose: bool = True):
+        self.verbose = verbose
+        if self.verbose:
+            print(
+                f"------------------------\nAt time t =  {self.now}, Factory OPENS\n------------------------")
+        if self.instrumentation is None:
+            self.run()
+        else:
+            self.instrumentation.run(self.run)
+            self.instrumentation.collect(self.nodes)
+        if self.verbose:
+            print(
+                f"------------------------\nAt time t =  {self.now}, Factory CLOSES\n------------------------")
+            self.stats()
+            if self.instrumentation is not None:
+                self.instrumentation.report()
@@ -0,0 +1,169 @@
+import argparse
+import json
+import os
+import numpy as np
+from analysis import solve_traffic
+from model import compile_model
+from params import load_nodes
+
+
+def _weights(rng: np.random.Generator, n: int, total: float = 1.0) -> list[float]:
+    # random probabilities summing to total, rounded so the config stays readable
+    weights = rng.dirichlet(np.ones(n)) * total
+    weights = np.round(weights, 6)
+    weights[-1] = round(total - weights[:-1].sum(), 6)
+    return weights.tolist()
+
+
+def generate(
+    nodes: int,
+    fan_out: int = 2,
+    feedback: float = 0.1,
+    utilization: float = 0.8,
+    utilization_spread: float = 0.1,
+    max_servers: int = 4,
+    mean_interarrival_time: float = 60,
+    simulation_time: float = 604800,
+    seed: int = None,
+) -> tuple[dict, dict]:
+    """
+    Config and workload of a random N-node network in the factory layout:
+    a dispatcher feeding every production line, each line sending products
+    to fan_out QA checks, and each QA check sending a feedback fraction
+    back to fan_out production lines and the rest to the exit.
+
+    Service times are set from the traffic equations so each node's
+    utilization falls within utilization +- utilization_spread.
+    """
+    if nodes < 3:
+        raise ValueError("a network needs at least a dispatcher, a production line and a QA check")
+    if not 0 <= feedback < 1:
+        raise ValueError("feedback must be in [0, 1)")
+    if not (0 < utilization - utilization_spread and utilization + utilization_spread < 1):
+        raise ValueError("utilization +- utilization_spread must be within (0, 1)")
+
+    rng = np.random.default_rng(seed)
+    n_lines = (nodes - 1) // 2
+    n_checks = nodes - 1 - n_lines
+    lines = [f"production_line_{i}" for i in range(n_lines)]
+    checks = [f"qa_check_{i}" for i in range(n_checks)]
+
+    def pick(names: list[str], first: int) -> list[str]:
+        # first keeps every node reachable, the rest are random
+        others = [name for name in names if name != names[first]]
+        k = min(fan_out, len(names)) - 1
+        return [names[first]] + list(rng.choice(others, size=k, replace=False))
+
+    dat = {
+        "dispatcher": {
+            "name": "dispatcher",
+            "mean_service_time": 1,
+            "max_servers": 1,
+            "go_to": [{"name": name, "probability": p}
+                      for name, p in zip(lines, _weights(rng, n_lines))],
+        },
+        "productionlines": [],
+        "qa_check": [],
+    }
+    for i, name in enumerate(lines):
+        targets = pick(checks, i % n_checks)
+        dat["productionlines"].append({
+            "name": name,
+            "mean_service_time": 1,
+            "max_servers": 1,
+            "go_to": [{"name": target, "probability": p}
+                      for target, p in zip(targets, _weights(rng, len(targets)))],
+        })
+    for i, name in enumerate(checks):
+        go_to = [{"name": "exit", "probability": round(1 - feedback, 6)}]
+        if feedback > 0:
+            targets = pick(lines, i % n_lines)
+            go_to += [{"name": target, "probability": p} for target, p in
+                      zip(targets, _weights(rng, len(targets), total=feedback))]
+        dat["qa_check"].append({
+            "name": name,
+            "mean_service_time": 1,
+            "max_servers": 1,
+            "go_to": go_to,
+        })
+
+    workload = {
+        "simulation_time": simulation_time,
+        "generator": {"mean_interarrival_time": mean_interarrival_time},
+    }
+
+    _, arrival_rates = solve_traffic(dat, workload)
+    for cfg, arrival_rate in zip(load_nodes(dat), arrival_rates):
+        servers = int(rng.integers(1, max_servers + 1))
+        target = rng.uniform(utilization - utilization_spread,
+                             utilization + utilization_spread)
+        cfg["max_servers"] = servers
+        cfg["mean_service_time"] = round(float(target * servers / arrival_rate), 3)
+
+    problems = check_stability(dat, workload)
+    if len(problems) > 0:
+        raise ValueError("generated network is unstable:\n  " + "\n  ".join(problems))
+    return dat, workload
+
+
+def check_stability(dat: dict, workload: dict) -> list[str]:
+    """
+    Nodes whose traffic-equation utilization is not below one, with the
+    mean service time raised by the MIN_SERVICE_TIME clamp
+    """
+    return compile_model(dat, workload, require_stable=False).unstable()
+
+
+def write(directory: str, name: str, dat: dict, workload: dict) -> tuple[str, str]:
+    """
+    Write name.config.json and name.workload.json, return their paths
+    """
+    os.makedirs(directory, exist_ok=True)
+    config_path = os.path.join(directory, f"{name}.config.json")
+    workload_path = os.path.join(directory, f"{name}.workload.json")
+    with open(config_path, "w") as f:
+        json.dump(dat, f, indent=2)
+    with open(workload_path, "w") as f:
+        json.dump(workload, f, indent=2)
+    return config_path, workload_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Write the config and workload of a random stable N-node network")
+    parser.add_argument("nodes", type=int, help="number of nodes, dispatcher included")
+    parser.add_argument("--fan-out", type=int, default=2,
+                        help="destinations of every production line and QA check")
+    parser.add_argument("--feedback", type=float, default=0.1,
+                        help="probability a QA check sends a product back to a production line")
+    parser.add_argument("--utilization", type=float, default=0.8,
+                        help="target utilization of every node")
+    parser.add_argument("--utilization-spread", type=float, default=0.1,
+                        help="node utilizations are drawn within +- this of the target")
+    parser.add_argument("--max-servers", type=int, default=4,
+                        help="servers per node are drawn from 1 to this")
+    parser.add_argument("--mean-interarrival-time", type=float, default=60)
+    parser.add_argument("--simulation-time", type=float, default=604800)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--output", default="./networks",
+                        help="directory of the generated files")
+    parser.add_argument("--name", default=None,
+                        help="file name prefix, defaults to net<nodes>")
+    args = parser.parse_args()
+
+    try:
+        dat, workload = generate(
+            nodes=args.nodes,
+            fan_out=args.fan_out,
+            feedback=args.feedback,
+            utilization=args.utilization,
+            utilization_spread=args.utilization_spread,
+            max_servers=args.max_servers,
+            mean_interarrival_time=args.mean_interarrival_time,
+            simulation_time=args.simulation_time,
+            seed=args.seed,
+        )
+    except ValueError as e:
+        parser.exit(2, f"error: {e}\n")
+    for path in write(args.output, args.name or f"net{args.nodes}", dat, workload):
+        print(path)
@@ -0,0 +1,270 @@
+import argparse
+import copy
+import itertools
+import json
+import math
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from prettytable import PrettyTable
+from analysis import mmc_metrics
+from cache import ResultCache
+from model import compile_model
+from params import load_nodes
+from replicate import replicate
+
+
+def stable_servers(arrival_rate: float, service_rate: float) -> int:
+    """
+    Fewest servers keeping a node's utilization below one
+    """
+    return math.floor(arrival_rate / service_rate) + 1
+
+
+class Optimizer:
+    """
+    Search integer max_servers vectors for the fewest total servers whose
+    simulated end-to-end mean and p95 response times meet the limits.
+
+    Vectors are tried by increasing total, and within a total by increasing
+    analytic (Jackson network, M/M/c) mean response time. A vector is not
+    simulated when its analytic mean exceeds the limit by more than slack,
+    or when it is below a vector that already failed in simulation. All
+    vectors share the replication seeds (common random numbers) and each
+    simulated one is cached, so no configuration is simulated twice.
+    """
+
+    def __init__(
+        self,
+        config_path: str,
+        workload_path: str,
+        max_mean: float = None,
+        max_p95: float = None,
+        replications: int = 10,
+        seed: int = 0,
+        headroom: int = 3,
+        slack: float = 0.25,
+        conservative: bool = False,
+        engine: str = "native",
+        workers: int = None,
+        confidence: float = 0.95,
+        result_cache: ResultCache = None,
+    ) -> None:
+        with open(config_path) as f:
+            self.dat = json.load(f)
+        with open(workload_path) as f:
+            self.workload = json.load(f)
+        self.workload_path = workload_path
+        # limits on the end-to-end response time, in hours
+        self.max_mean = max_mean
+        self.max_p95 = max_p95
+        self.replications = replications
+        self.seed = seed
+        self.slack = slack
+        # judge the limits on the CI upper bound instead of the mean
+        self.conservative = conservative
+        self.engine = engine
+        self.workers = workers
+        self.confidence = confidence
+        # replication summaries kept across optimizer runs
+        self.result_cache = result_cache
+
+        # the configured servers may be too few, that is what the search fixes
+        model = compile_model(self.dat, self.workload, require_stable=False)
+        self.names = list(model.names)
+        self.arrival_rates = model.arrival_rates.tolist()
+        # the clamped rates the model's stability check uses, so the lowest
+        # vector tried is one every replication accepts
+        self.service_rates = model.effective_service_rates.tolist()
+        self.external_rate = model.external_rate
+        self.lower = [stable_servers(a, s)
+                      for a, s in zip(self.arrival_rates, self.service_rates)]
+        self.upper = [c + headroom for c in self.lower]
+
+        self.cache: dict[tuple, dict] = {}
+        self.failed: list[tuple] = []
+        self.pruned = {"analytic": 0, "dominated": 0}
+        self.config_dir: str = None
+
+    def analytic_response_time(self, servers: tuple) -> float:
+        # Little's law over the sum of the M/M/c populations, in hours
+        population = sum(mmc_metrics(a, s, c)["L"] for a, s, c in
+                         zip(self.arrival_rates, self.service_rates, servers))
+        return population / self.external_rate / 3600
+
+    def config_for(self, servers: tuple) -> dict:
+        dat = copy.deepcopy(self.dat)
+        for cfg, c in zip(load_nodes(dat), servers):
+            cfg["max_servers"] = int(c)
+        return dat
+
+    def simulate(self, servers: tuple, pool: ProcessPoolExecutor) -> dict:
+        if servers not in self.cache:
+            path = os.path.join(
+                self.config_dir, "servers-" + "-".join(map(str, servers)) + ".json")
+            with open(path, "w") as f:
+                json.dump(self.config_for(servers), f)
+            result = replicate(path, self.workload_path, self.replications,
+                               seed=self.seed, confidence=self.confidence,
+                               engine=self.engine, pool=pool, cache=self.result_cache)
+            self.cache[servers] = {
+                "servers": servers,
+                "total": sum(servers),
+                "analytic_mean": self.analytic_response_time(servers),
+                "mean": result["system"]["sojourn_mean"],
+                "p95": result["system"]["sojourn_p95"],
+            }
+        return self.cache[servers]
+
+    def feasible(self, evaluation: dict) -> bool:
+        bound = "ci_high" if self.conservative else "mean"
+        if self.max_mean is not None and not evaluation["mean"][bound] <= self.max_mean:
+            return False
+        if self.max_p95 is not None and not evaluation["p95"][bound] <= self.max_p95:
+            return False
+        return True
+
+    def _dominated(self, servers: tuple) -> bool:
+        # fewer servers everywhere than a failed vector cannot do better
+        return any(all(c <= f for c, f in zip(servers, failed))
+                   for failed in self.failed)
+
+    def _prune_limit(self) -> float:
+        # the p95 of a right-skewed sojourn time is above its mean, so the
+        # p95 limit also bounds the mean when no mean limit is given
+        limit = self.max_mean if self.max_mean is not None else self.max_p95
+        return limit * (1 + self.slack)
+
+    def run(self) -> dict:
+        by_total: dict[int, list[tuple]] = {}
+        for servers in itertools.product(
+                *[range(lo, hi + 1) for lo, hi in zip(self.lower, self.upper)]):
+            by_total.setdefault(sum(servers), []).append(servers)
+
+        best = None
+        limit = self._prune_limit()
+        with tempfile.TemporaryDirectory() as self.config_dir, \
+                ProcessPoolExecutor(max_workers=self.workers) as pool:
+            for total in sorted(by_total):
+                ranked = sorted(by_total[total], key=self.analytic_response_time)
+                feasible = []
+                for i, servers in enumerate(ranked):
+                    if self.analytic_response_time(servers) > limit:
+                        # ranked by analytic mean, so the rest are worse
+                        self.pruned["analytic"] += len(ranked) - i
+                        break
+                    if self._dominated(servers):
+                        self.pruned["dominated"] += 1
+                        continue
+                    evaluation = self.simulate(servers, pool)
+                    if self.feasible(evaluation):
+                        feasible.append(evaluation)
+                    else:
+                        self.failed.append(servers)
+                if len(feasible) > 0:
+                    best = min(feasible, key=lambda e: e["mean"]["mean"])
+                    break
+        return self.result(best)
+
+    def result(self, best: dict) -> dict:
+        def named(evaluation: dict) -> dict:
+            res = dict(evaluation)
+            res["servers"] = dict(zip(self.names, evaluation["servers"]))
+            return res
+
+        return {
+            "limits": {"max_mean": self.max_mean, "max_p95": self.max_p95,
+                       "conservative": self.conservative},
+            "replications": self.replications,
+            "best": None if best is None else named(best),
+            "simulated": [named(e) for e in self.cache.values()],
+            "pruned": dict(self.pruned),
+        }
+
+
+def print_optimization(result: dict):
+    print(
+        f"------------------------\nCapacity planning, {result['replications']} replications "
+        f"per configuration (hours)\n------------------------")
+    names = list(result["simulated"][0]["servers"]) if result["simulated"] else []
+    tb = PrettyTable(names + ["total", "analytic_mean", "mean", "mean_ci_high",
+                              "p95", "p95_ci_high"])
+    for e in result["simulated"]:
+        tb.add_row(list(e["servers"].values())
+                   + [e["total"], round(e["analytic_mean"], 4),
+                      round(e["mean"]["mean"], 4), round(e["mean"]["ci_high"], 4),
+                      round(e["p95"]["mean"], 4), round(e["p95"]["ci_high"], 4)])
+    print(tb)
+    print(f"simulated = {len(result['simulated'])}, pruned analytically = "
+          f"{result['pruned']['analytic']}, pruned by a failed smaller configuration = "
+          f"{result['pruned']['dominated']}")
+    best = result["best"]
+    if best is None:
+        print("no configuration within the search range meets the limits")
+        return
+    print(f"best: total servers = {best['total']}")
+    for name, servers in best["servers"].items():
+        print(f"  {name} = {servers}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Find the fewest servers per node meeting response time limits")
+    parser.add_argument("config", help="path to the network config file")
+    parser.add_argument("workload", help="path to the workload file")
+    parser.add_argument("--max-mean", type=float, default=None,
+                        help="limit on the mean end-to-end response time, in hours")
+    parser.add_argument("--max-p95", type=float, default=None,
+                        help="limit on the p95 end-to-end response time, in hours")
+    parser.add_argument("--replications", type=int, default=10,
+                        help="replications per simulated configuration")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="root seed shared by every configuration")
+    parser.add_argument("--headroom", type=int, default=3,
+                        help="servers tried per node above the fewest stable ones")
+    parser.add_argument("--slack", type=float, default=0.25,
+                        help="simulate configurations whose analytic mean is at most this fraction over the limit")
+    parser.add_argument("--conservative", action="store_true",
+                        help="require the CI upper bounds, not the means, to meet the limits")
+    parser.add_argument("--engine", choices=["simpy", "native"], default="native",
+                        help="simulation engine of the replications")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="worker processes, defaults to the CPU count")
+    parser.add_argument("--write", default=None,
+                        help="write the best configuration to this config file")
+    parser.add_argument("--json", action="store_true",
+                        help="print the result as JSON instead of a table")
+    parser.add_argument("--cache", default=None,
+                        help="directory of cached replication summaries, reused by later runs")
+    parser.add_argument("--cache-max-bytes", type=int, default=None,
+                        help="evict the least recently used cache entries above this size")
+    parser.add_argument("--cache-max-age", type=float, default=None,
+                        help="evict cache entries unused for this many seconds")
+    args = parser.parse_args()
+    if args.max_mean is None and args.max_p95 is None:
+        parser.error("give --max-mean, --max-p95 or both")
+
+    optimizer = Optimizer(
+        config_path=args.config,
+        workload_path=args.workload,
+        max_mean=args.max_mean,
+        max_p95=args.max_p95,
+        replications=args.replications,
+        seed=args.seed,
+        headroom=args.headroom,
+        slack=args.slack,
+        conservative=args.conservative,
+        engine=args.engine,
+        workers=args.workers,
+        result_cache=None if args.cache is None else ResultCache(
+            args.cache, max_bytes=args.cache_max_bytes, max_age=args.cache_max_age),
+    )
+    result = optimizer.run()
+    if args.write is not None and result["best"] is not None:
+        with open(args.write, "w") as f:
+            json.dump(optimizer.config_for(tuple(result["best"]["servers"].values())),
+                      f, indent=2)
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print_optimization(result)
@@ -1,28 +1,430 @@
+import os
+
 SIM_DURATION = 20
 
+# service times are clamped to at least this many seconds
+MIN_SERVICE_TIME = 1
+
+DISTRIBUTIONS = ("exponential", "lognormal", "gamma", "deterministic", "histogram",
+                 "empirical", "trace")
+
+
+def _count(value) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool) and value >= 1
+
+
+class TraceParams(object):
+    def __init__(
+        self,
+        path: str,
+        dtype: str = "float64",
+        columns: int = 1,
+        column: int = 0,
+        times: bool = False,
+    ) -> None:
+        # raw binary array of rows x columns values, or a .npy file
+        self.path = path
+        self.dtype = dtype
+        self.columns = columns
+        self.column = column
+        # the column holds absolute arrival times instead of gaps
+        self.times = times
+        pass
+
+    @classmethod
+    def from_config(cls, cfg: dict, owner: str) -> "TraceParams":
+        # {"path", "dtype", "columns", "column", "times"}
+        params = cls(
+            path=cfg["path"],
+            dtype=cfg.get("dtype", "float64"),
+            columns=cfg.get("columns", 1),
+            column=cfg.get("column", 0),
+            times=cfg.get("times", False),
+        )
+        if not os.path.exists(params.path):
+            raise ValueError(f"{owner}: trace file {params.path} does not exist")
+        if not 0 <= params.column < params.columns:
+            raise ValueError(f"{owner}: trace column must be in [0, columns)")
+        return params
+
+
+class ServiceParams(object):
+    def __init__(
+        self,
+        distribution: str = "exponential",
+        mean: float = None,
+        cv: float = None,
+        bins: list = None,
+        weights: list = None,
+        trace: TraceParams = None,
+        minimum: float = None,
+    ) -> None:
+        self.distribution = distribution
+        self.mean = mean
+        # coefficient of variation of lognormal and gamma
+        self.cv = cv
+        # histogram: len(weights) + 1 increasing bin edges
+        self.bins = bins
+        self.weights = weights
+        # empirical samples or a replayed trace
+        self.trace = trace
+        self.minimum = minimum
+        pass
+
+    @classmethod
+    def from_config(cls, cfg: dict) -> "ServiceParams":
+        # optional per node "service": {"distribution", "cv", "bins", "weights",
+        # "trace", "minimum"}, the mean is the node's mean_service_time
+        service_cfg = cfg.get("service", {})
+        name = cfg["name"]
+        distribution = service_cfg.get("distribution", "exponential")
+        if distribution not in DISTRIBUTIONS:
+            raise ValueError(
+                f"{name}: unknown service distribution {distribution}, expected one of {DISTRIBUTIONS}")
+        params = cls(
+            distribution=distribution,
+            mean=cfg["mean_service_time"],
+            cv=service_cfg.get("cv"),
+            bins=service_cfg.get("bins"),
+            weights=service_cfg.get("weights"),
+            # exponential service keeps the historical clamp
+            minimum=service_cfg.get(
+                "minimum", MIN_SERVICE_TIME if distribution == "exponential" else None),
+        )
+        if distribution in ("lognormal", "gamma") and not (params.cv is not None and params.cv > 0):
+            raise ValueError(f"{name}: {distribution} service needs a positive cv")
+        if distribution == "histogram":
+            bins, weights = params.bins or [], params.weights or []
+            if len(bins) != len(weights) + 1 or len(weights) == 0:
+                raise ValueError(f"{name}: histogram needs len(weights) + 1 bin edges")
+            if any(b >= c for b, c in zip(bins, bins[1:])) or bins[0] < 0:
+                raise ValueError(f"{name}: histogram bin edges must increase from 0 or more")
+            if any(w < 0 for w in weights) or sum(weights) <= 0:
+                raise ValueError(f"{name}: histogram weights must be non-negative, not all 0")
+        if distribution in ("empirical", "trace"):
+            if "trace" not in service_cfg:
+                raise ValueError(f"{name}: {distribution} service needs a \"trace\" file")
+            params.trace = TraceParams.from_config(service_cfg["trace"], owner=name)
+        return params
+
+
 class ServerParams(object):
     def __init__(
         self,
         mean_service_time: int,
+        service: ServiceParams = None,
     ) -> None:
         self.mean_service_time = mean_service_time
+        # None is the clamped exponential
+        self.service = service
+
+class RateProfileParams(object):
+    def __init__(
+        self,
+        starts: list,
+        factors: list,
+        period: float = None,
+    ) -> None:
+        # piecewise-constant arrival rate: factors[i] times the mean rate from starts[i] seconds on
+        self.starts = starts
+        self.factors = factors
+        # repeat the pieces every period seconds, e.g. 86400 for a daily shift pattern
+        self.period = period
+        # mean of the factors over a period, or over the horizon without one
+        self.mean_factor = 1.0
+        pass
+
+    @classmethod
+    def from_config(cls, cfg: dict, horizon: float) -> "RateProfileParams":
+        # generator "rate_profile": {"starts", "factors", "period"}, the factors are
+        # relative, rates are scaled so that mean_interarrival_time stays the mean
+        params = cls(
+            starts=[float(s) for s in cfg["starts"]],
+            factors=[float(f) for f in cfg["factors"]],
+            period=cfg.get("period"),
+        )
+        starts, factors = params.starts, params.factors
+        if len(starts) == 0 or len(starts) != len(factors):
+            raise ValueError("generator: rate_profile needs one factor per start")
+        if starts[0] != 0 or any(a >= b for a, b in zip(starts, starts[1:])):
+            raise ValueError("generator: rate_profile starts must increase from 0")
+        if any(f < 0 for f in factors):
+            raise ValueError("generator: rate_profile factors must be non-negative")
+        if params.period is not None and not params.period > starts[-1]:
+            raise ValueError("generator: rate_profile period must be after the last start")
+        span = params.period if params.period is not None else horizon
+        ends = [min(e, span) for e in starts[1:] + [span]]
+        area = sum(f * max(e - min(s, span), 0.0) for s, e, f in zip(starts, ends, factors))
+        if area <= 0:
+            raise ValueError("generator: rate_profile has no arrivals")
+        params.mean_factor = area / span
+        return params
+
 
 class GeneratorParams(object):
     def __init__(
             self,
             mean_interarrival_time: int,
+            trace: TraceParams = None,
+            rate_profile: RateProfileParams = None,
+            batch_size: int = 1,
     ) -> None:
+        # time between arrivals, of whole batches when batch_size > 1
         self.mean_interarrival_time = mean_interarrival_time
+        # replay interarrival times from a file instead of drawing them
+        self.trace = trace
+        # None is a constant arrival rate
+        self.rate_profile = rate_profile
+        # products arriving together, e.g. one pallet
+        self.batch_size = batch_size
+        pass
+
+    @classmethod
+    def from_config(cls, workload: dict) -> "GeneratorParams":
+        # workload "generator": {"mean_interarrival_time", "trace", "rate_profile", "batch_size"}
+        generator_cfg = workload["generator"]
+        trace = None
+        if "trace" in generator_cfg:
+            trace = TraceParams.from_config(generator_cfg["trace"], owner="generator")
+        rate_profile = None
+        if "rate_profile" in generator_cfg:
+            if trace is not None:
+                raise ValueError("generator: a trace replays its own arrival times, drop rate_profile")
+            rate_profile = RateProfileParams.from_config(
+                generator_cfg["rate_profile"], horizon=workload["simulation_time"])
+        params = cls(
+            mean_interarrival_time=generator_cfg["mean_interarrival_time"],
+            trace=trace,
+            rate_profile=rate_profile,
+            batch_size=generator_cfg.get("batch_size", 1),
+        )
+        if not _count(params.batch_size):
+            raise ValueError("generator: batch_size must be a positive integer")
+        return params
+
+
+class WindowParams(object):
+    def __init__(
+        self,
+        period: float = 86400,
+        starts: list = None,
+        names: list = None,
+    ) -> None:
+        # statistics per shift, shifts start at these offsets into every period (day)
+        self.period = period
+        self.starts = starts if starts is not None else [0.0]
+        self.names = names
         pass
 
+    @classmethod
+    def from_config(cls, workload: dict, generator: GeneratorParams) -> "WindowParams":
+        # optional workload "windows": {"period", "starts", "names"}, by default the
+        # pieces of a periodic rate profile are the shifts
+        windows_cfg = workload.get("windows")
+        if windows_cfg is None:
+            profile = generator.rate_profile
+            if profile is None or profile.period is None:
+                return None
+            return cls(period=profile.period, starts=list(profile.starts))
+        params = cls(
+            period=windows_cfg.get("period", 86400),
+            starts=[float(s) for s in windows_cfg.get("starts", [0])],
+            names=windows_cfg.get("names"),
+        )
+        if not params.period > 0:
+            raise ValueError("windows: period must be positive")
+        starts = params.starts
+        if len(starts) == 0 or starts[0] != 0 or any(a >= b for a, b in zip(starts, starts[1:])):
+            raise ValueError("windows: starts must increase from 0")
+        if starts[-1] >= params.period:
+            raise ValueError("windows: starts must be within the period")
+        if params.names is not None and len(params.names) != len(starts):
+            raise ValueError("windows: give one name per start")
+        return params
+
+
+def load_nodes(dat: dict) -> list[dict]:
+    """
+    Node configs in reporting order: dispatcher, production lines, QA checks
+    """
+    return [dat["dispatcher"]] + dat["productionlines"] + dat["qa_check"]
+
+
+DISCIPLINES = ("fifo", "lifo", "priority")
+
+
+class QueueParams(object):
+    def __init__(
+        self,
+        discipline: str = "fifo",
+        capacity: int = None,
+        on_full: str = "balk",
+        priority_key: str = "name",
+    ) -> None:
+        self.discipline = discipline
+        self.capacity = capacity
+        # "balk" drops arrivals to a full queue, "block" holds the upstream server
+        self.on_full = on_full
+        self.priority_key = priority_key
+        pass
+
+    @classmethod
+    def from_config(cls, cfg: dict) -> "QueueParams":
+        # optional per node "queue": {"discipline", "capacity", "on_full", "priority_key"}
+        queue_cfg = cfg.get("queue", {})
+        params = cls(
+            discipline=queue_cfg.get("discipline", "fifo"),
+            capacity=queue_cfg.get("capacity"),
+            on_full=queue_cfg.get("on_full", "balk"),
+            priority_key=queue_cfg.get("priority_key", "name"),
+        )
+        if params.discipline not in DISCIPLINES:
+            raise ValueError(
+                f"{cfg['name']}: unknown queue discipline {params.discipline}, expected one of {DISCIPLINES}")
+        if params.on_full not in ("balk", "block"):
+            raise ValueError(
+                f"{cfg['name']}: unknown on_full policy {params.on_full}, expected balk or block")
+        return params
+
+
+POLICIES = ("probabilistic", "jsq", "jiq", "power_of_d", "lew")
+
+
+class RoutingParams(object):
+    def __init__(
+        self,
+        policy: str = "probabilistic",
+        d: int = 2,
+    ) -> None:
+        # jsq: shortest queue, jiq: an idle node, power_of_d: shortest of d
+        # sampled destinations, lew: least expected work
+        self.policy = policy
+        self.d = d
+        pass
+
+    @classmethod
+    def from_config(cls, cfg: dict) -> "RoutingParams":
+        # optional per node "routing": {"policy", "d"}, exits keep their go_to probability
+        routing_cfg = cfg.get("routing", {})
+        params = cls(
+            policy=routing_cfg.get("policy", "probabilistic"),
+            d=routing_cfg.get("d", 2),
+        )
+        if params.policy not in POLICIES:
+            raise ValueError(
+                f"{cfg['name']}: unknown routing policy {params.policy}, expected one of {POLICIES}")
+        if not _count(params.d):
+            raise ValueError(f"{cfg['name']}: routing d must be a positive integer")
+        return params
+
+
+class BatchParams(object):
+    def __init__(
+        self,
+        size: int,
+        timeout: float = None,
+    ) -> None:
+        # products served together by one server in one service time
+        self.size = size
+        # seconds after a batch starts filling before it is served part full,
+        # None waits until it is full
+        self.timeout = timeout
+        pass
+
+    @classmethod
+    def from_config(cls, cfg: dict) -> "BatchParams":
+        # optional per node "batch": {"size", "timeout"}, the mean_service_time is per batch
+        batch_cfg = cfg.get("batch")
+        if batch_cfg is None:
+            return None
+        params = cls(
+            size=batch_cfg["size"],
+            timeout=batch_cfg.get("timeout"),
+        )
+        if not _count(params.size):
+            raise ValueError(f"{cfg['name']}: batch size must be a positive integer")
+        if params.timeout is not None and not params.timeout >= 0:
+            raise ValueError(f"{cfg['name']}: batch timeout must be non-negative")
+        return params
+
 
 class SystemParams(object):
     def __init__(
         self,
         name: str,
         max_servers: int,
+        queue: QueueParams = None,
+        node_id: int = -1,
+        batch: BatchParams = None,
     ) -> None:
         self.name = name
         self.max_servers = max_servers
+        self.queue = queue
+        # position of the node in load_nodes order
+        self.node_id = node_id
+        # None serves one product at a time
+        self.batch = batch
+        pass
+
+
+
+class PrecisionParams(object):
+    def __init__(
+        self,
+        relative_half_width: float,
+        confidence: float = 0.95,
+        check_interval: float = 3600,
+    ) -> None:
+        # stop once every node's mean wait CI half width is below this fraction of the mean
+        self.relative_half_width = relative_half_width
+        self.confidence = confidence
+        # simulated seconds between two checks of the stopping rule
+        self.check_interval = check_interval
+        pass
+
+    @classmethod
+    def from_config(cls, workload: dict) -> "PrecisionParams":
+        # optional workload "precision": {"relative_half_width", "confidence", "check_interval"}
+        precision_cfg = workload.get("precision")
+        if precision_cfg is None:
+            return None
+        params = cls(
+            relative_half_width=precision_cfg["relative_half_width"],
+            confidence=precision_cfg.get("confidence", 0.95),
+            check_interval=precision_cfg.get("check_interval", 3600),
+        )
+        if params.relative_half_width <= 0:
+            raise ValueError("precision: relative_half_width must be positive")
+        if not 0 < params.confidence < 1:
+            raise ValueError("precision: confidence must be between 0 and 1")
+        if params.check_interval <= 0:
+            raise ValueError("precision: check_interval must be positive")
+        return params
+
+
+class CheckpointParams(object):
+    def __init__(
+        self,
+        path: str,
+        interval: float = 86400,
+    ) -> None:
+        # the latest checkpoint, replaced atomically every interval simulated seconds
+        self.path = path
+        self.interval = interval
+        if self.interval <= 0:
+            raise ValueError("checkpoint: interval must be positive")
         pass
 
+
+class SnapshotParams(object):
+    def __init__(
+        self,
+        path: str,
+        interval: float = 3600,
+    ) -> None:
+        # newline-delimited JSON, one line every interval simulated seconds
+        self.path = path
+        self.interval = interval
+        if self.interval <= 0:
+            raise ValueError("snapshots: interval must be positive")
+        pass
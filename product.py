@@ -1,78 +1,42 @@
-class ProductStatistics:
-    def __init__(self) -> None:
-        self.wait_time: float = 0.0
-        self.service_time: float = 0.0
-        pass
-
-    def set_wait_time(self, t: float):
-        self.wait_time = t
-        return self
-
-    def set_service_time(self, t: float):
-        self.service_time = t
-        return self
-
-    def __str__(self) -> str:
-        return f"wait_time = {self.wait_time} service_time = {self.service_time}"
-
-    def get_wait_time(self) -> str:
-        return self.wait_time
-
-    def get_service_time(self) -> str:
-        return self.service_time
-
-
-class Entry:
-    def __init__(self, id: str, stats: ProductStatistics) -> None:
-        self.id = id
-        self.stats = stats
-        pass
+class Product:
+    """
+    A product in flight. Slotted and keyed by integer node ids, since under
+    overload hundreds of thousands of them are alive at once
+    """
 
+    __slots__ = ("name", "arrival_time", "node", "wait_start", "total_wait", "visits")
 
-class Product:
-    def __init__(self, name: str) -> None:
+    def __init__(self, name: int, arrival_time: float = 0.0) -> None:
         self.name = name
-        self.queues_visited: dict[str, ProductStatistics] = {}
+        # time the product entered the factory
+        self.arrival_time = arrival_time
+        # id of the node holding the product, -1 before the first one
+        self.node: int = -1
+        self.wait_start: float = 0.0
+        self.total_wait: float = 0.0
+        self.visits: int = 0
 
     def __str__(self) -> str:
-        return f"name={self.name} visited={self.queues_visited} wait_time={self.get_total_wait_time()} service_time={self.get_total_service_time()}"
+        return f"name={self.name} node={self.node} visits={self.visits} wait_time={self.get_total_wait_time()}"
 
-    def get_name(self) -> str:
+    def get_name(self) -> int:
         return self.name
 
-    def visited(self, queue_id: str):
-        self.queues_visited[queue_id] = ProductStatistics(),
-
-    def has_visited(self, queue_id: str):
-        res = self.queues_visited.get(queue_id)
-        return res is not None
+    def visited(self, node: int, now: float):
+        """
+        The product joined the queue of a node
+        """
+        self.node = node
+        self.wait_start = now
+        self.visits += 1
+
+    def end_wait(self, now: float) -> float:
+        """
+        The product left the queue of its node, returns how long it waited
+        """
+        wait = now - self.wait_start
+        self.total_wait += wait
+        return wait
 
     def get_total_wait_time(self) -> float:
-        total: float = 0.0
-        for (_, v) in enumerate(self.queues_visited):
-            total += v.get_wait_time()
-        return total
-
-    def update_wait_time(self, id: str, end: float):
-        res = self.queues_visited[id]
-        if res is None:
-            raise Exception("not exists")
-        res.end_wait_time = end
-
-    def started_waiting_at(self, id: str) -> float:
-        res = self.queues_visited[id]
-        if res is None:
-            raise Exception("not exists")
-        return res.start_wait_time
-
-    def set_wait_start(self, at: float):
-        res = self.queues_visited[id]
-        if res is None:
-            raise Exception("not exists")
-        res.start_wait_time = at
-
-    def get_wait_time(self, id: str):
-        res = self.queues_visited[id]
-        if res is None:
-            raise Exception("not exists")
-        return res.get_wait_time()
\ No newline at end of file
+        return self.total_wait
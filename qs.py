@@ -1,29 +1,114 @@
+from collections import deque
 from product import Product
-from typing import List
+from typing import Iterator, Optional
+import heapq
+import itertools
 import params as pr
 
 
+class QueueFullError(Exception):
+    pass
+
+
+class FIFODiscipline:
+    """
+    First come, first served
+    """
+
+    def __init__(self) -> None:
+        self.items: deque[Product] = deque()
+
+    def push(self, product: Product):
+        self.items.append(product)
+
+    def pop(self) -> Product:
+        return self.items.popleft()
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __iter__(self) -> Iterator[Product]:
+        return iter(self.items)
+
+
+class LIFODiscipline(FIFODiscipline):
+    """
+    Last come, first served
+    """
+
+    def pop(self) -> Product:
+        return self.items.pop()
+
+
+class PriorityDiscipline:
+    """
+    Smallest product attribute first, FIFO among equal priorities
+    """
+
+    def __init__(self, key: str) -> None:
+        self.key = key
+        self.items: list[tuple] = []
+        self.counter = itertools.count()
+
+    def push(self, product: Product):
+        heapq.heappush(
+            self.items, (getattr(product, self.key), next(self.counter), product))
+
+    def pop(self) -> Product:
+        return heapq.heappop(self.items)[2]
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __iter__(self) -> Iterator[Product]:
+        return (entry[2] for entry in self.items)
+
+
+def make_discipline(params: pr.QueueParams):
+    if params.discipline == "fifo":
+        return FIFODiscipline()
+    if params.discipline == "lifo":
+        return LIFODiscipline()
+    if params.discipline == "priority":
+        return PriorityDiscipline(key=params.priority_key)
+    raise ValueError(
+        f"unknown queue discipline {params.discipline}, expected one of {pr.DISCIPLINES}")
+
+
 class Queue:
     """
     Hold visitors
     """
 
     def __init__(
-        self
+        self,
+        params: Optional[pr.QueueParams] = None,
     ) -> None:
-        self.products: List[Product] = []
+        if params is None:
+            params = pr.QueueParams()
+        self.params = params
+        self.capacity: Optional[int] = params.capacity
+        self.products = make_discipline(params)
         return
 
     def enqueue(self, product: Product):
-        self.products.append(product)
+        if self.is_full():
+            raise QueueFullError("queue is full")
+        self.products.push(product)
 
     def dequeue(self) -> Product:
         if self.is_empty():
             raise Exception("queue is empty")
-        return self.products.pop(0)
+        return self.products.pop()
 
     def is_empty(self):
         return len(self.products) == 0
 
+    def is_full(self) -> bool:
+        return self.capacity is not None and len(self.products) >= self.capacity
+
     def __len__(self):
         return len(self.products)
+
+    def __iter__(self) -> Iterator[Product]:
+        return iter(self.products)
@@ -0,0 +1,118 @@
+import argparse
+import json
+import numpy as np
+from concurrent.futures import Executor, ProcessPoolExecutor
+from cache import ResultCache
+from main import ENGINES
+from system_stats import aggregate, print_result
+
+
+def run_replication(config_path: str, workload_path: str, seed: np.random.SeedSequence,
+                    engine: str = "simpy", cache: ResultCache = None,
+                    require_stable: bool = True) -> dict:
+    """
+    Run one factory and send back only its compact summary, read from
+    cache instead when the same run was done before
+    """
+    if cache is not None:
+        key = cache.key(config_path, workload_path, seed, engine)
+        summary = cache.get(key)
+        if summary is not None:
+            return summary
+    factory = ENGINES[engine](workload_path=workload_path,
+                              config_path=config_path, seed=seed,
+                              require_stable=require_stable)
+    factory.open(verbose=False)
+    summary = factory.summary()
+    if cache is not None:
+        cache.put(key, summary)
+    return summary
+
+
+def replicate(
+    config_path: str,
+    workload_path: str,
+    replications: int,
+    seed: int = None,
+    workers: int = None,
+    confidence: float = 0.95,
+    engine: str = "simpy",
+    pool: Executor = None,
+    cache: ResultCache = None,
+    require_stable: bool = True,
+) -> dict:
+    """
+    Aggregate of independent replications, run on pool when given so
+    callers replicating many configs keep one set of workers. With a cache
+    only replications not run before are simulated.
+    """
+    if seed is None:
+        # fresh entropy never repeats, there is nothing to look up
+        cache = None
+    # SeedSequence.spawn gives statistically independent streams per replication
+    seeds = np.random.SeedSequence(seed).spawn(replications)
+    if pool is None:
+        with ProcessPoolExecutor(max_workers=workers) as own_pool:
+            return replicate(config_path, workload_path, replications, seed,
+                             confidence=confidence, engine=engine, pool=own_pool,
+                             cache=cache, require_stable=require_stable)
+    summaries = list(pool.map(
+        run_replication,
+        [config_path] * replications,
+        [workload_path] * replications,
+        seeds,
+        [engine] * replications,
+        [cache] * replications,
+        [require_stable] * replications,
+    ))
+    if cache is not None:
+        cache.evict()
+    return aggregate(summaries, confidence=confidence)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run independent replications of the factory in parallel")
+    parser.add_argument("config", help="path to the network config file")
+    parser.add_argument("workload", help="path to the workload file")
+    parser.add_argument("replications", type=int,
+                        help="number of independent replications")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="root seed, replications get spawned child seeds")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="worker processes, defaults to the CPU count")
+    parser.add_argument("--confidence", type=float, default=0.95)
+    parser.add_argument("--engine", choices=list(ENGINES), default="simpy",
+                        help="simulation engine of every replication")
+    parser.add_argument("--allow-unstable", action="store_true",
+                        help="simulate a network with a node at utilization >= 1 instead of refusing it")
+    parser.add_argument("--json", action="store_true",
+                        help="print the result as JSON instead of a table")
+    parser.add_argument("--cache", default=None,
+                        help="directory of cached replication summaries, needs --seed")
+    parser.add_argument("--cache-max-bytes", type=int, default=None,
+                        help="evict the least recently used cache entries above this size")
+    parser.add_argument("--cache-max-age", type=float, default=None,
+                        help="evict cache entries unused for this many seconds")
+    args = parser.parse_args()
+
+    cache = None
+    if args.cache is not None:
+        cache = ResultCache(args.cache, max_bytes=args.cache_max_bytes,
+                            max_age=args.cache_max_age)
+
+    result = replicate(
+        config_path=args.config,
+        workload_path=args.workload,
+        replications=args.replications,
+        seed=args.seed,
+        workers=args.workers,
+        confidence=args.confidence,
+        engine=args.engine,
+        cache=cache,
+        require_stable=not args.allow_unstable,
+    )
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print_result(result)
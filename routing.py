@@ -0,0 +1,258 @@
+import math
+import numpy as np
+from typing import Any, Callable, Sequence
+from params import RoutingParams
+from streams import VariateStream
+
+
+class AliasTable:
+    """
+    Walker/Vose alias table, built once, giving O(1) draws from a discrete
+    distribution with a single uniform variate
+    """
+
+    def __init__(self, probabilities: Sequence[float]) -> None:
+        n = len(probabilities)
+        if n == 0:
+            raise ValueError("alias table needs at least one probability")
+        total = float(sum(probabilities))
+        if total <= 0:
+            raise ValueError("probabilities must sum to a positive value")
+
+        self.n = n
+        self.prob: list[float] = [0.0] * n
+        self.alias: list[int] = list(range(n))
+
+        scaled = [p * n / total for p in probabilities]
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] = scaled[l] + scaled[s] - 1.0
+            if scaled[l] < 1.0:
+                small.append(l)
+            else:
+                large.append(l)
+        # leftovers are 1.0 up to rounding error
+        for i in large + small:
+            self.prob[i] = 1.0
+
+    def sample_array(self, u: np.ndarray) -> np.ndarray:
+        """
+        Vectorized sample over an array of uniforms
+        """
+        scaled = u * self.n
+        column = scaled.astype(np.int64)
+        keep = (scaled - column) < np.asarray(self.prob)[column]
+        return np.where(keep, column, np.asarray(self.alias)[column])
+
+    def sample(self, u: float) -> int:
+        # the integer part picks the column, the fractional part the coin flip
+        scaled = u * self.n
+        column = int(scaled)
+        if scaled - column < self.prob[column]:
+            return column
+        return self.alias[column]
+
+
+class Router:
+    """
+    Choose among destinations with a precompiled alias table, drawing from a
+    batched uniform stream. A table compiled from the same probabilities,
+    e.g. NetworkModel.alias_tables, is reused instead of built again.
+    """
+
+    def __init__(self, destinations: Sequence[Any], stream: VariateStream,
+                 table: AliasTable = None) -> None:
+        self.destinations = list(destinations)
+        self.stream = stream
+        self.table = table
+        if self.table is None and len(self.destinations) > 0:
+            self.table = AliasTable(
+                [destination.probability for destination in self.destinations])
+
+    def __len__(self) -> int:
+        return len(self.destinations)
+
+    def choose(self) -> Any:
+        return self.destinations[self.table.sample(self.stream.next())]
+
+
+class LoadIndex:
+    """
+    Products in every node, queued, in service or held by a blocked server,
+    updated on each admission and departure. Load-aware routers watch the
+    nodes they route to and keep their own structures current from here,
+    so a decision never scans the network.
+    """
+
+    def __init__(self, servers: Sequence[int], mean_service_times: Sequence[float]) -> None:
+        n = len(servers)
+        self.loads = [0] * n
+        self.servers = [int(s) for s in servers]
+        self.mean_service_times = [float(m) for m in mean_service_times]
+        self.watchers: list[list[Callable[[int], None]]] = [[] for _ in range(n)]
+
+    def watch(self, node: int, callback: Callable[[int], None]):
+        self.watchers[node].append(callback)
+
+    def add(self, node: int, delta: int):
+        self.loads[node] += delta
+        for callback in self.watchers[node]:
+            callback(node)
+
+    def set_servers(self, node: int, count: int):
+        self.servers[node] = count
+        for callback in self.watchers[node]:
+            callback(node)
+
+    def is_idle(self, node: int) -> bool:
+        return self.loads[node] < self.servers[node]
+
+    def expected_work(self, node: int) -> float:
+        # time to clear the products there and one more, spread over the servers
+        return (self.loads[node] + 1) * self.mean_service_times[node] / self.servers[node]
+
+
+class MinTree:
+    """
+    Segment tree over scores: O(log k) updates and the position of the
+    minimum in O(1), ties going to the lowest position
+    """
+
+    def __init__(self, scores: Sequence[float]) -> None:
+        size = 1
+        while size < len(scores):
+            size *= 2
+        self.size = size
+        self.tree = [(math.inf, i) for i in range(2 * size)]
+        for i, score in enumerate(scores):
+            self.tree[size + i] = (score, i)
+        for i in range(size - 1, 0, -1):
+            self.tree[i] = min(self.tree[2 * i], self.tree[2 * i + 1])
+
+    def update(self, position: int, score: float):
+        tree = self.tree
+        i = self.size + position
+        tree[i] = (score, position)
+        i //= 2
+        while i > 0:
+            tree[i] = min(tree[2 * i], tree[2 * i + 1])
+            i //= 2
+
+    def argmin(self) -> int:
+        return self.tree[1][1]
+
+
+class PolicyRouter(Router):
+    """
+    Route by the load of the destinations. A draw from the go_to
+    probabilities first decides whether the product exits, so exit rates
+    stay as configured, then the policy picks among the node destinations:
+    jsq and lew read a MinTree in O(1) kept up in O(log k) per load change,
+    jiq picks at random among idle nodes kept in a swap-remove list, and
+    power_of_d compares d destinations drawn from the go_to probabilities.
+    """
+
+    def __init__(self, destinations: Sequence[Any], stream: VariateStream,
+                 nodes: Sequence[int], params: RoutingParams, index: LoadIndex,
+                 table: AliasTable = None) -> None:
+        super().__init__(destinations=destinations, stream=stream, table=table)
+        self.params = params
+        self.index = index
+        # node index of each destination, negative for the exit
+        self.nodes = list(nodes)
+        self.members = [k for k, j in enumerate(self.nodes) if j >= 0]
+        self.member_nodes = [self.nodes[k] for k in self.members]
+        # member positions of each node, two when go_to lists a node twice
+        self.positions: dict[int, list[int]] = {}
+        for m, j in enumerate(self.member_nodes):
+            self.positions.setdefault(j, []).append(m)
+        self.has_exit = len(self.members) < len(self.nodes)
+        weights = [self.destinations[k].probability for k in self.members]
+        if sum(weights) <= 0:
+            # every product exits, the policy never gets to pick
+            self.members = []
+        self.member_table = AliasTable(weights) if len(self.members) > 0 else None
+
+        self.tree: MinTree = None
+        self.idle: list[int] = []
+        self.idle_position: dict[int, int] = {}
+        policy = params.policy
+        if policy in ("jsq", "lew"):
+            self.score = index.loads.__getitem__ if policy == "jsq" else index.expected_work
+            self.tree = MinTree([self.score(j) for j in self.member_nodes])
+            self._select = self.tree.argmin
+            callback = self._rescore
+        elif policy == "jiq":
+            for m, j in enumerate(self.member_nodes):
+                self._mark(m, index.is_idle(j))
+            self._select = self._join_idle
+            callback = self._reidle
+        else:
+            self._select = self._power_of_d
+            callback = None
+        if callback is not None:
+            for j in self.positions:
+                index.watch(j, callback)
+
+    def _rescore(self, node: int):
+        score = self.score(node)
+        for m in self.positions[node]:
+            self.tree.update(m, score)
+
+    def _mark(self, member: int, idle: bool):
+        if idle and member not in self.idle_position:
+            self.idle_position[member] = len(self.idle)
+            self.idle.append(member)
+        elif not idle and member in self.idle_position:
+            # move the last idle member into the hole
+            position = self.idle_position.pop(member)
+            last = self.idle.pop()
+            if last != member:
+                self.idle[position] = last
+                self.idle_position[last] = position
+
+    def _reidle(self, node: int):
+        idle = self.index.is_idle(node)
+        for m in self.positions[node]:
+            self._mark(m, idle)
+
+    def _join_idle(self) -> int:
+        u = self.stream.next()
+        if len(self.idle) > 0:
+            return self.idle[int(u * len(self.idle))]
+        # nobody idle, fall back to the go_to probabilities
+        return self.member_table.sample(u)
+
+    def _power_of_d(self) -> int:
+        loads = self.index.loads
+        best, best_load = None, None
+        for _ in range(self.params.d):
+            m = self.member_table.sample(self.stream.next())
+            load = loads[self.member_nodes[m]]
+            if best is None or load < best_load:
+                best, best_load = m, load
+        return best
+
+    def choose(self) -> Any:
+        if self.has_exit or len(self.members) == 0:
+            k = self.table.sample(self.stream.next())
+            if self.nodes[k] < 0 or len(self.members) == 0:
+                return self.destinations[k]
+        return self.destinations[self.members[self._select()]]
+
+
+def build_router(destinations: Sequence[Any], stream: VariateStream, nodes: Sequence[int],
+                 params: RoutingParams = None, index: LoadIndex = None,
+                 table: AliasTable = None) -> Router:
+    """
+    Router of a node's routing policy, probabilistic without params
+    """
+    if params is None or params.policy == "probabilistic" or len(destinations) == 0:
+        return Router(destinations=destinations, stream=stream, table=table)
+    return PolicyRouter(destinations=destinations, stream=stream, nodes=nodes,
+                        params=params, index=index, table=table)
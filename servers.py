@@ -1,7 +1,7 @@
 from product import Product
 import simpy as sp
 import params as pr
-import numpy as np
+from streams import VariateStream
 
 class ProductServer:
     def __init__(self) -> None:
@@ -18,17 +18,17 @@ class ProductionLineServer(ProductServer):
         self,
         env: sp.Environment,
         params: pr.ServerParams,
+        stream: VariateStream,
     ) -> None:
         self.env = env
         self.params = params
+        self.stream = stream
         super().__init__()
 
     def process(self, product: Product):
         # print(
         #     f"At time t = {self.env.now}, ProductionLineServer RECEIVE product = {product.name}")
-        service_time = max(1, np.random.exponential(
-            self.params.mean_service_time,
-        ))
+        service_time = self.stream.next()
         # print(
         #     f"At time t = {self.env.now}, ProductionLineServer START product = {product.name}, duration = {service_time}")
         yield self.env.timeout(service_time)
@@ -41,17 +41,17 @@ class QACheckServer(ProductServer):
         self,
         env: sp.Environment,
         params: pr.ServerParams,
+        stream: VariateStream,
     ) -> None:
         self.env = env
         self.params = params
+        self.stream = stream
         super().__init__()
 
     def process(self, product: Product):
         # print(
         #     f"At time t = {self.env.now}, QACheckServer RECEIVE product = {product.name}")
-        service_time = max(1, np.random.exponential(
-            self.params.mean_service_time,
-        ))
+        service_time = self.stream.next()
         # print(
         #     f"At time t = {self.env.now}, QACheckServer START product = {product.name}, duration = {service_time}")
         yield self.env.timeout(service_time)
@@ -60,9 +60,10 @@ class QACheckServer(ProductServer):
         return 
 
 class DispatcherServer(ProductServer):
-    def __init__(self, env: sp.Environment, params: pr.ServerParams) -> None:
+    def __init__(self, env: sp.Environment, params: pr.ServerParams, stream: VariateStream) -> None:
         self.env = env
         self.params = params
+        self.stream = stream
         super().__init__()
 
     
@@ -70,7 +71,7 @@ class DispatcherServer(ProductServer):
         # print(
         #     f"At time t = {self.env.now}, DispatcherServer RECEIVE product = {product.name}")
 
-        service_time = max(1, np.random.exponential(self.params.mean_service_time))
+        service_time = self.stream.next()
         
         # print(
         #     f"At time t = {self.env.now}, DispatcherServer START product = {product.name}, duration = {service_time}")
@@ -0,0 +1,151 @@
+import math
+from bisect import bisect_right, insort
+import numpy as np
+
+# quantiles reported for waits and sojourn times
+QUANTILES = (0.5, 0.9, 0.95, 0.99, 0.999)
+
+
+class P2Quantiles:
+    """
+    Extended P-square estimate of several quantiles (Raatikainen, 1987):
+    one set of 2k + 3 markers at the quantiles, the midpoints between them
+    and both ends, constant memory whatever the number of observations.
+    Marker heights never cross, so the estimates are non-decreasing in p.
+    """
+
+    def __init__(self, quantiles: tuple) -> None:
+        self.quantiles = tuple(sorted(set(quantiles)))
+        self.count = 0
+        self.heights: list[float] = []
+        # desired position of marker i after n observations is 1 + (n - 1) * rates[i]
+        rates = [0.0]
+        for low, high in zip(self.quantiles, self.quantiles[1:] + (1.0,)):
+            rates += [low, (low + high) / 2]
+        rates[1:1] = [self.quantiles[0] / 2]
+        self.rates = tuple(rates + [1.0])
+        self.positions = list(range(1, len(self.rates) + 1))
+
+    def update(self, x: float):
+        self.count += 1
+        q = self.heights
+        last = len(self.rates) - 1
+        if self.count <= last + 1:
+            insort(q, x)
+            return
+
+        if x < q[0]:
+            q[0] = x
+            k = 1
+        elif x >= q[last]:
+            q[last] = x
+            k = last
+        else:
+            # q[k - 1] <= x < q[k]
+            k = bisect_right(q, x, 1, last)
+
+        n = self.positions
+        for i in range(k, last + 1):
+            n[i] += 1
+
+        scale = self.count - 1
+        rates = self.rates
+        for i in range(1, last):
+            d = 1 + scale * rates[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                step = 1 if d > 0 else -1
+                height = self._parabolic(i, step)
+                if not q[i - 1] < height < q[i + 1]:
+                    height = self._linear(i, step)
+                q[i] = height
+                n[i] += step
+
+    def _parabolic(self, i: int, d: int) -> float:
+        q = self.heights
+        n = self.positions
+        return q[i] + d / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+            + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+
+    def _linear(self, i: int, d: int) -> float:
+        q = self.heights
+        n = self.positions
+        return q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+
+    def values(self) -> dict[float, float]:
+        """
+        Estimate of every quantile, the sample quantiles while there are
+        fewer observations than markers
+        """
+        heights = self.heights
+        if len(heights) == 0:
+            return {p: math.nan for p in self.quantiles}
+        if len(heights) < len(self.rates):
+            return {p: heights[min(len(heights) - 1, int(p * len(heights)))]
+                    for p in self.quantiles}
+        # quantile i sits on marker 2 i + 2, between its two midpoint markers
+        return {p: heights[2 * i + 2] for i, p in enumerate(self.quantiles)}
+
+
+class QuantileSketch:
+    """
+    Count, mean, max and P-square estimates of a fixed set of quantiles
+    """
+
+    def __init__(self, quantiles: tuple = QUANTILES) -> None:
+        self.estimator = P2Quantiles(quantiles)
+        self.count = 0
+        self.total = 0.0
+        self.max = -math.inf
+
+    def update(self, x: float):
+        self.count += 1
+        self.total += x
+        if x > self.max:
+            self.max = x
+        self.estimator.update(x)
+
+    def mean(self) -> float:
+        if self.count == 0:
+            return math.nan
+        return self.total / self.count
+
+    def quantiles(self) -> dict[float, float]:
+        return self.estimator.values()
+
+    def summary(self, scale: float = 1.0) -> dict:
+        """
+        Count, mean, quantiles keyed p50, p90, p95, p99, p99_9 and max, divided by scale
+        """
+        res = {"count": self.count, "mean": self.mean() / scale}
+        for p, value in self.quantiles().items():
+            res[quantile_name(p)] = value / scale
+        res["max"] = self.max / scale if self.count > 0 else math.nan
+        return res
+
+
+class SampleQuantiles(QuantileSketch):
+    """
+    QuantileSketch results computed exactly from a whole sample, for engines
+    that hold every observation in arrays anyway
+    """
+
+    def __init__(self, values, quantiles: tuple = QUANTILES) -> None:
+        values = np.asarray(values, dtype=float)
+        self.count = len(values)
+        self.total = float(values.sum())
+        self.max = float(values.max(initial=-math.inf))
+        if self.count == 0:
+            self.values = {p: math.nan for p in quantiles}
+        else:
+            self.values = dict(zip(quantiles, np.quantile(values, quantiles).tolist()))
+
+    def update(self, x: float):
+        raise TypeError("SampleQuantiles is computed once from a whole sample")
+
+    def quantiles(self) -> dict[float, float]:
+        return dict(self.values)
+
+
+def quantile_name(p: float) -> str:
+    return "p" + f"{p * 100:g}".replace(".", "_")
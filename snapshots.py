@@ -0,0 +1,176 @@
+import json
+from bisect import bisect_right
+from params import WindowParams
+from system_stats import SystemStatistics, TimeWeightedStatistic
+
+# accumulators at t = 0: time, arrivals, service starts, total wait and areas
+START = (0.0, 0, 0, 0.0, 0.0, 0.0, 0.0)
+
+
+def _area(stat: TimeWeightedStatistic, now: float) -> float:
+    # area under the quantity up to now, without closing it
+    return stat.area + stat.value * (now - stat.last_time)
+
+
+def _ratio(numerator: float, denominator: float) -> float:
+    # None is written as null, e.g. the wait of a window without service starts
+    return numerator / denominator if denominator > 0 else None
+
+
+def accumulators(stats: SystemStatistics, now: float) -> tuple:
+    """
+    Running totals of a node at now, in START order
+    """
+    # products still queued arrived but did not start
+    arrivals = stats.total_service_requests + int(stats.queue_length.value)
+    return (now, arrivals, stats.total_service_requests, stats.total_wait_time,
+            _area(stats.in_system, now), _area(stats.queue_length, now),
+            _area(stats.busy_servers, now))
+
+
+def metrics(before: tuple, after: tuple, servers: int) -> dict:
+    """
+    Arrival rate (per hour), utilization, L, Lq and mean wait (hours)
+    between two accumulators tuples
+    """
+    elapsed, arrivals, starts, wait, in_node, in_queue, busy = (
+        a - b for a, b in zip(after, before))
+    return {
+        "arrival_rate": _ratio(arrivals * 3600, elapsed),
+        "utilization": _ratio(busy, elapsed * servers),
+        "avg_products_in_node": _ratio(in_node, elapsed),
+        "avg_products_in_queue": _ratio(in_queue, elapsed),
+        "avg_wait_time": _ratio(wait / 3600, starts),
+    }
+
+
+class SnapshotWriter:
+    """
+    Append one JSON line per snapshot to a file another process can tail:
+    per node arrival rate (per hour), utilization, L, Lq and mean wait
+    (hours), cumulative since t = 0 and over the window since the previous
+    snapshot.
+
+    Everything is read off the running counters and time-weighted areas of
+    SystemStatistics, so a snapshot costs the same whatever the number of
+    products in flight.
+    """
+
+    def __init__(self, path: str, interval: float) -> None:
+        self.path = path
+        self.interval = interval
+        # line buffered, a reader sees each snapshot as soon as it is written
+        self.file = open(path, "w", buffering=1)
+        # per node name: time, arrivals, starts, total wait and areas of the previous snapshot
+        self.previous: dict[str, tuple] = {}
+        self.last_time: float = None
+
+    def write(self, now: float, nodes: list[tuple[str, SystemStatistics, int]]):
+        """
+        Snapshot of (name, statistics, servers) of every node at now
+        """
+        line = {"time": float(now), "nodes": {}}
+        for name, stats, servers in nodes:
+            current = accumulators(stats, now)
+            line["nodes"][name] = {
+                "in_node": int(stats.in_system.value),
+                "in_queue": int(stats.queue_length.value),
+                "cumulative": metrics(START, current, servers),
+                "window": metrics(self.previous.get(name, START), current, servers),
+            }
+            self.previous[name] = current
+        self.file.write(json.dumps(line) + "\n")
+        self.last_time = now
+
+    def close(self):
+        self.file.close()
+
+
+def _clock(seconds: float) -> str:
+    hours, rest = divmod(int(seconds), 3600)
+    return f"{hours:02d}:{rest // 60:02d}"
+
+
+class WindowStatistics:
+    """
+    Per node statistics of every shift of every period (day) of a run,
+    from the same running totals as the snapshots. Shifts are pooled over
+    the days and also reported at their worst day, so servers can be sized
+    for the peak shift instead of the two week average.
+    """
+
+    def __init__(self, params: WindowParams) -> None:
+        self.params = params
+        self.labels = params.names or [
+            f"{_clock(start)}-{_clock(end)}"
+            for start, end in zip(params.starts, params.starts[1:] + [params.period])]
+        self.previous: dict[str, tuple] = {}
+        self.last_time = 0.0
+        # (day, shift, {name: (accumulator differences, servers)}) of every closed window
+        self.windows: list[tuple] = []
+
+    def shift(self, time: float) -> tuple[int, int]:
+        """
+        Day and shift index of time
+        """
+        day, offset = divmod(time, self.params.period)
+        return int(day), bisect_right(self.params.starts, offset) - 1
+
+    def next_boundary(self, now: float) -> float:
+        """
+        Start of the window after the one holding now
+        """
+        day, offset = divmod(now, self.params.period)
+        for start in self.params.starts[1:] + [self.params.period]:
+            if start > offset:
+                return day * self.params.period + start
+        return (day + 1) * self.params.period
+
+    def record(self, now: float, nodes: list[tuple[str, SystemStatistics, int]]):
+        """
+        Close the window running since the last record at now
+        """
+        if now <= self.last_time:
+            return
+        day, shift = self.shift(self.last_time)
+        window = {}
+        for name, stats, servers in nodes:
+            current = accumulators(stats, now)
+            before = self.previous.get(name, START)
+            window[name] = (tuple(a - b for a, b in zip(current, before)), servers)
+            self.previous[name] = current
+        self.windows.append((day, shift, window))
+        self.last_time = now
+
+    def _pooled(self, key) -> dict:
+        # key of a window -> {name: metrics of the summed windows, plus the worst window}
+        totals: dict = {}
+        for day, shift, window in self.windows:
+            group = totals.setdefault(key(day, shift), {})
+            for name, (difference, servers) in window.items():
+                if name not in group:
+                    group[name] = {"total": START, "servers": servers,
+                                   "peak_utilization": None, "peak_wait_time": None}
+                entry = group[name]
+                entry["total"] = tuple(a + b for a, b in zip(entry["total"], difference))
+                one = metrics(START, difference, servers)
+                for peak, metric in (("peak_utilization", "utilization"),
+                                     ("peak_wait_time", "avg_wait_time")):
+                    if one[metric] is not None and (entry[peak] is None or one[metric] > entry[peak]):
+                        entry[peak] = one[metric]
+        return {k: {name: dict(metrics(START, e["total"], e["servers"]),
+                               peak_utilization=e["peak_utilization"],
+                               peak_wait_time=e["peak_wait_time"])
+                    for name, e in group.items()}
+                for k, group in totals.items()}
+
+    def summary(self) -> dict:
+        """
+        Metrics per shift label and per day, each {node name: metrics}
+        """
+        shifts = self._pooled(lambda day, shift: self.labels[shift])
+        days = self._pooled(lambda day, shift: day)
+        return {
+            "shifts": {label: shifts[label] for label in self.labels if label in shifts},
+            "days": {f"day {day}": nodes for day, nodes in sorted(days.items())},
+        }
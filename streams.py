@@ -0,0 +1,402 @@
+import math
+import zlib
+import numpy as np
+from functools import partial
+from typing import Callable, Optional
+from params import ServiceParams, GeneratorParams, TraceParams, RateProfileParams
+
+DEFAULT_BLOCK_SIZE = 4096
+
+
+def _exponential(mean: float, rng: np.random.Generator, n: int) -> np.ndarray:
+    return rng.exponential(mean, size=n)
+
+
+def _uniform(rng: np.random.Generator, n: int) -> np.ndarray:
+    return rng.random(size=n)
+
+
+def _lognormal(mu: float, sigma: float, rng: np.random.Generator, n: int) -> np.ndarray:
+    return rng.lognormal(mu, sigma, size=n)
+
+
+def _gamma(shape: float, scale: float, rng: np.random.Generator, n: int) -> np.ndarray:
+    return rng.gamma(shape, scale, size=n)
+
+
+def _deterministic(value: float, rng: np.random.Generator, n: int) -> np.ndarray:
+    return np.full(n, float(value))
+
+
+def _histogram(cumulative: np.ndarray, edges: np.ndarray, rng: np.random.Generator,
+               n: int) -> np.ndarray:
+    # inverse CDF of a piecewise-uniform density, cumulative runs from 0 to 1
+    u = rng.random(size=n)
+    i = np.clip(np.searchsorted(cumulative, u, side="right") - 1, 0, len(edges) - 2)
+    fraction = (u - cumulative[i]) / (cumulative[i + 1] - cumulative[i])
+    return edges[i] + fraction * (edges[i + 1] - edges[i])
+
+
+def open_trace(params: TraceParams) -> np.ndarray:
+    """
+    The trace column as a read-only memory map, nothing is read until indexed
+    """
+    if params.path.endswith(".npy"):
+        data = np.load(params.path, mmap_mode="r")
+    else:
+        data = np.memmap(params.path, dtype=params.dtype, mode="r")
+        if params.columns > 1:
+            data = data.reshape(-1, params.columns)
+    if data.ndim == 1:
+        return data
+    return data[:, params.column]
+
+
+class Empirical:
+    """
+    Inverse-CDF draws from the empirical distribution of a trace: the
+    floor(u * n)-th order statistic is a uniformly chosen sample, so draws
+    index the memory map directly instead of sorting it into memory
+    """
+
+    def __init__(self, params: TraceParams) -> None:
+        self.params = params
+        self.samples = open_trace(params)
+
+    def __call__(self, rng: np.random.Generator, n: int) -> np.ndarray:
+        return np.asarray(self.samples[rng.integers(0, len(self.samples), size=n)], dtype=float)
+
+    def __getstate__(self) -> dict:
+        # checkpoints keep the path, not a copy of the file
+        return {"params": self.params}
+
+    def __setstate__(self, state: dict):
+        self.__init__(state["params"])
+
+
+class VariateStream:
+    """
+    Hand out random variates one at a time from blocks pre-generated by a
+    numpy Generator.
+
+    Drawing a block of n values from a Generator yields the same sequence as
+    n consecutive scalar draws, so a stream reproduces the scalar draws of a
+    Generator seeded the same way, clamp included.
+
+    The draws are not those of the original code, which took every variate
+    from the global np.random state in event order. That sequence depends on
+    how the draws of all nodes interleave, so no per-node block can
+    reproduce it. Runs are instead reproducible per seed from here on.
+    """
+
+    def __init__(
+        self,
+        rng: np.random.Generator,
+        draw: Callable[[np.random.Generator, int], np.ndarray],
+        block_size: int = DEFAULT_BLOCK_SIZE,
+        minimum: Optional[float] = None,
+    ) -> None:
+        self.rng = rng
+        self.draw = draw
+        self.block_size = block_size
+        self.minimum = minimum
+        self.block: list[float] = []
+        self.pos = 0
+        self.refills = 0
+        # variates handed out by next and take, blocks dropped by reseed aside
+        self.handed_out = 0
+
+    def _refill(self):
+        block = self.draw(self.rng, self.block_size)
+        if self.minimum is not None:
+            block = np.maximum(block, self.minimum)
+        # python floats index much faster than numpy scalars
+        self.block = block.tolist()
+        self.pos = 0
+        self.refills += 1
+
+    def next(self) -> float:
+        if self.pos >= len(self.block):
+            self._refill()
+        value = self.block[self.pos]
+        self.pos += 1
+        self.handed_out += 1
+        return value
+
+    def drawn(self) -> int:
+        """
+        Number of variates handed out so far
+        """
+        return self.handed_out
+
+    def reseed(self, rng: np.random.Generator):
+        """
+        Continue the stream from rng, dropping the rest of the current block
+        """
+        self.rng = rng
+        self.block = []
+        self.pos = 0
+
+    def take(self, n: int) -> np.ndarray:
+        """
+        Return the next n variates as an array, continuing the stream
+        """
+        out = np.empty(n)
+        filled = 0
+        while filled < n:
+            if self.pos >= len(self.block):
+                self._refill()
+            count = min(n - filled, len(self.block) - self.pos)
+            out[filled:filled + count] = self.block[self.pos:self.pos + count]
+            self.pos += count
+            filled += count
+        self.handed_out += n
+        return out
+
+
+class TraceStream(VariateStream):
+    """
+    Replay a trace file in order, one block at a time through numpy.memmap,
+    so memory stays at one block whatever the length of the file. Absolute
+    times are turned into gaps. At the end the stream wraps around, or
+    hands out +inf (no further event) when wrap is False.
+    """
+
+    def __init__(
+        self,
+        params: TraceParams,
+        wrap: bool = True,
+        block_size: int = DEFAULT_BLOCK_SIZE,
+        minimum: Optional[float] = None,
+    ) -> None:
+        super().__init__(rng=None, draw=None, block_size=block_size, minimum=minimum)
+        self.params = params
+        self.wrap = wrap and not params.times
+        self.data = open_trace(params)
+        # next row of the file, and the last arrival time of a times trace
+        self.row = 0
+        self.last_time = 0.0
+
+    def _refill(self):
+        if self.row >= len(self.data) and self.wrap and len(self.data) > 0:
+            self.row = 0
+        if self.row >= len(self.data):
+            self.block = [math.inf]
+            self.pos = 0
+            self.refills += 1
+            return
+        block = np.asarray(self.data[self.row:self.row + self.block_size], dtype=float)
+        self.row += len(block)
+        if self.params.times:
+            block, self.last_time = np.diff(block, prepend=self.last_time), block[-1]
+        if self.minimum is not None:
+            block = np.maximum(block, self.minimum)
+        self.block = block.tolist()
+        self.pos = 0
+        self.refills += 1
+
+    def reseed(self, rng: np.random.Generator):
+        # a replay does not depend on the seed
+        return
+
+    def __getstate__(self) -> dict:
+        state = dict(self.__dict__)
+        del state["data"]
+        return state
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self.data = open_trace(self.params)
+
+
+class RateProfile:
+    """
+    Cumulative arrival rate Lambda(t) of a piecewise-constant rate profile,
+    inverted for whole arrays of positions at once
+    """
+
+    def __init__(self, params: RateProfileParams, mean_interarrival_time: float) -> None:
+        self.starts = np.asarray(params.starts, dtype=float)
+        self.rates = np.asarray(params.factors, dtype=float) / (
+            params.mean_factor * mean_interarrival_time)
+        self.period = params.period
+        # Lambda at every start, equal starts of a zero rate piece and the next
+        self.cumulative = np.concatenate(
+            [[0.0], np.cumsum(self.rates[:-1] * np.diff(self.starts))])
+        self.per_period = None
+        if self.period is not None:
+            self.per_period = self.cumulative[-1] + self.rates[-1] * (self.period - self.starts[-1])
+
+    def inverse(self, positions: np.ndarray) -> np.ndarray:
+        """
+        Times t with Lambda(t) = positions, +inf past the last arrival of a
+        profile ending at rate zero
+        """
+        offset = 0.0
+        if self.period is not None:
+            periods, positions = np.divmod(positions, self.per_period)
+            offset = periods * self.period
+        # side right skips zero rate pieces, which add nothing to Lambda
+        piece = np.searchsorted(self.cumulative, positions, side="right") - 1
+        rates = self.rates[piece]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            times = self.starts[piece] + (positions - self.cumulative[piece]) / rates
+        return np.where(rates > 0, offset + times, math.inf)
+
+
+class ProfileStream(VariateStream):
+    """
+    Interarrival times of a non-homogeneous Poisson process with a
+    piecewise-constant rate. A block of unit rate exponential gaps is summed
+    into positions on the Lambda axis and mapped back to arrival times in one
+    vectorized inversion, so the profile costs one numpy pass per block.
+    """
+
+    def __init__(
+        self,
+        rng: np.random.Generator,
+        profile: RateProfile,
+        block_size: int = DEFAULT_BLOCK_SIZE,
+    ) -> None:
+        super().__init__(rng=rng, draw=partial(_exponential, 1.0), block_size=block_size)
+        self.profile = profile
+        # Lambda and time of the last arrival handed to a block
+        self.position = 0.0
+        self.time = 0.0
+        # Lambda and time at the start of the block and after each of its gaps
+        self.positions = np.zeros(1)
+        self.times = np.zeros(1)
+
+    def _refill(self):
+        positions = self.position + np.cumsum(self.draw(self.rng, self.block_size))
+        times = self.profile.inverse(positions)
+        with np.errstate(invalid="ignore"):
+            gaps = np.diff(times, prepend=self.time)
+        # inf - inf is nan, once the rate stays at zero no arrival follows
+        gaps[np.isinf(times)] = math.inf
+        self.positions = np.concatenate([[self.position], positions])
+        self.times = np.concatenate([[self.time], times])
+        self.position = positions[-1]
+        self.time = times[-1]
+        self.block = gaps.tolist()
+        self.pos = 0
+        self.refills += 1
+
+    def reseed(self, rng: np.random.Generator):
+        """
+        Continue the stream from rng at the last arrival handed out, the
+        dropped rest of the block never moved along the profile
+        """
+        if len(self.block) > 0:
+            self.position = float(self.positions[self.pos])
+            self.time = float(self.times[self.pos])
+        super().reseed(rng)
+
+
+class RandomStreams:
+    """
+    Independent random streams, one per (node, purpose) pair, all derived
+    from a single seed.
+
+    Child seeds are keyed by the node and purpose names rather than by
+    creation order, so adding a node does not shift the draws of the others.
+    Each stream is a PCG64 Generator, not the legacy MT19937 global state,
+    so no seed reproduces a run of the original code.
+    """
+
+    def __init__(self, seed=None) -> None:
+        if isinstance(seed, np.random.SeedSequence):
+            self.seed_seq = seed
+        else:
+            self.seed_seq = np.random.SeedSequence(seed)
+
+    def generator(self, node: str, purpose: str) -> np.random.Generator:
+        key = (zlib.crc32(node.encode()), zlib.crc32(purpose.encode()))
+        child = np.random.SeedSequence(
+            self.seed_seq.entropy,
+            spawn_key=tuple(self.seed_seq.spawn_key) + key,
+        )
+        return np.random.Generator(np.random.PCG64(child))
+
+    def exponential(
+        self,
+        node: str,
+        purpose: str,
+        mean: float,
+        minimum: Optional[float] = None,
+        block_size: int = DEFAULT_BLOCK_SIZE,
+    ) -> VariateStream:
+        return VariateStream(
+            rng=self.generator(node, purpose),
+            draw=partial(_exponential, mean),
+            block_size=block_size,
+            minimum=minimum,
+        )
+
+    def service(
+        self,
+        node: str,
+        params: ServiceParams,
+        block_size: int = DEFAULT_BLOCK_SIZE,
+    ) -> VariateStream:
+        """
+        Service times of node drawn, or replayed, as params configure
+        """
+        distribution = params.distribution
+        if distribution == "exponential":
+            return self.exponential(node=node, purpose="service", mean=params.mean,
+                                    minimum=params.minimum, block_size=block_size)
+        if distribution == "trace":
+            return TraceStream(params=params.trace, wrap=True, block_size=block_size,
+                               minimum=params.minimum)
+        if distribution == "lognormal":
+            sigma2 = math.log(1 + params.cv ** 2)
+            draw = partial(_lognormal, math.log(params.mean) - sigma2 / 2, math.sqrt(sigma2))
+        elif distribution == "gamma":
+            shape = 1 / params.cv ** 2
+            draw = partial(_gamma, shape, params.mean / shape)
+        elif distribution == "deterministic":
+            draw = partial(_deterministic, params.mean)
+        elif distribution == "histogram":
+            weights = np.asarray(params.weights, dtype=float)
+            cumulative = np.concatenate([[0.0], np.cumsum(weights) / weights.sum()])
+            draw = partial(_histogram, cumulative, np.asarray(params.bins, dtype=float))
+        else:
+            draw = Empirical(params.trace)
+        return VariateStream(
+            rng=self.generator(node, "service"),
+            draw=draw,
+            block_size=block_size,
+            minimum=params.minimum,
+        )
+
+    def interarrival(
+        self,
+        params: GeneratorParams,
+        block_size: int = DEFAULT_BLOCK_SIZE,
+    ) -> VariateStream:
+        """
+        Exponential interarrival times at a constant or profiled rate, or
+        the gaps of an arrival trace
+        """
+        if params.trace is not None:
+            return TraceStream(params=params.trace, wrap=False, block_size=block_size)
+        if params.rate_profile is not None:
+            return ProfileStream(
+                rng=self.generator("generator", "interarrival"),
+                profile=RateProfile(params.rate_profile, params.mean_interarrival_time),
+                block_size=block_size)
+        return self.exponential(node="generator", purpose="interarrival",
+                                mean=params.mean_interarrival_time, block_size=block_size)
+
+    def uniform(
+        self,
+        node: str,
+        purpose: str,
+        block_size: int = DEFAULT_BLOCK_SIZE,
+    ) -> VariateStream:
+        return VariateStream(
+            rng=self.generator(node, purpose),
+            draw=_uniform,
+            block_size=block_size,
+        )
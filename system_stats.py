@@ -1,3 +1,274 @@
+import math
+import numpy as np
+import simpy as sp
+from prettytable import PrettyTable
+from statistics import NormalDist
+from typing import List, Optional
+from analysis import mmc_metrics
+from sketches import QuantileSketch, SampleQuantiles
+
+# non-overlapping batches behind the steady-state confidence intervals
+BATCHES = 20
+
+# columns reported per node, in the order of list_stats
+STAT_COLUMNS = [
+    "arrival_rate", "service_rate", "utilization", "avg_products_in_node",
+    "avg_products_in_queue", "no_processed", "no_remaining", "no_balked",
+    "measured_utilization", "measured_avg_in_node", "measured_avg_in_queue",
+]
+
+
+def student_t_quantile(p: float, df: int) -> float:
+    """
+    Quantile of Student's t distribution, exact for df <= 2 and from the
+    Cornish-Fisher expansion otherwise (within 0.2% for df >= 3)
+    """
+    if df < 1:
+        return math.nan
+    if df == 1:
+        return math.tan(math.pi * (p - 0.5))
+    if df == 2:
+        return (2 * p - 1) / math.sqrt(2 * p * (1 - p))
+    z = NormalDist().inv_cdf(p)
+    return (z
+            + (z ** 3 + z) / (4 * df)
+            + (5 * z ** 5 + 16 * z ** 3 + 3 * z) / (96 * df ** 2)
+            + (3 * z ** 7 + 19 * z ** 5 + 17 * z ** 3 - 15 * z) / (384 * df ** 3)
+            + (79 * z ** 9 + 776 * z ** 7 + 1482 * z ** 5 - 1920 * z ** 3 - 945 * z) / (92160 * df ** 4))
+
+
+def confidence_interval(values, confidence: float = 0.95) -> tuple[float, float, float]:
+    """
+    Mean, sample standard deviation and CI half width of independent values
+    """
+    values = np.asarray(values, dtype=float)
+    n = len(values)
+    if n == 0:
+        return math.nan, math.nan, math.nan
+    mean = float(values.mean())
+    if n == 1 or not np.all(np.isfinite(values)):
+        # e.g. the analytic L of an unstable node, infinite in every replication
+        return mean, math.nan, math.nan
+    std = float(values.std(ddof=1))
+    half_width = student_t_quantile(0.5 + confidence / 2, n - 1) * std / math.sqrt(n)
+    return mean, std, half_width
+
+
+def aggregate(summaries: list[dict], confidence: float = 0.95) -> dict:
+    """
+    Across-replication mean, std and CI of every node and system column
+    """
+    def interval(values) -> dict:
+        mean, std, half_width = confidence_interval(values, confidence)
+        return {
+            "mean": mean,
+            "std": std,
+            "ci_low": mean - half_width,
+            "ci_high": mean + half_width,
+        }
+
+    first = summaries[0]
+    result = {"replications": len(summaries), "confidence": confidence,
+              "nodes": {}, "system": {}}
+    for node, columns in first["nodes"].items():
+        result["nodes"][node] = {
+            column: interval([s["nodes"][node][column] for s in summaries])
+            for column in columns
+        }
+    for column in first["system"]:
+        result["system"][column] = interval(
+            [s["system"][column] for s in summaries])
+    return result
+
+
+def print_result(result: dict):
+    print(
+        f"------------------------\nReplications = {result['replications']}, "
+        f"confidence = {result['confidence']}\n------------------------")
+    tb = PrettyTable(["node_name", "column", "mean", "std", "ci_low", "ci_high"])
+    for node, columns in result["nodes"].items():
+        for column, v in columns.items():
+            tb.add_row([node, column, round(v["mean"], 4), round(v["std"], 4),
+                        round(v["ci_low"], 4), round(v["ci_high"], 4)])
+    for column, v in result["system"].items():
+        tb.add_row(["system", column, round(v["mean"], 4), round(v["std"], 4),
+                    round(v["ci_low"], 4), round(v["ci_high"], 4)])
+    tb.align["node_name"] = "l"
+    tb.align["column"] = "l"
+    print(tb)
+
+
+def mser_truncation(means) -> int:
+    """
+    Number of leading batch means to drop as warm-up: the d <= m / 2 that
+    minimizes MSER(d) = sum((Z_i - mean(Z[d:]))^2 for i >= d) / (m - d)^2
+    """
+    means = np.asarray(means, dtype=float)
+    m = len(means)
+    if m < 2:
+        return 0
+    # suffix sums over means[d:] for every d
+    s1 = np.cumsum(means[::-1])[::-1]
+    s2 = np.cumsum(means[::-1] ** 2)[::-1]
+    remaining = np.arange(m, 0, -1)
+    mser = (s2 - s1 ** 2 / remaining) / remaining ** 2
+    return int(np.argmin(mser[:m // 2 + 1]))
+
+
+class BatchMeans:
+    """
+    Means of consecutive batches of observations, for MSER-5 warm-up
+    truncation and batch-means confidence intervals. At most max_batches
+    means are kept: when full, neighbours merge and the batch size doubles
+    """
+
+    def __init__(self, batch_size: int = 5, max_batches: int = 1024) -> None:
+        self.batch_size = batch_size
+        self.max_batches = max_batches
+        self.means: list[float] = []
+        self.partial_sum: float = 0.0
+        self.partial_count: int = 0
+        self.count: int = 0
+
+    @classmethod
+    def from_values(cls, values, batch_size: int = 5, max_batches: int = 1024) -> "BatchMeans":
+        """
+        Same state as adding the values one by one, for the array engines
+        """
+        values = np.asarray(values, dtype=float)
+        while len(values) // batch_size >= max_batches:
+            batch_size *= 2
+        batches = cls(batch_size=batch_size, max_batches=max_batches)
+        complete = len(values) // batch_size * batch_size
+        batches.means = values[:complete].reshape(-1, batch_size).mean(axis=1).tolist()
+        batches.partial_sum = float(values[complete:].sum())
+        batches.partial_count = len(values) - complete
+        batches.count = len(values)
+        return batches
+
+    def add(self, x: float):
+        self.count += 1
+        self.partial_sum += x
+        self.partial_count += 1
+        if self.partial_count == self.batch_size:
+            self.means.append(self.partial_sum / self.batch_size)
+            self.partial_sum = 0.0
+            self.partial_count = 0
+            if len(self.means) == self.max_batches:
+                means = self.means
+                self.means = [(means[i] + means[i + 1]) / 2
+                              for i in range(0, len(means) - 1, 2)]
+                self.batch_size *= 2
+
+    def warmup(self) -> int:
+        """
+        Observations MSER drops as warm-up
+        """
+        return mser_truncation(self.means) * self.batch_size
+
+    def estimate(self, confidence: float = 0.95, batches: int = BATCHES) -> tuple[float, float]:
+        """
+        Steady-state mean and CI half width from `batches` non-overlapping
+        batches after the warm-up, NaN while there are too few batch means
+        """
+        means = np.asarray(self.means)
+        means = means[mser_truncation(means):]
+        size = len(means) // batches
+        if size == 0:
+            return math.nan, math.nan
+        grouped = means[len(means) - size * batches:].reshape(batches, size).mean(axis=1)
+        mean, _, half_width = confidence_interval(grouped, confidence)
+        return mean, half_width
+
+    def relative_half_width(self, confidence: float = 0.95) -> float:
+        mean, half_width = self.estimate(confidence)
+        if half_width == 0:
+            return 0.0
+        if mean == 0:
+            return math.inf
+        return half_width / abs(mean)
+
+    def summary(self, prefix: str, scale: float = 1.0, confidence: float = 0.95) -> dict:
+        """
+        Steady-state mean, half width and warm-up as flat prefix keys
+        """
+        mean, half_width = self.estimate(confidence)
+        return {
+            f"steady_{prefix}_mean": mean / scale,
+            f"steady_{prefix}_half_width": half_width / scale,
+            f"{prefix}_warmup": self.warmup(),
+        }
+
+
+def precision_reached(stats: list["SystemStatistics"], relative_half_width: float,
+                      confidence: float = 0.95) -> bool:
+    """
+    Stopping rule: every node's steady-state mean wait is known to within
+    relative_half_width of itself
+    """
+    return all(s.wait_batches.relative_half_width(confidence) <= relative_half_width
+               for s in stats)
+
+
+class SampledSeries:
+    """
+    Fixed-resolution samples of a piecewise-constant quantity, written into a
+    preallocated buffer when the quantity changes instead of by polling
+    """
+
+    def __init__(self, resolution: float, duration: float) -> None:
+        self.resolution = resolution
+        self.values = np.zeros(int(duration / resolution) + 1)
+        self.next_index = 0
+
+    def record(self, now: float, value: float):
+        # every sample taken before now saw the previous value
+        end = min(math.ceil(now / self.resolution), len(self.values))
+        if end > self.next_index:
+            self.values[self.next_index:end] = value
+            self.next_index = end
+
+    def flush(self, now: float, value: float):
+        # samples up to and including now see the current value
+        self.record(now, value)
+        end = min(math.floor(now / self.resolution) + 1, len(self.values))
+        if end > self.next_index:
+            self.values[self.next_index:end] = value
+            self.next_index = end
+
+    def times(self) -> np.ndarray:
+        return np.arange(len(self.values)) * self.resolution
+
+
+class TimeWeightedStatistic:
+    """
+    Time average of a piecewise-constant quantity, accumulated on change
+    """
+
+    def __init__(self, series: Optional[SampledSeries] = None) -> None:
+        self.value: float = 0.0
+        self.start_time: float = 0.0
+        self.last_time: float = 0.0
+        self.area: float = 0.0
+        self.series = series
+
+    def update(self, now: float, value: float):
+        if self.series is not None:
+            self.series.record(now, self.value)
+        self.area += self.value * (now - self.last_time)
+        self.last_time = now
+        self.value = value
+
+    def add(self, now: float, delta: float):
+        self.update(now, self.value + delta)
+
+    def mean(self, now: float) -> float:
+        elapsed = now - self.start_time
+        if elapsed <= 0:
+            return 0.0
+        return (self.area + self.value * (now - self.last_time)) / elapsed
+
+
 class SystemStatistics:
     def __init__(self, system_name: str) -> None:
         self.system_name = system_name
@@ -15,6 +286,17 @@ class SystemStatistics:
         self.utilization: float = 0.0
         self.total_product_count: int = 0
         self.in_queue_at_end: int = 0
+        self.total_balked: int = 0
+
+        # time-weighted state, updated on arrival, service start and departure
+        self.queue_length = TimeWeightedStatistic()
+        self.busy_servers = TimeWeightedStatistic()
+        self.in_system = TimeWeightedStatistic()
+        self.max_servers: int = 0
+        self.end_time: float = 0.0
+        # waits of the products that started service
+        self.wait_quantiles = QuantileSketch()
+        self.wait_batches = BatchMeans()
         pass
 
     def __str__(self) -> str:
@@ -58,26 +340,109 @@ class SystemStatistics:
         self.total_product_count += 1
         return
 
+    def sample(self, resolution: float, duration: float):
+        """
+        Also keep sampled queue length and busy servers series
+        """
+        self.queue_length.series = SampledSeries(resolution, duration)
+        self.busy_servers.series = SampledSeries(resolution, duration)
+
+    def record_arrival(self, now: float):
+        self.queue_length.add(now, 1)
+        self.in_system.add(now, 1)
+
+    def record_service_start(self, now: float, products: int = 1):
+        # a batch of products takes one server
+        self.queue_length.add(now, -products)
+        self.busy_servers.add(now, 1)
+
+    def record_departure(self, now: float, products: int = 1):
+        self.busy_servers.add(now, -1)
+        self.in_system.add(now, -products)
+
+    def close(self, now: float):
+        self.end_time = now
+        for stat in (self.queue_length, self.busy_servers, self.in_system):
+            stat.update(now, stat.value)
+            if stat.series is not None:
+                stat.series.flush(now, stat.value)
+
+    def measured_avg_in_sys(self) -> float:
+        return self.in_system.mean(self.end_time)
+
+    def measured_avg_in_queue(self) -> float:
+        return self.queue_length.mean(self.end_time)
+
+    def measured_utilization(self) -> float:
+        if self.max_servers == 0:
+            return 0.0
+        return self.busy_servers.mean(self.end_time) / self.max_servers
+
+    def update_balked(self):
+        self.total_balked += 1
+        return
+
     def update_wait_time(self, wait_time: float):
         self.total_wait_time += wait_time
         return
 
+    def record_wait(self, wait_time: float):
+        """
+        Wait of a product starting service, also kept in wait_quantiles
+        """
+        self.total_wait_time += wait_time
+        self.wait_quantiles.update(wait_time)
+        self.wait_batches.add(wait_time)
+
     def update_utilization(self, max_servers: int):
+        self.max_servers = max_servers
+        if self.service_rate() == 0:
+            # no service completed, e.g. a rarely visited node in a short run
+            self.utilization = math.nan
+            return
         self.utilization = self.arrival_rate() / (max_servers * self.service_rate())
         return
     
+    def _mmc(self) -> dict:
+        # M/M/c with the measured rates, not M/M/1, since nodes have several servers
+        if self.service_rate() == 0:
+            return {"rho": math.nan, "p_wait": math.nan, "L": math.nan,
+                    "Lq": math.nan, "W": math.nan, "Wq": math.nan}
+        return mmc_metrics(self.arrival_rate(), self.service_rate(), self.max_servers)
+
     def get_avg_in_sys(self):
-        return self.utilization / (1 - self.utilization)
+        return self._mmc()["L"]
     
     def get_avg_in_queue(self):
-        return  self.utilization / (1 - self.utilization) - self.utilization
+        return self._mmc()["Lq"]
     
     def arrival_rate(self) -> float:
+        if self.avg_interarrival_time() == 0:
+            return 0.0
         return 3600 / self.avg_interarrival_time()
     
     def service_rate(self) -> float:
+        if self.avg_service_time() == 0:
+            return 0.0
         return 3600 / self.avg_service_time()
 
+    def summary(self) -> dict:
+        """
+        Unrounded values of STAT_COLUMNS, then the wait quantiles and the
+        steady-state mean wait in hours
+        """
+        values = [
+            self.arrival_rate(), self.service_rate(), self.utilization,
+            self.get_avg_in_sys(), self.get_avg_in_queue(),
+            self.total_product_count, self.in_queue_at_end, self.total_balked,
+            self.measured_utilization(), self.measured_avg_in_sys(),
+            self.measured_avg_in_queue(),
+        ]
+        res = dict(zip(STAT_COLUMNS, values))
+        res.update(sketch_summary("wait", self.wait_quantiles, scale=3600))
+        res.update(self.wait_batches.summary("wait", scale=3600))
+        return res
+
     def list_stats(self) -> list:
         stats = []
         stats.append(self.system_name)
@@ -88,4 +453,225 @@ class SystemStatistics:
         stats.append(round(self.get_avg_in_queue(), 4))
         stats.append(self.total_product_count)
         stats.append(self.in_queue_at_end)
-        return stats
\ No newline at end of file
+        stats.append(self.total_balked)
+        stats.append(round(self.measured_utilization(), 4))
+        stats.append(round(self.measured_avg_in_sys(), 4))
+        stats.append(round(self.measured_avg_in_queue(), 4))
+        return stats
+
+
+def sketch_summary(prefix: str, sketch: QuantileSketch, scale: float = 1.0) -> dict:
+    """
+    Mean, quantiles and max of a sketch as flat prefix_* keys
+    """
+    summary = sketch.summary(scale=scale)
+    del summary["count"]
+    return {f"{prefix}_{key}": value for key, value in summary.items()}
+
+
+class SojournStatistics:
+    """
+    Time in system, total wait and number of node visits of the products
+    leaving the factory, kept in constant-memory quantile sketches
+    """
+
+    def __init__(self) -> None:
+        self.sojourn = QuantileSketch()
+        self.wait = QuantileSketch()
+        self.hops = QuantileSketch()
+        self.sojourn_batches = BatchMeans()
+
+    @classmethod
+    def from_samples(cls, sojourn, wait, hops) -> "SojournStatistics":
+        """
+        Exact quantiles of complete samples in exit order, from the array
+        engines
+        """
+        stats = cls()
+        stats.sojourn_batches = BatchMeans.from_values(sojourn)
+        stats.sojourn = SampleQuantiles(sojourn)
+        stats.wait = SampleQuantiles(wait)
+        stats.hops = SampleQuantiles(hops)
+        return stats
+
+    def record_exit(self, product, now: float):
+        self.sojourn.update(now - product.arrival_time)
+        self.wait.update(product.total_wait)
+        self.hops.update(product.visits)
+        self.sojourn_batches.add(now - product.arrival_time)
+
+    def summary(self) -> dict:
+        """
+        Exit count, sojourn and wait quantiles in hours, hop quantiles and
+        the steady-state mean sojourn in hours
+        """
+        res = {"no_exited": self.sojourn.count}
+        res.update(sketch_summary("sojourn", self.sojourn, scale=3600))
+        res.update(sketch_summary("sojourn_wait", self.wait, scale=3600))
+        res.update(sketch_summary("hops", self.hops))
+        res.update(self.sojourn_batches.summary("sojourn", scale=3600))
+        return res
+
+
+class GeneratorStatistics:
+    def __init__(self, env: sp.Environment) -> None:
+        self.env = env
+
+        self.total_generated: int = 0
+        self.total_interarrival_time: float = 0.0
+        self.theoretical_arrival_rate: float = 0.0
+
+    def add_total_generated(self):
+        self.total_generated += 1
+
+    def avg_interarrival_time(self) -> float:
+        if self.total_generated == 0:
+            return 0.0
+        return self.total_interarrival_time / self.total_generated
+    
+    def arrival_rate(self) -> float:
+        return 3600 / self.avg_interarrival_time()
+
+    def update_interarrival_time(self, last_time: float):
+        self.total_interarrival_time += last_time
+        
+    def get_theoretical(self, mean_interarrival_time: float) -> float:
+        self.theoretical_arrival_rate = 3600 / mean_interarrival_time
+        return
+
+    def list_stats(self) -> List:
+        return [self.total_generated, round(self.avg_interarrival_time(), 4)]
+
+    def __str__(self) -> str:
+        return f"""total_generated: {self.total_generated}
+arrival_rate (actual / theory / diff): {str(round(self.arrival_rate(), 4)) + " / " + str(round(self.theoretical_arrival_rate, 4)) + " / " + str(abs(round(self.arrival_rate() - self.theoretical_arrival_rate, 4)))}
+"""
+
+
+class FactoryReport:
+    """
+    Reporting shared by the simulation engines, which provide systems(),
+    generator_stats(), sojourn_stats() and sim_time, and windows when the
+    workload has shifts
+    """
+
+    # snapshots.WindowStatistics of the run, None without shift windows
+    windows = None
+
+    def system_summary(self) -> dict:
+        avg_products_in_sys = 0.0
+        measured_avg_products_in_sys = 0.0
+        for r in self.systems():
+            avg_products_in_sys += r.get_stats().get_avg_in_sys()
+            measured_avg_products_in_sys += r.get_stats().measured_avg_in_sys()
+        arrival_rate = self.generator_stats().arrival_rate()
+        return {
+            "avg_products_in_sys": avg_products_in_sys,
+            "avg_sys_response_time": avg_products_in_sys / arrival_rate,
+            "measured_avg_products_in_sys": measured_avg_products_in_sys,
+            "measured_avg_sys_response_time": measured_avg_products_in_sys / arrival_rate,
+        }
+
+    def summary(self) -> dict:
+        """
+        Compact, picklable results of a finished run
+        """
+        generator_stats = self.generator_stats()
+        system = self.system_summary()
+        system.update(self.sojourn_stats().summary())
+        res = {
+            "nodes": {r.get_name(): r.get_stats().summary() for r in self.systems()},
+            "system": system,
+            "generator": {
+                "total_generated": generator_stats.total_generated,
+                "arrival_rate": generator_stats.arrival_rate(),
+            },
+        }
+        if self.windows is not None:
+            res["windows"] = self.windows.summary()
+        return res
+
+    def stats(self):
+        print(
+            f"------------------------\nSimulation duration = {self.sim_time}\n------------------------")
+        tb = PrettyTable(["node_name"] + STAT_COLUMNS)
+        
+        for r in self.systems():
+            tb.add_row(r.get_stats().list_stats())
+        tb.align["system_name"] = "l"
+
+        print(tb)
+        
+        for name, value in self.system_summary().items():
+            print(f"{name} = {round(value, 4)}")
+
+        self.quantile_stats()
+        self.steady_state_stats()
+        if self.windows is not None:
+            self.window_stats()
+        
+        print(
+            f"------------------------\nGenerator statistics\n------------------------")
+        print(self.generator_stats())
+
+    def quantile_stats(self):
+        sojourn = self.sojourn_stats()
+        print(
+            f"------------------------\nSojourn and wait quantiles (hours, hops in visits)\n------------------------")
+        rows = [("end_to_end sojourn", sojourn.sojourn, 3600),
+                ("end_to_end wait", sojourn.wait, 3600),
+                ("end_to_end hops", sojourn.hops, 1)]
+        rows += [(f"{r.get_name()} wait", r.get_stats().wait_quantiles, 3600)
+                 for r in self.systems()]
+        columns = list(sojourn.sojourn.summary())
+        tb = PrettyTable(["quantity"] + columns)
+        for name, sketch, scale in rows:
+            summary = sketch.summary(scale=scale)
+            tb.add_row([name, summary["count"]]
+                       + [round(summary[c], 4) for c in columns[1:]])
+        tb.align["quantity"] = "l"
+        print(tb)
+
+    def steady_state_stats(self, confidence: float = 0.95):
+        print(
+            f"------------------------\nSteady state after MSER warm-up, {BATCHES} batch means, "
+            f"{confidence} CI (hours)\n------------------------")
+        rows = [("end_to_end sojourn", self.sojourn_stats().sojourn_batches)]
+        rows += [(f"{r.get_name()} wait", r.get_stats().wait_batches)
+                 for r in self.systems()]
+        tb = PrettyTable(["quantity", "observations", "warmup", "mean",
+                          "half_width", "relative_half_width"])
+        for name, batches in rows:
+            mean, half_width = batches.estimate(confidence)
+            tb.add_row([name, batches.count, batches.warmup(), round(mean / 3600, 4),
+                        round(half_width / 3600, 4),
+                        round(batches.relative_half_width(confidence), 4)])
+        tb.align["quantity"] = "l"
+        print(tb)
+
+    def window_stats(self):
+        summary = self.windows.summary()
+        print(
+            f"------------------------\nPer shift, pooled over days, peak of the worst day "
+            f"(rates per hour, waits in hours)\n------------------------")
+        columns = ["arrival_rate", "utilization", "avg_products_in_node",
+                   "avg_products_in_queue", "avg_wait_time", "peak_utilization", "peak_wait_time"]
+        tb = PrettyTable(["shift", "node_name"] + columns)
+        for label, nodes in summary["shifts"].items():
+            for name, metrics in nodes.items():
+                tb.add_row([label, name] + [_rounded(metrics[c]) for c in columns])
+        tb.align["node_name"] = "l"
+        print(tb)
+
+        print(f"------------------------\nUtilization per day\n------------------------")
+        names = [r.get_name() for r in self.systems()]
+        tb = PrettyTable(["day", "arrival_rate"] + names)
+        for day, nodes in summary["days"].items():
+            tb.add_row([day, _rounded(nodes[names[0]]["arrival_rate"])]
+                       + [_rounded(nodes[name]["utilization"]) for name in names])
+        print(tb)
+
+
+def _rounded(value):
+    # windows without service starts have no mean wait
+    return "-" if value is None else round(value, 4)
@@ -1,9 +1,9 @@
 import simpy as sp
-import numpy as np
 from product import Product
 from params import ServerParams, SystemParams
 from servers import ProductionLineServer, DispatcherServer, QACheckServer
 from base_systems import System, SystemScheduleResult
+from streams import RandomStreams
 
 
 class Destination:
@@ -25,57 +25,54 @@ class ProductionLine(System):
             env: sp.Environment,
             params: SystemParams,
             server_params: ServerParams,
+            streams: RandomStreams,
             qa_check: list[Destination]) -> None:
-        self.qa_check_destinations = qa_check
-        self.probabilties = []
-        for destination in self.qa_check_destinations:
-            self.probabilties.append(destination.probability)
-        super().__init__(env, params=params, server_params=server_params)
+        super().__init__(env, params=params, server_params=server_params, streams=streams)
+        # one server object per system, it holds no per-product state
+        self.server = ProductionLineServer(
+            env=self.env,
+            params=self.server_params,
+            stream=self.service_stream,
+        )
+        self.set_destinations(destinations=qa_check)
 
     def schedule(self):
         while True:
-            res, product, req = self.request_server()
+            res, product = self.request_server()
             match res:
                 case SystemScheduleResult.FOUND_PRODUCT:
-                    server = ProductionLineServer(
-                        env=self.env,
-                        params=self.server_params,
-                    )
-                    yield req
-                    self.env.process(self.serve(
-                        product=product, req=req, server=server))
-                    self._move_to_next_production_line(product=product)
+                    self._start(self.serve(
+                        product=product, server=self.server), "serve")
+                case SystemScheduleResult.FOUND_BATCH:
+                    self._start(self.serve_batch(
+                        products=product, server=self.server), "serve")
                 case _:
-                    if self.is_active():
-                        yield from self.go_active()
-                    else:
-                        yield from self.go_idle()
+                    yield from self.wait_for_work()
 
     def _move_to_next_production_line(self, product: Product):
         # a production line either moves the product to the end, or another QA line
-        if len(self.qa_check_destinations) == 0:
+        if len(self.router) == 0:
             # print(
             #     f"t = {self.env.now}, ProductionLine line = {self.get_name()} MOVE_TO_CHECK_LINE product = {product.get_name()} STRAIGHT TO EXIT")
+            self._exit(product)
             return
 
-        probabilities = self.probabilties
-        next_lines = np.random.choice(
-            self.qa_check_destinations, 1, p=probabilities)
-        next_line = next_lines[0]
+        next_line = self.router.choose()
 
-        # if got destination of exit, do nothing
+        # if got destination of exit, the product leaves the factory
         if next_line.name == "exit":
             # print(
             #     f"t = {self.env.now}, ProductionLine line = {self.get_name()} MOVE_TO_CHECK_LINE product = {product.get_name()} EXIT probability = {next_line.probability}")
+            self._exit(product)
             return
 
-        next_line.system.add_product(product=product)
+        yield from self.send_to(system=next_line.system, product=product)
         # print(
         #     f"t = {self.env.now}, ProductionLine line = {self.get_name()} MOVE_TO_CHECK_LINE product = {product.get_name()} qa_check={next_line.name} probability = {next_line.probability}")
 
     def run(self):
         super().run()
-        self.env.process(self.schedule())
+        self._start(self.schedule(), "schedule")
 
 
 class Dispatcher(System):
@@ -84,44 +81,39 @@ class Dispatcher(System):
             env: sp.Environment,
             params: SystemParams,
             server_params: ServerParams,
+            streams: RandomStreams,
             production_lines: list[Destination]) -> None:
-        self.production_lines = production_lines
-        self.line_probabilities = []
-        for line in production_lines:
-            self.line_probabilities.append(line.probability)
-
-        super().__init__(env, params, server_params)
+        super().__init__(env, params, server_params, streams)
+        # one server object per system, it holds no per-product state
+        self.server = DispatcherServer(
+            env=self.env,
+            params=self.server_params,
+            stream=self.service_stream,
+        )
+        self.set_destinations(destinations=production_lines)
 
     def schedule(self):
         while True:
-            res, product, req = self.request_server()
+            res, product = self.request_server()
             match res:
                 case SystemScheduleResult.FOUND_PRODUCT:
-                    server = DispatcherServer(
-                        env=self.env,
-                        params=self.server_params,
-                    )
-                    yield req
-                    self.env.process(self.serve(
-                        product=product, req=req, server=server))
-                    self._move_to_next_production_line(product=product)
+                    self._start(self.serve(
+                        product=product, server=self.server), "serve")
+                case SystemScheduleResult.FOUND_BATCH:
+                    self._start(self.serve_batch(
+                        products=product, server=self.server), "serve")
                 case _:
-                    if self.is_active():
-                        yield from self.go_active()
-                    else:
-                        yield from self.go_idle()
+                    yield from self.wait_for_work()
 
     def _move_to_next_production_line(self, product: Product):
 
-        if (self.production_lines is None) or (len(self.production_lines) == 0):
+        if len(self.router) == 0:
             print(f"Dispatcher have no production lines, this must not happens")
             exit(10)
         else:
-            next_lines = np.random.choice(
-                self.production_lines, 1, p=self.line_probabilities)
-            next_line = next_lines[0]
+            next_line = self.router.choose()
 
-            next_line.system.add_product(product=product)
+            yield from self.send_to(system=next_line.system, product=product)
             # print(
             #     f"t = {self.env.now}, Dispatcher MOVE_TO_PRODUCTION_LINE line = {next_line.name} probability = {next_line.probability} product = {product.get_name()}")
 
@@ -129,7 +121,7 @@ class Dispatcher(System):
 
     def run(self):
         super().run()
-        self.env.process(self.schedule())
+        self._start(self.schedule(), "schedule")
 
 
 class QACheck(System):
@@ -138,62 +130,54 @@ class QACheck(System):
             env: sp.Environment,
             params: SystemParams,
             server_params: ServerParams,
+            streams: RandomStreams,
             go_to: list[Destination]) -> None:
-        self.production_lines_destinations = go_to
-        self.probabilities = []
-        for line in self.production_lines_destinations:
-            self.probabilities.append(line.probability)
-        super().__init__(env, params, server_params)
+        super().__init__(env, params, server_params, streams)
+        # one server object per system, it holds no per-product state
+        self.server = QACheckServer(
+            env=self.env,
+            params=self.server_params,
+            stream=self.service_stream,
+        )
+        self.set_destinations(destinations=go_to)
 
     def set_production_lines(self, production_lines: list[ProductionLine]):
         self.production_lines = production_lines
         return self
 
-    def set_product_lines_destinations(self, destinations: list[Destination]):
-        self.production_lines_destinations = destinations
-        self.probabilities = []
-        for line in self.production_lines_destinations:
-            self.probabilities.append(line.probability)
-
     def schedule(self):
         while True:
-            res, product, req = self.request_server()
+            res, product = self.request_server()
             match res:
                 case SystemScheduleResult.FOUND_PRODUCT:
-                    server = QACheckServer(
-                        env=self.env,
-                        params=self.server_params,
-                    )
-                    yield req
-                    self.env.process(self.serve(
-                        product=product, req=req, server=server))
-                    self._move_to_next_production_line(product=product)
+                    self._start(self.serve(
+                        product=product, server=self.server), "serve")
+                case SystemScheduleResult.FOUND_BATCH:
+                    self._start(self.serve_batch(
+                        products=product, server=self.server), "serve")
                 case _:
-                    if self.is_active():
-                        yield from self.go_active()
-                    else:
-                        yield from self.go_idle()
+                    yield from self.wait_for_work()
 
     def _move_to_next_production_line(self, product: Product):
-        if len(self.production_lines_destinations) == 0:
+        if len(self.router) == 0:
             # print(
             #     f"t = {self.env.now}, QACheck check = {self.get_name()} MOVE_TO_PRODUCTION_LINE product = {product.get_name()} STRAIGHT TO EXIT")
+            self._exit(product)
             return
 
-        next_lines = np.random.choice(
-            self.production_lines_destinations, 1, p=self.probabilities)
-        next_line = next_lines[0]
+        next_line = self.router.choose()
 
-        # if got destination of exit, do nothing
+        # if got destination of exit, the product leaves the factory
         if next_line.name == "exit":
             # print(
             #     f"t = {self.env.now}, QACheck check = {self.get_name()} MOVE_TO_PRODUCTION_LINE product = {product.get_name()} EXIST probability = {next_line.probability}")
+            self._exit(product)
             return
 
-        next_line.system.add_product(product=product)
+        yield from self.send_to(system=next_line.system, product=product)
         # print(
         #     f"t = {self.env.now}, QACheck check = {self.get_name()} MOVE_TO_PRODUCTION_LINE product = {product.get_name()} production_line = {next_line.name} probability = {next_line.probability}")
 
     def run(self):
         super().run()
-        self.env.process(self.schedule())
\ No newline at end of file
+        self._start(self.schedule(), "schedule")
\ No newline at end of file
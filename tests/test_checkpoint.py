@@ -0,0 +1,83 @@
+import json
+import numpy as np
+import pytest
+import params as pr
+from native_engine import NativeFactory, ARRIVAL
+from params import RateProfileParams
+from streams import ProfileStream, RateProfile
+
+WORKLOAD = {
+    "simulation_time": 4 * 86400,
+    "generator": {
+        "mean_interarrival_time": 200,
+        "rate_profile": {"starts": [0, 21600, 50400], "factors": [0.4, 1.6, 1.0], "period": 86400},
+    },
+}
+
+
+def _arrivals(seed: int, reseed_at: float = None) -> int:
+    # arrivals in [20, 100) at rate 10, rate 0.1 from 100 on
+    profile = RateProfile(RateProfileParams(starts=[0.0, 100.0], factors=[10.0, 0.1]), 1.0)
+    stream = ProfileStream(np.random.default_rng(seed), profile, block_size=600)
+    time, count = 0.0, 0
+    while True:
+        time += stream.next()
+        if reseed_at is not None and time >= reseed_at:
+            stream.reseed(np.random.default_rng(seed + 1000))
+            reseed_at = None
+        if time >= 100:
+            return count
+        if time >= 20:
+            count += 1
+
+
+def test_profile_reseed_keeps_rate():
+    seeds = range(100)
+    kept = np.mean([_arrivals(seed) for seed in seeds])
+    branched = np.mean([_arrivals(seed, reseed_at=20) for seed in seeds])
+    assert abs(kept - 800) < 20
+    assert abs(branched - 800) < 20
+
+
+def test_branch_of_profile_checkpoint(tmp_path):
+    workload_path = tmp_path / "workload.json"
+    workload_path.write_text(json.dumps(WORKLOAD))
+    checkpoint_path = str(tmp_path / "run.pkl")
+    factory = NativeFactory(str(workload_path), "./config.json", seed=1,
+                            checkpoint=pr.CheckpointParams(path=checkpoint_path, interval=100000))
+    factory.sim_time = 100000
+    factory.open(verbose=False)
+
+    branch = NativeFactory.resume(checkpoint_path, seed=2, simulation_time=WORKLOAD["simulation_time"])
+    # the profile continues at the pending arrival, not past the dropped block
+    pending = min(event[0] for event in branch.calendar if event[2] == ARRIVAL)
+    assert branch.interarrival_stream.time == pending
+    branch.open(verbose=False)
+    assert branch.summary()["generator"]["total_generated"] > factory.summary()["generator"]["total_generated"]
+
+
+def test_branches_leave_the_source_checkpoint(tmp_path):
+    checkpoint_path = str(tmp_path / "run.pkl")
+    factory = NativeFactory("./workload/workload1.json", "./config.json", seed=1,
+                            checkpoint=pr.CheckpointParams(path=checkpoint_path, interval=50000))
+    factory.sim_time = 100000
+    factory.open(verbose=False)
+    with open(checkpoint_path, "rb") as f:
+        source = f.read()
+
+    summaries = []
+    for seed in (2, 2):
+        branch = NativeFactory.resume(checkpoint_path, seed=seed, simulation_time=300000)
+        branch.open(verbose=False)
+        summaries.append(branch.summary())
+        with open(checkpoint_path, "rb") as f:
+            assert f.read() == source
+    # both branches started from the same state
+    assert summaries[0] == summaries[1]
+
+    own = pr.CheckpointParams(path=str(tmp_path / "branch.pkl"), interval=50000)
+    branch = NativeFactory.resume(checkpoint_path, seed=3, simulation_time=300000, checkpoint=own)
+    branch.open(verbose=False)
+    assert NativeFactory.resume(own.path).now == 300000
+    with pytest.raises(ValueError):
+        NativeFactory.resume(checkpoint_path, checkpoint=pr.CheckpointParams(path=checkpoint_path))
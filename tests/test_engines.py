@@ -0,0 +1,53 @@
+import json
+import pytest
+from main import Factory
+from native_engine import NativeFactory
+
+WORKLOAD = {"simulation_time": 200000, "generator": {"mean_interarrival_time": 360}}
+
+
+def _flat(summary: dict, prefix: str = "") -> dict:
+    values = {}
+    for key, value in summary.items():
+        if isinstance(value, dict):
+            values.update(_flat(value, f"{prefix}{key}/"))
+        else:
+            values[f"{prefix}{key}"] = value
+    return values
+
+
+def _same_run(tmp_path, edit):
+    # the native engine draws the same variates as SimPy, so both give the
+    # same summary up to float rounding
+    with open("./config.json") as f:
+        dat = json.load(f)
+    edit(dat)
+    config_path, workload_path = tmp_path / "config.json", tmp_path / "workload.json"
+    config_path.write_text(json.dumps(dat))
+    workload_path.write_text(json.dumps(WORKLOAD))
+    simpy = Factory(str(workload_path), str(config_path), seed=1)
+    simpy.open(verbose=False)
+    native = NativeFactory(str(workload_path), str(config_path), seed=1)
+    native.open(verbose=False)
+    expected = _flat(simpy.summary())
+    assert _flat(native.summary()) == pytest.approx(expected, rel=1e-9, nan_ok=True)
+    return expected
+
+
+def test_jsq_routing(tmp_path):
+    summary = _same_run(tmp_path, lambda dat: dat["dispatcher"].update(routing={"policy": "jsq"}))
+    assert summary["nodes/production_line_a/no_processed"] > 0
+
+
+def test_batch_service(tmp_path):
+    def edit(dat):
+        dat["productionlines"][0].update(mean_service_time=2400, batch={"size": 3, "timeout": 600})
+    summary = _same_run(tmp_path, edit)
+    assert summary["nodes/production_line_a/no_processed"] > 0
+
+
+def test_blocking_queue(tmp_path):
+    def edit(dat):
+        dat["qa_check"][0]["queue"] = {"capacity": 1, "on_full": "block"}
+    summary = _same_run(tmp_path, edit)
+    assert summary["nodes/qa_check_a/no_balked"] == 0
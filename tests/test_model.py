@@ -0,0 +1,61 @@
+import copy
+import json
+import numpy as np
+import pytest
+from model import compile_model, check_files
+from routing import AliasTable
+
+with open("./config.json") as f:
+    CONFIG = json.load(f)
+WORKLOAD = {"simulation_time": 100000, "generator": {"mean_interarrival_time": 360}}
+
+
+def _problems(edit) -> list[str]:
+    dat = copy.deepcopy(CONFIG)
+    edit(dat)
+    return check_files(dat, WORKLOAD)
+
+
+def test_valid_files_have_no_problems():
+    assert check_files(CONFIG, WORKLOAD) == []
+    model = compile_model(CONFIG, WORKLOAD)
+    assert np.all(model.utilizations < 1)
+
+
+@pytest.mark.parametrize("edit, problem", [
+    (lambda dat: dat.pop("qa_check"), "missing \"qa_check\""),
+    (lambda dat: dat["dispatcher"].update(max_servers=0), "max_servers"),
+    (lambda dat: dat["dispatcher"].update(mean_service_time=-1), "mean_service_time"),
+    (lambda dat: dat["dispatcher"]["go_to"][0].update(probability=0.9), "dispatcher"),
+    (lambda dat: dat["dispatcher"].update(routing={"policy": "random"}), "unknown routing policy"),
+    (lambda dat: dat["dispatcher"].update(queue={"on_full": "drop"}), "unknown on_full policy"),
+    (lambda dat: dat["dispatcher"].update(batch={"size": 0}), "batch size"),
+])
+def test_problems_are_reported(edit, problem):
+    problems = _problems(edit)
+    assert any(problem in p for p in problems), problems
+    dat = copy.deepcopy(CONFIG)
+    edit(dat)
+    with pytest.raises(ValueError, match="invalid network"):
+        compile_model(dat, WORKLOAD)
+
+
+def test_unstable_network_needs_allow():
+    overloaded = {"simulation_time": 100000, "generator": {"mean_interarrival_time": 100}}
+    with pytest.raises(ValueError, match="unstable network"):
+        compile_model(CONFIG, overloaded)
+    model = compile_model(CONFIG, overloaded, require_stable=False)
+    assert "dispatcher" in model.unstable()[0]
+    # a bounded queue balks instead of growing
+    dat = copy.deepcopy(CONFIG)
+    for cfg in [dat["dispatcher"], *dat["productionlines"], *dat["qa_check"]]:
+        cfg["queue"] = {"capacity": 10}
+    assert compile_model(dat, overloaded).unstable() == []
+
+
+def test_alias_table_draws_the_probabilities():
+    probabilities = [0.5, 0.4, 0.1]
+    table = AliasTable(probabilities)
+    u = np.random.default_rng(1).random(200000)
+    counts = np.bincount(table.sample_array(u), minlength=3) / len(u)
+    assert np.allclose(counts, probabilities, atol=0.005)
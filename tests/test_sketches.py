@@ -0,0 +1,46 @@
+import numpy as np
+from sketches import QUANTILES, QuantileSketch
+
+
+def test_quantiles_close_and_ordered():
+    rng = np.random.default_rng(0)
+    values = rng.lognormal(0, 1.5, 50000)
+    sketch = QuantileSketch()
+    for x in values:
+        sketch.update(float(x))
+    estimates = [sketch.quantiles()[p] for p in QUANTILES]
+    assert estimates == sorted(estimates)
+    for estimate, exact in zip(estimates[:-1], np.quantile(values, QUANTILES[:-1])):
+        assert abs(estimate - exact) < 0.02 * exact
+
+
+def test_few_observations_use_the_sample():
+    sketch = QuantileSketch()
+    for x in (3.0, 1.0, 2.0):
+        sketch.update(x)
+    assert sketch.quantiles()[0.5] == 2.0
+    assert sketch.quantiles()[0.999] == 3.0
+
+
+def test_non_monotone_input():
+    # a descending run followed by an ascending one, then alternating extremes
+    values = np.concatenate([np.arange(5000, 0, -1), np.arange(1, 5001), np.tile([1.0, 5000.0], 2500)])
+    sketch = QuantileSketch()
+    for x in values:
+        sketch.update(float(x))
+    estimates = [sketch.quantiles()[p] for p in QUANTILES]
+    assert estimates == sorted(estimates)
+    assert 1.0 <= estimates[0] and estimates[-1] <= 5000.0
+    assert abs(estimates[0] - np.quantile(values, 0.5)) < 0.05 * 5000
+
+
+def test_below_five_observations():
+    sketch = QuantileSketch()
+    sketch.update(7.0)
+    assert all(value == 7.0 for value in sketch.quantiles().values())
+    for x in (4.0, 9.0, 1.0):
+        sketch.update(x)
+    estimates = [sketch.quantiles()[p] for p in QUANTILES]
+    assert estimates == sorted(estimates)
+    assert sketch.quantiles()[0.5] == 7.0
+    assert sketch.quantiles()[0.999] == 9.0